@@ -1,3 +1,6 @@
-from .bacanora import (download, upload, grant, isdir, isfile,
+from .bacanora import (download, upload, grant, stat, isdir, isfile,
                        exists, mkdir, delete)
-
+from .bulk import download_many, upload_many, delete_many, makedirs_many
+from .remotefile import open
+from .listing import listdir, scandir, walk
+from .tree import download_tree, upload_tree
@@ -6,5 +6,5 @@ from .reactors import send_message, await_actor_execution
 from .uri import to_agave_uri, from_tacc_s3_uri, from_agave_uri
 from .files import (agave_mkdir, agave_download_file,
                     agave_upload_file, wait_for_file_status,
-                    process_agave_httperror, exists, isdir, \
-                    isfile, delete)
+                    process_agave_httperror, describe, list_page, \
+                    iter_listing, exists, isdir, isfile, delete)
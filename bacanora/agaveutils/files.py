@@ -8,6 +8,11 @@ from random import random
 from agavepy.agave import Agave, AgaveError
 from requests.exceptions import HTTPError
 
+from .. import buffers
+from .. import circuitbreaker
+from .. import sessions
+from ..circuitbreaker import CircuitOpen
+
 PWD = os.getcwd()
 MAX_ELAPSED = 300
 MAX_RETRIES = 5
@@ -38,6 +43,8 @@ def get(agaveClient, agaveAbsolutePath, systemId, localFilename,
                                     systemId,
                                     localFilename)
             return f
+        except CircuitOpen:
+            raise
         except Exception:
             if attempt < retries:
                 attempt = attempt + 1
@@ -69,6 +76,8 @@ def mkdir(agaveClient, dirName, systemId, basePath='/',
                         systemId,
                         basePath)
             return True
+        except CircuitOpen:
+            raise
         except Exception:
             if attempt < retries:
                 attempt = attempt + 1
@@ -139,9 +148,13 @@ def agave_mkdir(agaveClient, dirName, systemId, basePath='/',
     nothing if all directories are already in place.
     """
     try:
-        agaveClient.files.manage(systemId=systemId,
-                                 body={'action': 'mkdir', 'path': dirName},
-                                 filePath=basePath)
+        sessions.attach(agaveClient)
+        with circuitbreaker.guard(circuitbreaker.FILES):
+            agaveClient.files.manage(systemId=systemId,
+                                     body={'action': 'mkdir', 'path': dirName},
+                                     filePath=basePath)
+    except CircuitOpen:
+        raise
     except HTTPError as h:
         http_err_resp = process_agave_httperror(h)
         raise Exception(http_err_resp)
@@ -167,8 +180,12 @@ def agave_download_file(agaveClient,
     downloadFileName = os.path.join(PWD, localFilename)
     with open(downloadFileName, 'wb') as f:
         try:
-            rsp = agaveClient.files.download(systemId=systemId,
-                                             filePath=agaveAbsolutePath)
+            sessions.attach(agaveClient)
+            with circuitbreaker.guard(circuitbreaker.FILES):
+                rsp = agaveClient.files.download(systemId=systemId,
+                                                 filePath=agaveAbsolutePath)
+        except CircuitOpen:
+            raise
         except HTTPError as h:
             http_err_resp = process_agave_httperror(h)
             raise Exception(http_err_resp)
@@ -179,9 +196,7 @@ def agave_download_file(agaveClient,
         if type(rsp) == dict:
             raise Exception(
                 "Failed to download {}".format(agaveAbsolutePath))
-        for block in rsp.iter_content(2048):
-            if not block:
-                break
+        for block in buffers.iter_response(rsp):
             f.write(block)
     return downloadFileName
 
@@ -205,9 +220,13 @@ def agave_upload_file(agaveClient,
     # that file, then do a mv operation at the end. Formally, its no differnt
     # for provenance than uploading in place.
     try:
-        agaveClient.files.importData(systemId=systemId,
-                                     filePath=agaveDestPath,
-                                     fileToUpload=open(uploadFile))
+        sessions.attach(agaveClient)
+        with circuitbreaker.guard(circuitbreaker.FILES):
+            agaveClient.files.importData(systemId=systemId,
+                                         filePath=agaveDestPath,
+                                         fileToUpload=open(uploadFile))
+    except CircuitOpen:
+        raise
     except HTTPError as h:
         http_err_resp = process_agave_httperror(h)
         raise Exception(http_err_resp)
@@ -253,11 +272,15 @@ def wait_for_file_status(agaveClient, agaveWatchPath,
 
     while (time.time() < expires):
         try:
-            hist = agaveClient.files.getHistory(systemId=systemId,
-                                                filePath=agaveWatchPath)
+            sessions.attach(agaveClient)
+            with circuitbreaker.guard(circuitbreaker.FILES):
+                hist = agaveClient.files.getHistory(systemId=systemId,
+                                                    filePath=agaveWatchPath)
             stat = hist[-1]['status']
             if stat in TERMINAL_STATES:
                 return True
+        except CircuitOpen:
+            raise
         except Exception:
             # we have to swallow this exception because status isn't available
             # until the files service picks up the task. sometimes that's
@@ -275,38 +298,91 @@ def wait_for_file_status(agaveClient, agaveWatchPath,
             agaveWatchPath, maxTime, stat))
 
 
-def exists(agaveClient, agaveAbsolutePath, systemId, formats=None):
-    """Check if a path exists on an Agave storage resource
+def describe(agaveClient, agaveAbsolutePath, systemId):
+    """Fetch the listing record for a path on an Agave storage resource
 
     Args:
         agaveAbsolutePath (str): An Agave absolute path
-        systemId (str, optional): The storage system against which to resolve the POSIX path
+        systemId (str): The storage system against which to resolve the path
 
     Raises:
-        AgaveHelperError: The function has failed due an API error
+        HTTPError: The function has failed due an API error
 
     Returns:
-        bool: Whether the path exists or not
+        dict: The files.list entry for the path, or None if it does not exist
     """
-    if formats is None:
-        formats = ('folder', 'raw')
     try:
-        path_format = agaveClient.files.list(
-            filePath=agaveAbsolutePath,
-            systemId=systemId,
-            limit=2)[0].get('format', None)
-        if path_format in formats:
-            return True
-        else:
-            return False
+        sessions.attach(agaveClient)
+        with circuitbreaker.guard(circuitbreaker.FILES):
+            return agaveClient.files.list(
+                filePath=agaveAbsolutePath,
+                systemId=systemId,
+                limit=2)[0]
     except HTTPError as herr:
         if herr.response.status_code == 404:
-            return False
+            return None
         else:
             raise HTTPError(herr)
     except Exception:
         raise
 
+
+def list_page(agaveClient, agaveAbsolutePath, systemId, limit, offset=0):
+    """Fetch one page of a directory listing
+
+    Args:
+        agaveAbsolutePath (str): An Agave absolute path
+        systemId (str): The storage system against which to resolve the path
+        limit (int): Maximum number of entries to return
+        offset (int): Number of entries to skip
+
+    Raises:
+        HTTPError: The function has failed due an API error
+
+    Returns:
+        list: files.list entries; a page shorter than ``limit`` is the last
+    """
+    sessions.attach(agaveClient)
+    with circuitbreaker.guard(circuitbreaker.FILES):
+        return agaveClient.files.list(filePath=agaveAbsolutePath,
+                                      systemId=systemId,
+                                      limit=limit, offset=offset)
+
+
+def iter_listing(agaveClient, agaveAbsolutePath, systemId, limit=250):
+    """Yield every files.list entry for a path, one page at a time"""
+    offset = 0
+    while True:
+        page = list_page(agaveClient, agaveAbsolutePath, systemId,
+                         limit, offset=offset)
+        for entry in page:
+            yield entry
+        if len(page) < limit:
+            return
+        offset += len(page)
+
+
+def exists(agaveClient, agaveAbsolutePath, systemId, formats=None):
+    """Check if a path exists on an Agave storage resource
+
+    Args:
+        agaveAbsolutePath (str): An Agave absolute path
+        systemId (str, optional): The storage system against which to resolve the POSIX path
+
+    Raises:
+        AgaveHelperError: The function has failed due an API error
+
+    Returns:
+        bool: Whether the path exists or not
+    """
+    if formats is None:
+        formats = ('folder', 'raw')
+    listing = describe(agaveClient, agaveAbsolutePath, systemId)
+    if listing is not None and listing.get('format', None) in formats:
+        return True
+    else:
+        return False
+
 def isfile(agaveClient, agaveAbsolutePath, systemId):
     return exists(agaveClient, agaveAbsolutePath, systemId, formats=['raw'])
 
@@ -315,7 +391,10 @@ def isdir(agaveClient, agaveAbsolutePath, systemId):
 
 def delete(agaveClient, agaveAbsolutePath, systemId):
     try:
-        agaveClient.files.delete(filePath=agaveAbsolutePath, systemId=systemId)
+        sessions.attach(agaveClient)
+        with circuitbreaker.guard(circuitbreaker.FILES):
+            agaveClient.files.delete(filePath=agaveAbsolutePath,
+                                     systemId=systemId)
     except HTTPError as herr:
         if herr.response.status_code == 404:
             return False
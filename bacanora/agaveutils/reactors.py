@@ -10,7 +10,10 @@ from tenacity import retry, retry_if_exception_type
 from tenacity import stop_after_delay
 from tenacity import wait_exponential
 
+from .. import circuitbreaker
 from .. import logger as loggermodule
+from .. import metrics
+from .. import sessions
 from .. import settings
 
 logger = loggermodule.get_logger(__name__)
@@ -25,11 +28,13 @@ class ExecutionNotComplete(AgaveError):
     pass
 
 
+@metrics.instrument
 @retry(
     retry=retry_if_exception_type(AgaveError),
     reraise=RETRY_RERAISE,
     stop=stop_after_delay(RETRY_MAX_DELAY),
-    wait=wait_exponential(multiplier=1, max=8))
+    wait=wait_exponential(multiplier=1, max=8),
+    before_sleep=metrics.retried)
 def send_message(agaveClient,
                  actorId,
                  message,
@@ -67,12 +72,15 @@ def send_message(agaveClient,
                 pass_envs[SPECIAL_VARS[env]] = os.environ.get(env)
 
     execution = {}
+    metrics.via(metrics.API)
     try:
-        execution = agaveClient.actors.sendMessage(
-            actorId=actorId,
-            body={'message': message},
-            environment=pass_envs,
-            **kwargs)
+        sessions.attach(agaveClient)
+        with circuitbreaker.guard(circuitbreaker.ACTORS):
+            execution = agaveClient.actors.sendMessage(
+                actorId=actorId,
+                body={'message': message},
+                environment=pass_envs,
+                **kwargs)
     except Exception:
         logger.exception('Failed to message {}'.format(actorId))
         if ignoreErrors is False:
@@ -89,18 +97,23 @@ def send_message(agaveClient,
             agaveClient, actorId=actorId, executionId=execId, **kwargs)
 
 
+@metrics.instrument
 @retry(
     retry=retry_if_exception_type(AgaveError),
     reraise=RETRY_RERAISE,
     stop=stop_after_delay(RETRY_MAX_DELAY),
-    wait=wait_exponential(multiplier=1, max=8))
+    wait=wait_exponential(multiplier=1, max=8),
+    before_sleep=metrics.retried)
 def await_actor_execution(agaveClient, actorId, executionId, **kwargs):
     # agaveClient.nonce form overrides explicit passing of 'nonce' in kwargs
     if getattr(agaveClient, 'nonce', None) is not None:
         kwargs['nonce'] = getattr(agaveClient, 'nonce')
+    metrics.via(metrics.API)
     try:
-        execution_resp = agaveClient.actors.getExecution(
-            actorId=actorId, executionId=executionId, **kwargs)
+        sessions.attach(agaveClient)
+        with circuitbreaker.guard(circuitbreaker.ACTORS):
+            execution_resp = agaveClient.actors.getExecution(
+                actorId=actorId, executionId=executionId, **kwargs)
         status = execution_resp.get('status', 'UNKNOWN')
         logger.debug('status: {}'.format(status))
         if status in ['COMPLETE', 'FAILED', 'ERROR']:
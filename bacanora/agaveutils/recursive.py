@@ -2,19 +2,28 @@
 import os
 import sys
 import logging
-from time import sleep
-from random import random
+import threading
+from queue import Queue
 
-__version__ = '0.1.0'
+from .. import circuitbreaker
+from .. import sessions
+from .. import settings
+from ..ratelimit import TokenBucket
+from .files import iter_listing
+
+__version__ = '0.2.0'
 
 FILES = True
 FORMAT = "%(asctime)s [%(levelname)s]: %(message)s"
 DATEFORMAT = "%Y-%m-%dT%H:%M:%SZ"
+PROGRESS_INTERVAL = 1000
+LIST_PAGE_SIZE = settings.FILES_LIST_PAGE_SIZE
 
 
 class PemAgent(object):
     """Specialized Agave class for doing recursive pem management"""
-    def __init__(self, agaveClient, loglevel='INFO'):
+    def __init__(self, agaveClient, loglevel='INFO', max_workers=None,
+                 rate=None):
         """
         Initialize a PemAgent object
 
@@ -23,11 +32,20 @@ class PemAgent(object):
 
         Keyword parameters:
         loglevel - Set the logging level. DEBUG is good for diagnosing issues.
+        max_workers - Number of concurrent listing/grant workers
+        rate - Maximum permission updates per second across all workers
 
         Returns:
         - PemAgent
         """
+        if max_workers is None:
+            max_workers = settings.MAX_WORKERS
+        if rate is None:
+            rate = settings.PEMS_RATE_LIMIT
         self.client = agaveClient
+        self.max_workers = max(1, max_workers)
+        self.ratelimit = TokenBucket(rate)
+        self.failures = []
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(loglevel)
         stderrLogger = logging.StreamHandler()
@@ -37,23 +55,94 @@ class PemAgent(object):
         self.version = __version__
 
     def grant(self, system, abspath, username='world',
-              pem='READ', recursive=False, permissive=True):
-        '''Recursively crawl abspath and grant pem'''
-        self.updatepem(system, abspath, username, pem, recursive)
-        dirs, files = self.listdir(system, abspath)[:2]
+              pem='READ', recursive=False, permissive=True, progress=None):
+        '''Recursively crawl abspath and grant pem
+
+        Directory listings and permission updates are spread over a pool
+        of workers sharing one rate limit. As before, a failure on one path
+        is logged and does not stop the walk or change the return value;
+        failed paths are recorded in self.failures and counted in the
+        progress snapshots. Only a failure to list abspath itself raises.
+
+        permissive - Kept for compatibility; per-path failures never raise
+        progress - Optional callable that receives a dict of counts
+        (granted, listed, failed) as the walk proceeds
+        '''
         self.logger.debug("grant {} to {} on path agave://{}{}".format(
             pem, username, system, abspath))
-        try:
-            self.walk(abspath, dirs, files, system, username, pem, recursive)
-        except Exception as e:
-            if permissive is True:
-                self.logger.error(
-                    "grant failed on agave://{}{} (error: {})".format(
-                        system, abspath, e))
-                return False
-            else:
-                raise Exception(e)
-                return False
+        self.failures = []
+        counts = {'granted': 0, 'listed': 0, 'failed': 0}
+        lock = threading.Lock()
+        tasks = Queue()
+        root_errors = []
+
+        def _tally(key, path=None, exc=None):
+            with lock:
+                counts[key] = counts[key] + 1
+                if exc is not None:
+                    self.failures.append((path, exc))
+                snapshot = dict(counts)
+            if key == 'granted' and snapshot['granted'] % PROGRESS_INTERVAL == 0:
+                self.logger.info("granted {granted}, listed {listed}, "
+                                 "failed {failed}".format(**snapshot))
+            if progress is not None:
+                try:
+                    progress(snapshot)
+                except Exception as e:
+                    self.logger.warning(
+                        "progress callback failed: {}".format(e))
+
+        def _worker():
+            while True:
+                task = tasks.get()
+                if task is None:
+                    tasks.task_done()
+                    return
+                action, path = task
+                try:
+                    if action == 'grant':
+                        self.updatepem(system, path, username, pem,
+                                       recursive, permissive=False)
+                        _tally('granted')
+                    else:
+                        dirs, files = self.listdir(system, path)[:2]
+                        if FILES:
+                            for name in files:
+                                tasks.put(('grant', os.path.join(path, name)))
+                        for name in dirs:
+                            dpath = os.path.join(path, name)
+                            tasks.put(('grant', dpath))
+                            tasks.put(('list', dpath))
+                        _tally('listed')
+                except Exception as e:
+                    self.logger.error(
+                        "{} failed on agave://{}{} (error: {})".format(
+                            action, system, path, e))
+                    if action == 'list' and path == abspath:
+                        root_errors.append(e)
+                    try:
+                        _tally('failed', path, e)
+                    except Exception:
+                        pass
+                finally:
+                    tasks.task_done()
+
+        tasks.put(('grant', abspath))
+        tasks.put(('list', abspath))
+        workers = [threading.Thread(target=_worker, daemon=True)
+                   for _ in range(self.max_workers)]
+        for worker in workers:
+            worker.start()
+        tasks.join()
+        for worker in workers:
+            tasks.put(None)
+        for worker in workers:
+            worker.join()
+
+        self.logger.info("granted {granted}, listed {listed}, "
+                         "failed {failed}".format(**counts))
+        if root_errors:
+            raise Exception(root_errors[0])
 
         return True
 
@@ -78,18 +167,18 @@ class PemAgent(object):
         '''Send an pems update request'''
 
         try:
-            self.client.files.updatePermissions(systemId=system,
-                                                filePath=fpath,
-                                                body={'username': username,
-                                                      'permission': pem,
-                                                      'recursive': rec})
-            # introduce pseudo-random delay between pems calls
-            sleep(0.5 * random())
+            self.ratelimit.consume()
+            sessions.attach(self.client)
+            with circuitbreaker.guard(circuitbreaker.PERMISSIONS):
+                self.client.files.updatePermissions(
+                    systemId=system, filePath=fpath,
+                    body={'username': username, 'permission': pem,
+                          'recursive': rec})
         except Exception as e:
             if permissive is True:
                 self.logger.error(
                     "updatepem failed on agave://{}{} (error: {})".format(
-                        sys, fpath, e))
+                        system, fpath, e))
                 return False
             else:
                 raise Exception(e)
@@ -105,8 +194,8 @@ class PemAgent(object):
     def listdir(self, system, fpath):
         dirs, files, links = [], [], []
         try:
-            for file_obj in self.client.files.list(systemId=system,
-                                                   filePath=fpath):
+            for file_obj in iter_listing(
+                    self.client, fpath, system, limit=LIST_PAGE_SIZE):
                     if file_obj['format'] == 'folder':
                         if file_obj['name'] != '.':
                             dirs.append(file_obj['name'])
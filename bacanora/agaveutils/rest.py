@@ -0,0 +1,131 @@
+"""
+Direct HTTP access to Agave files endpoints that AgavePy does not expose,
+such as ranged reads of the media endpoint
+"""
+from requests.utils import quote
+from agavepy.agave import AgaveError
+
+from .. import circuitbreaker
+from .. import sessions
+from .utils import get_api_server, get_api_token
+
+__all__ = ['api_server', 'auth', 'files_url', 'media_url', 'get_media',
+           'request', 'content_range']
+
+FILES_PREFIX = 'files/v2'
+
+
+def api_server(agaveClient):
+    '''Base URL of the API server for a client, without trailing slash'''
+    server = None
+    try:
+        server = get_api_server(agaveClient)
+    except Exception:
+        pass
+    if not server:
+        server = getattr(agaveClient, 'api_server', None)
+    if not server:
+        raise AgaveError('Unable to determine API server for client')
+    return str(server).rstrip('/')
+
+
+def auth(agaveClient):
+    '''Headers and query parameters that authenticate a raw request
+
+    Abaco nonces take precedence over bearer tokens, as they do for
+    AgavePy calls made by bacanora.
+    '''
+    nonce = getattr(agaveClient, 'nonce', None)
+    if nonce is not None:
+        return {}, {'x-nonce': nonce}
+    token = None
+    try:
+        token = get_api_token(agaveClient)
+    except Exception:
+        pass
+    if not token:
+        token = getattr(agaveClient, '_token', None)
+    if not token:
+        raise AgaveError('No access token or nonce available for client')
+    return {'Authorization': 'Bearer {}'.format(token)}, {}
+
+
+def files_url(agaveClient, collection, systemId, path):
+    '''URL of a files service resource such as media or listings'''
+    return '{}/{}/{}/system/{}/{}'.format(
+        api_server(agaveClient), FILES_PREFIX, collection, systemId,
+        quote(path.lstrip('/')))
+
+
+def media_url(agaveClient, systemId, path):
+    return files_url(agaveClient, 'media', systemId, path)
+
+
+def request(agaveClient, method, url, headers=None, params=None,
+            refresh=True, **kwargs):
+    '''Make an authenticated request, refreshing an expired token once'''
+    auth_headers, auth_params = auth(agaveClient)
+    auth_headers.update(headers or {})
+    auth_params.update(params or {})
+    with circuitbreaker.guard(circuitbreaker.FILES) as call:
+        rsp = sessions.request(method, url, headers=auth_headers,
+                               params=auth_params, **kwargs)
+        call.failed = circuitbreaker.failed_status(rsp.status_code)
+    if rsp.status_code == 401 and refresh and not auth_params.get('x-nonce'):
+        token = getattr(agaveClient, 'token', None)
+        if token is not None and hasattr(token, 'refresh'):
+            rsp.close()
+            token.refresh()
+            return request(agaveClient, method, url, headers=headers,
+                           params=params, refresh=False, **kwargs)
+    return rsp
+
+
+def get_media(agaveClient, systemId, path, start=None, end=None,
+              headers=None, stream=True, **kwargs):
+    '''GET a file from the media endpoint, optionally as a byte range
+
+    Arguments:
+        start (int, optional): First byte to request
+        end (int, optional): Last byte to request, inclusive
+
+    Raises:
+        HTTPError: The server returned an error status
+
+    Returns:
+        requests.Response: The open response. A status of 206 means the
+        range was honored; 200 means the whole file is being sent.
+    '''
+    headers = dict(headers or {})
+    if start is not None or end is not None:
+        headers['Range'] = 'bytes={}-{}'.format(
+            start or 0, '' if end is None else end)
+    rsp = request(agaveClient, 'GET', media_url(agaveClient, systemId, path),
+                  headers=headers, stream=stream, **kwargs)
+    try:
+        rsp.raise_for_status()
+    except Exception:
+        rsp.close()
+        raise
+    return rsp
+
+
+def content_range(rsp):
+    '''Parse a Content-Range header into (start, end, total)
+
+    Any element the server did not report is None.
+    '''
+    value = rsp.headers.get('Content-Range')
+    if not value or not value.startswith('bytes '):
+        return None, None, None
+    span, _, total = value[6:].partition('/')
+    start, _, end = span.partition('-')
+    try:
+        start, end = int(start), int(end)
+    except ValueError:
+        start, end = None, None
+    try:
+        total = int(total)
+    except ValueError:
+        total = None
+    return start, end, total
@@ -0,0 +1,549 @@
+"""
+Asyncio equivalents of the core bacanora operations
+
+API calls are made with non-blocking ``aiohttp`` requests sharing one
+client session per event loop, so a single loop can keep many metadata
+calls in flight without a thread each. Direct-path filesystem calls, and
+token refreshes, run on a small thread pool. A per-loop semaphore bounds
+the number of operations in progress at once.
+
+``aiohttp`` is optional (``pip install bacanora[aio]``). Without it every
+operation runs its synchronous counterpart on the thread pool.
+"""
+import asyncio
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from weakref import WeakKeyDictionary
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from agavepy.agave import AgaveError
+from requests import Response
+from requests.exceptions import HTTPError
+from tenacity import retry, retry_if_exception, retry_if_exception_type
+from tenacity import stop_after_delay
+from tenacity import wait_exponential
+
+from . import agaveutils
+from . import bacanora as _sync
+from . import circuitbreaker
+from . import direct
+from . import logger as loggermodule
+from . import metadata
+from . import settings
+from .agaveutils import rest
+from .circuitbreaker import CircuitOpen
+from .direct import DirectOperationFailed
+
+logger = loggermodule.get_logger(__name__)
+
+__all__ = ['download', 'upload', 'grant', 'stat', 'exists', 'isfile', 'isdir',
+           'mkdir', 'delete', 'close']
+
+DEFAULT_STORAGE_SYSTEM = 'data-sd2e-community'
+RETRY_MAX_DELAY = settings.RETRY_MAX_DELAY
+RETRY_RERAISE = settings.RETRY_RERAISE
+FILES_BLOCK_SIZE = settings.FILES_BLOCK_SIZE
+AIO_CONCURRENCY = settings.AIO_CONCURRENCY
+AIO_EXECUTOR_WORKERS = settings.AIO_EXECUTOR_WORKERS
+
+_executor = None
+_loops = WeakKeyDictionary()
+
+
+class _LoopState(object):
+    """Semaphore and HTTP session belonging to one event loop"""
+
+    def __init__(self):
+        self.semaphore = asyncio.Semaphore(AIO_CONCURRENCY)
+        self.session = None
+
+
+def _state():
+    loop = asyncio.get_event_loop()
+    state = _loops.get(loop)
+    if state is None:
+        state = _loops[loop] = _LoopState()
+    return state
+
+
+async def _in_executor(func, *args, **kwargs):
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=AIO_EXECUTOR_WORKERS)
+    return await asyncio.get_event_loop().run_in_executor(
+        _executor, partial(func, *args, **kwargs))
+
+
+async def _session():
+    state = _state()
+    if state.session is None or state.session.closed:
+        state.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=AIO_CONCURRENCY),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=settings.HTTP_CONNECT_TIMEOUT,
+                sock_read=settings.HTTP_READ_TIMEOUT))
+    return state.session
+
+
+async def close():
+    """Close the HTTP session of the running event loop"""
+    state = _loops.pop(asyncio.get_event_loop(), None)
+    if state is not None and state.session is not None:
+        await state.session.close()
+
+
+def _http_error(status, reason, url, content):
+    """An HTTPError shaped like the ones raised by requests"""
+    rsp = Response()
+    rsp.status_code = status
+    rsp.reason = reason
+    rsp.url = url
+    rsp._content = content
+    kind = 'Client' if status < 500 else 'Server'
+    return HTTPError('{} {} Error: {} for url: {}'.format(
+        status, kind, reason, url), response=rsp)
+
+
+async def _send(agave_client, method, url, headers=None, params=None,
+                refresh=True, family=circuitbreaker.FILES, **kwargs):
+    """Make an authenticated request; the caller must release the response
+
+    Raises:
+        HTTPError: The server returned an error status
+        AgaveError: The server could not be reached
+        CircuitOpen: The circuit breaker for ``family`` is open
+    """
+    auth_headers, auth_params = rest.auth(agave_client)
+    auth_headers.update(headers or {})
+    auth_params.update(params or {})
+    session = await _session()
+    with circuitbreaker.guard(family) as call:
+        try:
+            rsp = await session.request(method, url, headers=auth_headers,
+                                        params=auth_params, **kwargs)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            call.failed = True
+            raise AgaveError('{} {} failed: {}'.format(method, url, exc))
+        call.failed = circuitbreaker.failed_status(rsp.status)
+    if rsp.status == 401 and refresh and not auth_params.get('x-nonce'):
+        token = getattr(agave_client, 'token', None)
+        if token is not None and hasattr(token, 'refresh'):
+            rsp.release()
+            await _in_executor(token.refresh)
+            return await _send(agave_client, method, url, headers=headers,
+                               params=params, refresh=False, family=family,
+                               **kwargs)
+    if rsp.status >= 400:
+        content = await rsp.read()
+        rsp.release()
+        raise _http_error(rsp.status, rsp.reason, str(rsp.url), content)
+    return rsp
+
+
+async def _call(agave_client, method, url, **kwargs):
+    """Make a request and return its decoded JSON body, if any"""
+    rsp = await _send(agave_client, method, url, **kwargs)
+    try:
+        return await rsp.json(content_type=None)
+    except ValueError:
+        return None
+    finally:
+        rsp.release()
+
+
+async def _fallback(func, *args, **kwargs):
+    """Run a synchronous bacanora operation on the thread pool"""
+    async with _state().semaphore:
+        return await _in_executor(func, *args, **kwargs)
+
+
+async def _describe(agave_client, path, system_id):
+    """Async agaveutils.files.describe: the listing entry for a path, or None"""
+    try:
+        body = await _call(agave_client, 'GET',
+                           rest.files_url(agave_client, 'listings',
+                                          system_id, path),
+                           params={'limit': '2'})
+    except HTTPError as herr:
+        if herr.response.status_code == 404:
+            return None
+        raise
+    result = (body or {}).get('result') or []
+    return result[0] if result else None
+
+
+async def _direct(operation, *args, system_id=DEFAULT_STORAGE_SYSTEM,
+                  **kwargs):
+    """Run a direct-path operation on the executor, if its mount is usable
+
+    Mount health is checked on the loop, so systems without a usable
+    direct path never wait for an executor thread.
+
+    Returns:
+        tuple: ``(True, result)`` if the direct path served the call,
+        otherwise ``(False, None)``
+    """
+    if not direct.available(system_id):
+        return False, None
+    try:
+        return True, await _in_executor(operation, *args,
+                                        system_id=system_id, **kwargs)
+    except DirectOperationFailed as exc:
+        logger.debug('direct {} unavailable: {}'.format(
+            operation.__name__, exc))
+        return False, None
+
+
+async def _stat(agave_client, path, system_id):
+    hit, record = metadata.cache.get(system_id, path)
+    if hit:
+        return record
+    served, record = await _direct(direct.stat, path, system_id=system_id)
+    if served and record is None and (
+            direct.authoritative() or
+            circuitbreaker.is_open(circuitbreaker.FILES)):
+        return None
+    if record is None:
+        listing = await _describe(agave_client, path, system_id)
+        if listing is not None:
+            record = metadata.StatResult.from_listing(listing, path, system_id)
+    metadata.cache.put(system_id, path, record)
+    return record
+
+
+@retry(retry=retry_if_exception_type(AgaveError), reraise=RETRY_RERAISE,
+       stop=stop_after_delay(RETRY_MAX_DELAY), wait=wait_exponential(multiplier=2, max=64))
+async def download(agave_client, file_to_download, local_filename=None,
+                   system_id=DEFAULT_STORAGE_SYSTEM):
+    """Download a file from Agave files API
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        file_to_download (str): Absolute path of file to download
+        local_filename (str): Local name of file once downloaded
+        system_id (str, optional): Storage system where file is located [data-sd2e-community]
+
+    Returns:
+        str: Name of downloaded file
+    """
+    logger.info('bacanora.aio.download()')
+    if aiohttp is None:
+        return await _fallback(_sync.download, agave_client, file_to_download,
+                               local_filename=local_filename, system_id=system_id)
+    if local_filename is None:
+        local_filename = os.path.basename(file_to_download)
+    downloadFileName = os.path.join(_sync.PWD, local_filename)
+    async with _state().semaphore:
+        served, _ = await _direct(direct.get, file_to_download,
+                                  local_filename, system_id=system_id)
+        if served:
+            return local_filename
+        logger.info('using Agave API')
+        try:
+            rsp = await _send(agave_client, 'GET',
+                              rest.media_url(agave_client, system_id,
+                                             file_to_download))
+        except HTTPError as http_err:
+            if re.compile('404 Client Error').search(str(http_err)):
+                raise HTTPError('404 Not Found') from http_err
+            http_err_resp = agaveutils.process_agave_httperror(http_err)
+            raise AgaveError(http_err_resp) from http_err
+        # Implements atomic download
+        f = tempfile.NamedTemporaryFile(
+            'wb', delete=False, dir=os.path.dirname(downloadFileName))
+        try:
+            with f:
+                async for block in rsp.content.iter_chunked(FILES_BLOCK_SIZE):
+                    # Disk writes can block, so keep them off the loop
+                    await _in_executor(f.write, block)
+            os.rename(f.name, downloadFileName)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            os.unlink(f.name)
+            raise AgaveError('Download of {} interrupted: {}'.format(
+                file_to_download, exc))
+        except Exception:
+            os.unlink(f.name)
+            raise
+        finally:
+            rsp.release()
+    return local_filename
+
+
+@retry(retry=retry_if_exception_type(AgaveError), reraise=RETRY_RERAISE,
+       stop=stop_after_delay(RETRY_MAX_DELAY), wait=wait_exponential(multiplier=2, max=64))
+async def upload(agave_client, file_to_upload, destination_path,
+                 system_id=DEFAULT_STORAGE_SYSTEM, autogrant=False):
+    """Upload a file using Agave files, with optional world:READ grant
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        file_to_upload (str): Path of file to upload
+        destination_path (str): Absolute path on destination storage system
+        system_id (str, optional): Storage system where file is located [data-sd2e-community]
+        autogrant (bool, optional): Whether to automatically grant world read to uploaded file [False]
+
+    Returns:
+        bool: True on success
+    """
+    logger.info('bacanora.aio.upload()')
+    if aiohttp is None:
+        return await _fallback(_sync.upload, agave_client, file_to_upload,
+                               destination_path, system_id=system_id,
+                               autogrant=autogrant)
+    async with _state().semaphore:
+        try:
+            served, _ = await _direct(direct.put, file_to_upload,
+                                      destination_path, system_id=system_id)
+            if not served:
+                logger.info('using Agave API')
+                try:
+                    with open(file_to_upload, 'rb') as f:
+                        form = aiohttp.FormData()
+                        form.add_field('fileToUpload', f,
+                                       filename=os.path.basename(file_to_upload))
+                        await _call(agave_client, 'POST',
+                                    rest.media_url(agave_client, system_id,
+                                                   destination_path),
+                                    data=form)
+                except CircuitOpen:
+                    raise
+                except HTTPError as h:
+                    http_err_resp = agaveutils.process_agave_httperror(h)
+                    raise Exception(http_err_resp)
+                except Exception as e:
+                    raise AgaveError(
+                        "Error uploading {}: {}".format(file_to_upload, e))
+        finally:
+            metadata.cache.invalidate(
+                system_id, os.path.join(destination_path,
+                                        os.path.basename(file_to_upload)),
+                parents=True)
+    if autogrant:
+        return await grant(agave_client, destination_path, system_id=system_id)
+    return True
+
+
+@retry(retry=retry_if_exception(circuitbreaker.retryable),
+       stop=stop_after_delay(RETRY_MAX_DELAY), reraise=RETRY_RERAISE,
+       wait=wait_exponential(multiplier=2, max=64))
+async def grant(agave_client, pems_grant_target, system_id=DEFAULT_STORAGE_SYSTEM,
+                username='world', permission='READ'):
+    """Grant Agave file permissions
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        pems_grant_target (str): Absolute path on destination storage system
+        system_id (str, optional): Storage system where file is located [data-sd2e-community]
+        username (str, optional): Username to grant permission to [world]
+        permission (str, optional): Permission to grant [READ]
+
+    Returns:
+        bool: True on success
+    """
+    logger.info('bacanora.aio.grant()')
+    if aiohttp is None:
+        return await _fallback(_sync.grant, agave_client, pems_grant_target,
+                               system_id=system_id, username=username,
+                               permission=permission)
+    pemBody = {'username': username,
+               'permission': permission,
+               'recursive': False}
+    async with _state().semaphore:
+        try:
+            await _call(agave_client, 'POST',
+                        rest.files_url(agave_client, 'pems', system_id,
+                                       pems_grant_target),
+                        json=pemBody, family=circuitbreaker.PERMISSIONS)
+        except CircuitOpen:
+            raise
+        except HTTPError as h:
+            http_err_resp = agaveutils.process_agave_httperror(h)
+            raise Exception(http_err_resp)
+        except Exception as e:
+            raise AgaveError(
+                "Error setting permissions on {}: {}".format(pems_grant_target, e))
+    return True
+
+
+@retry(retry=retry_if_exception(
+           lambda e: not isinstance(e, (FileNotFoundError, CircuitOpen))),
+       stop=stop_after_delay(RETRY_MAX_DELAY), reraise=RETRY_RERAISE,
+       wait=wait_exponential(multiplier=2, max=64))
+async def stat(agave_client, path_to_stat, system_id=DEFAULT_STORAGE_SYSTEM):
+    """Retrieve type, size, modification time and permissions for a path
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        path_to_stat (str): Agave-absolute path to inspect
+        system_id (str, optional): Storage system where file is located [data-sd2e-community]
+
+    Raises:
+        FileNotFoundError: The path does not exist
+
+    Returns:
+        StatResult: Metadata record for the path
+    """
+    logger.info('bacanora.aio.stat()')
+    if aiohttp is None:
+        return await _fallback(_sync.stat, agave_client, path_to_stat,
+                               system_id=system_id)
+    async with _state().semaphore:
+        record = await _stat(agave_client, path_to_stat, system_id)
+    if record is None:
+        raise FileNotFoundError(
+            'No such file or directory: agave://{}{}'.format(
+                system_id, path_to_stat))
+    return record
+
+
+@retry(retry=retry_if_exception(circuitbreaker.retryable),
+       stop=stop_after_delay(RETRY_MAX_DELAY), reraise=RETRY_RERAISE,
+       wait=wait_exponential(multiplier=2, max=64))
+async def exists(agave_client, path_to_test, system_id=DEFAULT_STORAGE_SYSTEM):
+    """Test for existence of a file or directory
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        path_to_test (str): Agave-absolute path to test
+        system_id (str, optional): Storage system where file is located [data-sd2e-community]
+
+    Returns:
+        bool: True on existence
+    """
+    logger.info('bacanora.aio.exists()')
+    if aiohttp is None:
+        return await _fallback(_sync.exists, agave_client, path_to_test,
+                               system_id=system_id)
+    async with _state().semaphore:
+        return await _stat(agave_client, path_to_test, system_id) is not None
+
+
+@retry(retry=retry_if_exception(circuitbreaker.retryable),
+       stop=stop_after_delay(RETRY_MAX_DELAY), reraise=RETRY_RERAISE,
+       wait=wait_exponential(multiplier=2, max=64))
+async def isfile(agave_client, path_to_test, system_id=DEFAULT_STORAGE_SYSTEM):
+    """Determine if a path points to a file
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        path_to_test (str): Agave-absolute path to test
+        system_id (str, optional): Storage system where file is located [data-sd2e-community]
+
+    Returns:
+        bool: True if target is a file
+    """
+    logger.info('bacanora.aio.isfile()')
+    if aiohttp is None:
+        return await _fallback(_sync.isfile, agave_client, path_to_test,
+                               system_id=system_id)
+    async with _state().semaphore:
+        record = await _stat(agave_client, path_to_test, system_id)
+    return record is not None and record.is_file()
+
+
+@retry(retry=retry_if_exception(circuitbreaker.retryable),
+       stop=stop_after_delay(RETRY_MAX_DELAY), reraise=RETRY_RERAISE,
+       wait=wait_exponential(multiplier=2, max=64))
+async def isdir(agave_client, path_to_test, system_id=DEFAULT_STORAGE_SYSTEM):
+    """Determine if a path points to a directory
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        path_to_test (str): Agave-absolute path to test
+        system_id (str, optional): Storage system where file is located [data-sd2e-community]
+
+    Returns:
+        bool: True if target is a directory
+    """
+    logger.info('bacanora.aio.isdir()')
+    if aiohttp is None:
+        return await _fallback(_sync.isdir, agave_client, path_to_test,
+                               system_id=system_id)
+    async with _state().semaphore:
+        record = await _stat(agave_client, path_to_test, system_id)
+    return record is not None and record.is_dir()
+
+
+@retry(retry=retry_if_exception(circuitbreaker.retryable),
+       stop=stop_after_delay(RETRY_MAX_DELAY), reraise=RETRY_RERAISE,
+       wait=wait_exponential(multiplier=2, max=64))
+async def mkdir(agave_client, path_to_make, system_id=DEFAULT_STORAGE_SYSTEM):
+    """Make a new directory on the specified storage system
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        path_to_make (str): Agave-absolute path to create
+        system_id (str, optional): Storage system where file is located [data-sd2e-community]
+
+    Returns:
+        bool: True on success
+    """
+    logger.info('bacanora.aio.mkdir()')
+    if aiohttp is None:
+        return await _fallback(_sync.mkdir, agave_client, path_to_make,
+                               system_id=system_id)
+    async with _state().semaphore:
+        record = await _stat(agave_client, path_to_make, system_id)
+        if record is not None and record.is_dir():
+            return True
+        try:
+            served, made = await _direct(direct.mkdir, path_to_make,
+                                         system_id=system_id)
+            if served:
+                return made
+            logger.info('using Agave API')
+            await _call(agave_client, 'PUT',
+                        rest.media_url(agave_client, system_id, '/'),
+                        json={'action': 'mkdir', 'path': path_to_make})
+            return True
+        finally:
+            metadata.cache.invalidate(system_id, path_to_make, parents=True)
+
+
+@retry(retry=retry_if_exception(circuitbreaker.retryable),
+       stop=stop_after_delay(RETRY_MAX_DELAY), reraise=RETRY_RERAISE,
+       wait=wait_exponential(multiplier=2, max=64))
+async def delete(agave_client, path_to_rm, system_id=DEFAULT_STORAGE_SYSTEM,
+                 recursive=True):
+    """Delete a path on the specified storage system
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        path_to_rm (str): Agave-absolute path to remove
+        system_id (str, optional): Storage system where file is located [data-sd2e-community]
+
+    Returns:
+        bool: True on success
+    """
+    logger.info('bacanora.aio.delete()')
+    if aiohttp is None:
+        return await _fallback(_sync.delete, agave_client, path_to_rm,
+                               system_id=system_id, recursive=recursive)
+    async with _state().semaphore:
+        if await _stat(agave_client, path_to_rm, system_id) is None:
+            logger.warning('Path {} did not exist to delete!'.format(path_to_rm))
+            return True
+        try:
+            served, removed = await _direct(direct.delete, path_to_rm,
+                                            system_id=system_id,
+                                            recursive=recursive)
+            if served:
+                return removed
+            logger.info('using Agave API')
+            try:
+                await _call(agave_client, 'DELETE',
+                            rest.media_url(agave_client, system_id, path_to_rm))
+            except HTTPError as herr:
+                if herr.response.status_code == 404:
+                    return False
+                raise
+            return True
+        finally:
+            metadata.cache.invalidate(system_id, path_to_rm, children=True)
@@ -3,30 +3,95 @@ import json
 import re
 import sys
 import tempfile
-from pprint import pformat
 from attrdict import AttrDict
 from agavepy.agave import AgaveError
 from requests.exceptions import HTTPError
-from tenacity import retry, retry_if_exception_type
+from tenacity import retry, retry_if_exception, retry_if_exception_type
 from tenacity import stop_after_delay
 from tenacity import wait_exponential
 
 from . import agaveutils
+from . import buffers
+from . import circuitbreaker
 from . import direct
+from . import filecache
 from . import logger as loggermodule
+from . import metadata
+from . import metrics
+from . import resumable
+from . import sessions
 from . import settings
+from .circuitbreaker import CircuitOpen
 from .direct import DirectOperationFailed
 
 DEFAULT_STORAGE_SYSTEM = 'data-sd2e-community'
 RETRY_MAX_DELAY  = settings.RETRY_MAX_DELAY
 RETRY_RERAISE = settings.RETRY_RERAISE
 FILES_BLOCK_SIZE = settings.FILES_BLOCK_SIZE
+FILES_RESUMABLE = settings.FILES_RESUMABLE
 
 PWD = os.getcwd()
 logger = loggermodule.get_logger(__name__)
 
+def _transferred(filename):
+    """Count a file's size as moved by the current operation"""
+    if metrics._active():
+        try:
+            metrics.transferred(os.path.getsize(filename))
+        except OSError:
+            pass
+
+def _direct(operation, *args, system_id=DEFAULT_STORAGE_SYSTEM, **kwargs):
+    """Try an operation on the direct path, unless its mount is unusable
+
+    Returns:
+        tuple: ``(True, result)`` if the direct path served the call,
+        otherwise ``(False, None)``
+    """
+    if not direct.available(system_id):
+        return False, None
+    try:
+        result = operation(*args, system_id=system_id, **kwargs)
+    except DirectOperationFailed as exc:
+        logger.debug('direct {} failed: {}'.format(operation.__name__, exc))
+        return False, None
+    # A preceding existence check may have noted a different path
+    metrics.via(metrics.DIRECT)
+    return True, result
+
+def _download_via_client(agave_client, file_to_download, downloadFileName,
+                         system_id):
+    """Non-resumable download through AgavePy's files.download"""
+    # Implements atomic download
+    # Beside the destination, so the rename never crosses filesystems
+    f = tempfile.NamedTemporaryFile(
+        'wb', delete=False, dir=os.path.dirname(downloadFileName))
+    try:
+        with f:
+            sessions.attach(agave_client)
+            with circuitbreaker.guard(circuitbreaker.FILES):
+                rsp = agave_client.files.download(systemId=system_id,
+                                                  filePath=file_to_download)
+            if isinstance(rsp, dict):
+                raise AgaveError(
+                    "Failed to download {}".format(file_to_download))
+            for block in buffers.iter_response(rsp, FILES_BLOCK_SIZE):
+                f.write(block)
+        try:
+            os.rename(f.name, downloadFileName)
+        except Exception as rexc:
+            raise OSError('Atomic rename failed after download', rexc)
+    except Exception:
+        try:
+            os.unlink(f.name)
+        except OSError:
+            pass
+        raise
+
+@metrics.instrument
 @retry(retry=retry_if_exception_type(AgaveError), reraise=RETRY_RERAISE,
-       stop=stop_after_delay(RETRY_MAX_DELAY), wait=wait_exponential(multiplier=2, max=64))
+       stop=stop_after_delay(RETRY_MAX_DELAY), wait=wait_exponential(multiplier=2, max=64),
+       before_sleep=metrics.retried)
 def download(agave_client, file_to_download, local_filename=None, system_id=DEFAULT_STORAGE_SYSTEM):
     """Download a file from Agave files API
 
@@ -46,47 +111,55 @@ def download(agave_client, file_to_download, local_filename=None, system_id=DEFA
 
     downloadFileName = os.path.join(PWD, local_filename)
 
-    try:
-        direct.get(file_to_download, local_filename, system_id=system_id)
-    except DirectOperationFailed as exc:
+    served, _ = _direct(direct.get, file_to_download, local_filename,
+                        system_id=system_id)
+    if not served:
         logger.info('using Agave API')
-        logger.debug(pformat(exc))
+        metrics.via(metrics.API)
         # Download using Agave API call
         try:
-            downloadFileName = os.path.join(PWD, local_filename)
-            # Implements atomic download
-            f = tempfile.NamedTemporaryFile('wb', delete=False, dir=PWD)
-            # with open(downloadFileName, 'wb') as f:
-            rsp = agave_client.files.download(systemId=system_id,
-                                              filePath=file_to_download)
-            if isinstance(rsp, dict):
-                raise AgaveError(
-                    "Failed to download {}".format(file_to_download))
-            for block in rsp.iter_content(FILES_BLOCK_SIZE):
-                if not block:
-                    break
-                f.write(block)
-            try:
-                os.rename(f.name, downloadFileName)
-            except Exception as rexc:
-                raise OSError('Atomic rename failed after download', rexc)
-
-        except (HTTPError, AgaveError) as http_err:
-            try:
-                os.unlink(downloadFileName)
-            except Exception:
-                logger.exception('Failed to unlink {}'.format(downloadFileName))
-                pass
+            cache_key = None
+            if filecache.cache.enabled:
+                # One listing call decides whether the cached copy is fresh
+                record = _stat(agave_client, file_to_download, system_id)
+                if record is not None and (record.checksum or
+                                           record.mtime is not None):
+                    cache_key = filecache.cache.key(
+                        system_id, file_to_download, record.size, record.mtime,
+                        checksum=record.checksum)
+                    if filecache.cache.fetch(cache_key, downloadFileName):
+                        logger.info('served from download cache')
+                        metrics.via(metrics.CACHE)
+                        return local_filename
+                # The metadata lookup may have noted the cache
+                metrics.via(metrics.API)
+            if FILES_RESUMABLE and resumable.supported(agave_client):
+                resumable.fetch(agave_client, file_to_download,
+                                downloadFileName, system_id,
+                                block_size=FILES_BLOCK_SIZE)
+            else:
+                _download_via_client(agave_client, file_to_download,
+                                     downloadFileName, system_id)
+            if cache_key is not None:
+                try:
+                    filecache.cache.store(cache_key, downloadFileName)
+                except OSError as cexc:
+                    logger.warning('Failed to cache {}: {}'.format(
+                        file_to_download, cexc))
+        except HTTPError as http_err:
             if re.compile('404 Client Error').search(str(http_err)):
                 raise HTTPError('404 Not Found') from http_err
             else:
                 http_err_resp = agaveutils.process_agave_httperror(http_err)
                 raise AgaveError(http_err_resp) from http_err
 
+    _transferred(downloadFileName)
     return local_filename
 
+@metrics.instrument
 @retry(retry=retry_if_exception_type(AgaveError), reraise=RETRY_RERAISE,
-       stop=stop_after_delay(RETRY_MAX_DELAY), wait=wait_exponential(multiplier=2, max=64))
+       stop=stop_after_delay(RETRY_MAX_DELAY), wait=wait_exponential(multiplier=2, max=64),
+       before_sleep=metrics.retried)
 def upload(agave_client, file_to_upload, destination_path,
           system_id=DEFAULT_STORAGE_SYSTEM, autogrant=False):
     """Upload a file using Agave files, with optional world:READ grant
@@ -103,27 +176,41 @@ def upload(agave_client, file_to_upload, destination_path,
     """
     logger.info('bacanora.upload()')
     try:
-        direct.put(file_to_upload, destination_path, system_id=system_id)
-    except DirectOperationFailed as exc:
-        logger.info('using Agave API')
-        logger.debug(pformat(exc))
-        try:
-            agave_client.files.importData(systemId=system_id,
-                                          filePath=destination_path,
-                                          fileToUpload=open(file_to_upload, 'rb'))
-        except HTTPError as h:
-            http_err_resp = agaveutils.process_agave_httperror(h)
-            raise Exception(http_err_resp)
-        except Exception as e:
-            raise AgaveError(
-                "Error uploading {}: {}".format(file_to_upload, e))
+        served, _ = _direct(direct.put, file_to_upload, destination_path,
+                            system_id=system_id)
+        if not served:
+            logger.info('using Agave API')
+            metrics.via(metrics.API)
+            try:
+                sessions.attach(agave_client)
+                with circuitbreaker.guard(circuitbreaker.FILES):
+                    agave_client.files.importData(systemId=system_id,
+                                                  filePath=destination_path,
+                                                  fileToUpload=open(file_to_upload, 'rb'))
+            except CircuitOpen:
+                raise
+            except HTTPError as h:
+                http_err_resp = agaveutils.process_agave_httperror(h)
+                raise Exception(http_err_resp)
+            except Exception as e:
+                raise AgaveError(
+                    "Error uploading {}: {}".format(file_to_upload, e))
+    finally:
+        metadata.cache.invalidate(
+            system_id, os.path.join(destination_path,
+                                    os.path.basename(file_to_upload)),
+            parents=True)
+    _transferred(file_to_upload)
     if autogrant:
         return grant(agave_client, destination_path, system_id=system_id)
     else:
         return True
 
-@retry(stop=stop_after_delay(RETRY_MAX_DELAY), reraise=RETRY_RERAISE,
-       wait=wait_exponential(multiplier=2, max=64))
+@metrics.instrument
+@retry(retry=retry_if_exception(circuitbreaker.retryable),
+       stop=stop_after_delay(RETRY_MAX_DELAY), reraise=RETRY_RERAISE,
+       wait=wait_exponential(multiplier=2, max=64),
+       before_sleep=metrics.retried)
 def grant(agave_client, pems_grant_target, system_id=DEFAULT_STORAGE_SYSTEM,
           username='world', permission='READ'):
     """Grant Agave file permissions
@@ -140,13 +227,18 @@ def grant(agave_client, pems_grant_target, system_id=DEFAULT_STORAGE_SYSTEM,
     """
     logger.info('bacanora.grant()')
     logger.info('using Agave API')
+    metrics.via(metrics.API)
     try:
         pemBody = {'username': username,
                    'permission': permission,
                    'recursive': False}
-        agave_client.files.updatePermissions(systemId=system_id,
-                                             filePath=pems_grant_target,
-                                             body=pemBody)
+        sessions.attach(agave_client)
+        with circuitbreaker.guard(circuitbreaker.PERMISSIONS):
+            agave_client.files.updatePermissions(systemId=system_id,
+                                                 filePath=pems_grant_target,
+                                                 body=pemBody)
+    except CircuitOpen:
+        raise
     except HTTPError as h:
         http_err_resp = agaveutils.process_agave_httperror(h)
         raise Exception(http_err_resp)
@@ -155,8 +247,67 @@ def grant(agave_client, pems_grant_target, system_id=DEFAULT_STORAGE_SYSTEM,
             "Error setting permissions on {}: {}".format(pems_grant_target, e))
     return True
 
-@retry(stop=stop_after_delay(RETRY_MAX_DELAY), reraise=RETRY_RERAISE,
-       wait=wait_exponential(multiplier=2, max=64))
+def _stat(agave_client, path, system_id):
+    """Metadata for a path from one os.stat() or one files.list call
+
+    Answers are served from and stored in the metadata cache when it is
+    enabled. Returns None if the path does not exist. A negative answer
+    from the direct path is final with BACANORA_DIRECT_AUTHORITATIVE, or
+    while the files API circuit is open.
+    """
+    hit, record = metadata.cache.get(system_id, path)
+    if hit:
+        metrics.via(metrics.CACHE)
+        return record
+    served, record = _direct(direct.stat, path, system_id=system_id)
+    if served and record is None and (
+            direct.authoritative() or
+            circuitbreaker.is_open(circuitbreaker.FILES)):
+        logger.debug('trusting direct path: {} does not exist'.format(path))
+        return None
+    if record is None:
+        logger.info('using Agave API')
+        metrics.via(metrics.API)
+        listing = agaveutils.files.describe(agave_client, path,
+                                            systemId=system_id)
+        if listing is not None:
+            record = metadata.StatResult.from_listing(listing, path, system_id)
+    metadata.cache.put(system_id, path, record)
+    return record
+
+@metrics.instrument
+@retry(retry=retry_if_exception(
+           lambda e: not isinstance(e, (FileNotFoundError, CircuitOpen))),
+       stop=stop_after_delay(RETRY_MAX_DELAY), reraise=RETRY_RERAISE,
+       wait=wait_exponential(multiplier=2, max=64),
+       before_sleep=metrics.retried)
+def stat(agave_client, path_to_stat, system_id=DEFAULT_STORAGE_SYSTEM):
+    """Retrieve type, size, modification time and permissions for a path
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        path_to_stat (str): Agave-absolute path to inspect
+        system_id (str, optional): Storage system where file is located [data-sd2e-community]
+
+    Raises:
+        FileNotFoundError: The path does not exist
+
+    Returns:
+        StatResult: Metadata record for the path
+    """
+    logger.info('bacanora.stat()')
+    record = _stat(agave_client, path_to_stat, system_id)
+    if record is None:
+        raise FileNotFoundError(
+            'No such file or directory: agave://{}{}'.format(
+                system_id, path_to_stat))
+    return record
+
+@metrics.instrument
+@retry(retry=retry_if_exception(circuitbreaker.retryable),
+       stop=stop_after_delay(RETRY_MAX_DELAY), reraise=RETRY_RERAISE,
+       wait=wait_exponential(multiplier=2, max=64),
+       before_sleep=metrics.retried)
 def exists(agave_client, path_to_test, system_id=DEFAULT_STORAGE_SYSTEM):
     """Test for existence of a file or directory
 
@@ -169,14 +320,13 @@ def exists(agave_client, path_to_test, system_id=DEFAULT_STORAGE_SYSTEM):
         bool: True on existence
     """
     logger.info('bacanora.exists()')
-    if direct.exists(path_to_test, system_id=system_id):
-        return True
-    else:
-        logger.info('using Agave API')
-        return agaveutils.exists(agave_client, path_to_test, systemId=system_id)
+    return _stat(agave_client, path_to_test, system_id) is not None
 
-@retry(stop=stop_after_delay(RETRY_MAX_DELAY), reraise=RETRY_RERAISE,
-       wait=wait_exponential(multiplier=2, max=64))
+@metrics.instrument
+@retry(retry=retry_if_exception(circuitbreaker.retryable),
+       stop=stop_after_delay(RETRY_MAX_DELAY), reraise=RETRY_RERAISE,
+       wait=wait_exponential(multiplier=2, max=64),
+       before_sleep=metrics.retried)
 def isfile(agave_client, path_to_test, system_id=DEFAULT_STORAGE_SYSTEM):
     """Determine if a path points to a file
 
@@ -189,14 +339,14 @@ def isfile(agave_client, path_to_test, system_id=DEFAULT_STORAGE_SYSTEM):
         bool: True if target is a file
     """
     logger.info('bacanora.isfile()')
-    if direct.isfile(path_to_test, system_id=system_id):
-        return True
-    else:
-        logger.info('using Agave API')
-        return agaveutils.isfile(agave_client, path_to_test, systemId=system_id)
+    record = _stat(agave_client, path_to_test, system_id)
+    return record is not None and record.is_file()
 
-@retry(stop=stop_after_delay(RETRY_MAX_DELAY), reraise=RETRY_RERAISE,
-       wait=wait_exponential(multiplier=2, max=64))
+@metrics.instrument
+@retry(retry=retry_if_exception(circuitbreaker.retryable),
+       stop=stop_after_delay(RETRY_MAX_DELAY), reraise=RETRY_RERAISE,
+       wait=wait_exponential(multiplier=2, max=64),
+       before_sleep=metrics.retried)
 def isdir(agave_client, path_to_test, system_id=DEFAULT_STORAGE_SYSTEM):
     """Determine if a path points to a directory
 
@@ -209,14 +359,14 @@ def isdir(agave_client, path_to_test, system_id=DEFAULT_STORAGE_SYSTEM):
         bool: True if target is a directory
     """
     logger.info('bacanora.isdir()')
-    if direct.isdir(path_to_test, system_id=system_id):
-        return True
-    else:
-        logger.info('using Agave API')
-        return agaveutils.isdir(agave_client, path_to_test, systemId=system_id)
+    record = _stat(agave_client, path_to_test, system_id)
+    return record is not None and record.is_dir()
 
-@retry(stop=stop_after_delay(RETRY_MAX_DELAY), reraise=RETRY_RERAISE,
-       wait=wait_exponential(multiplier=2, max=64))
+@metrics.instrument
+@retry(retry=retry_if_exception(circuitbreaker.retryable),
+       stop=stop_after_delay(RETRY_MAX_DELAY), reraise=RETRY_RERAISE,
+       wait=wait_exponential(multiplier=2, max=64),
+       before_sleep=metrics.retried)
 def mkdir(agave_client, path_to_make, system_id=DEFAULT_STORAGE_SYSTEM):
     """Make a new directory on the specified storage system
 
@@ -229,19 +379,27 @@ def mkdir(agave_client, path_to_make, system_id=DEFAULT_STORAGE_SYSTEM):
         bool: True on success
     """
     logger.info('bacanora.mkdir()')
-    if isdir(agave_client, path_to_make, system_id=system_id):
+    # The undecorated helper, so one mkdir() is observed once
+    record = _stat(agave_client, path_to_make, system_id)
+    if record is not None and record.is_dir():
         return True
     try:
-        return direct.mkdir(path_to_make, system_id=system_id)
-    except DirectOperationFailed as exc:
+        served, made = _direct(direct.mkdir, path_to_make, system_id=system_id)
+        if served:
+            return made
         logger.info('using Agave API')
-        logger.debug(pformat(exc))
+        metrics.via(metrics.API)
         return agaveutils.files.mkdir(agave_client,
                                       path_to_make,
                                       systemId=system_id)
+    finally:
+        metadata.cache.invalidate(system_id, path_to_make, parents=True)
 
-@retry(stop=stop_after_delay(RETRY_MAX_DELAY), reraise=RETRY_RERAISE,
-       wait=wait_exponential(multiplier=2, max=64))
+@metrics.instrument
+@retry(retry=retry_if_exception(circuitbreaker.retryable),
+       stop=stop_after_delay(RETRY_MAX_DELAY), reraise=RETRY_RERAISE,
+       wait=wait_exponential(multiplier=2, max=64),
+       before_sleep=metrics.retried)
 def delete(agave_client, path_to_rm, system_id=DEFAULT_STORAGE_SYSTEM, recursive=True):
     """Delete a path on the specified storage system
 
@@ -254,14 +412,18 @@ def delete(agave_client, path_to_rm, system_id=DEFAULT_STORAGE_SYSTEM, recursive
         bool: True on success
     """
     logger.info('bacanora.delete()')
-    if not exists(agave_client, path_to_rm, system_id=DEFAULT_STORAGE_SYSTEM):
+    if _stat(agave_client, path_to_rm, system_id) is None:
         logger.warning('Path {} did not exist to delete!'.format(path_to_rm))
         return True
     try:
-        return direct.delete(path_to_rm, system_id=system_id, recursive=recursive)
-    except DirectOperationFailed as exc:
+        served, removed = _direct(direct.delete, path_to_rm,
+                                  system_id=system_id, recursive=recursive)
+        if served:
+            return removed
         logger.info('using Agave API')
-        logger.debug(pformat(exc))
+        metrics.via(metrics.API)
         return agaveutils.files.delete(agave_client,
                                        path_to_rm,
                                        systemId=system_id)
+    finally:
+        metadata.cache.invalidate(system_id, path_to_rm, children=True)
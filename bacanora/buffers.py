@@ -0,0 +1,181 @@
+"""
+Reusable transfer buffers and adaptive read sizing for HTTP downloads
+
+Download loops read response bodies into preallocated ``bytearray``
+buffers borrowed from a shared pool instead of allocating a fresh
+``bytes`` object per block. When the body is not content-encoded it is
+read with urllib3's ``readinto`` into the pooled buffer, and the
+connection goes back to the session's pool once the body is done. The
+read size starts at ``BACANORA_FILES_BLOCK_SIZE`` and doubles while
+blocks arrive quickly, up to ``BACANORA_FILES_MAX_BLOCK_SIZE``, so fast
+links make few large writes and slow links still report progress often.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from http.client import HTTPException, IncompleteRead
+
+from requests.exceptions import ChunkedEncodingError
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+
+from . import logger as loggermodule
+from . import settings
+
+logger = loggermodule.get_logger(__name__)
+
+__all__ = ['BufferPool', 'AdaptiveChunker', 'iter_response', 'pool']
+
+FILES_BLOCK_SIZE = settings.FILES_BLOCK_SIZE
+FILES_MAX_BLOCK_SIZE = settings.FILES_MAX_BLOCK_SIZE
+FILES_BUFFER_POOL_SIZE = settings.FILES_BUFFER_POOL_SIZE
+# Seconds one read should take before the chunk size stops growing
+TARGET_READ_SECONDS = 0.1
+
+
+class BufferPool(object):
+    """Thread-safe free lists of fixed-size ``bytearray`` buffers
+
+    Arguments:
+        max_free (int): Buffers of each size kept for reuse once released
+    """
+
+    def __init__(self, max_free=FILES_BUFFER_POOL_SIZE):
+        self.max_free = max_free
+        self._free = {}
+        self._lock = threading.Lock()
+        self.allocated = 0
+        self.reused = 0
+
+    def acquire(self, size):
+        """Take a buffer of exactly ``size`` bytes, allocating if none is free"""
+        with self._lock:
+            free = self._free.get(size)
+            if free:
+                self.reused += 1
+                return free.pop()
+            self.allocated += 1
+        return bytearray(size)
+
+    def release(self, buf):
+        """Return a buffer to the pool; extras are left to the garbage collector"""
+        with self._lock:
+            free = self._free.setdefault(len(buf), [])
+            if len(free) < self.max_free:
+                free.append(buf)
+
+    @contextmanager
+    def borrow(self, size):
+        buf = self.acquire(size)
+        try:
+            yield buf
+        finally:
+            self.release(buf)
+
+    def clear(self):
+        with self._lock:
+            self._free.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'allocated': self.allocated, 'reused': self.reused,
+                    'free': sum(len(f) for f in self._free.values()),
+                    'max_free': self.max_free}
+
+
+class AdaptiveChunker(object):
+    """Chooses the next read size from how long recent reads took
+
+    A full read that finishes in under half the target doubles the size;
+    one that takes more than twice the target halves it.
+
+    Arguments:
+        initial (int): First read size in bytes
+        maximum (int): Largest read size in bytes
+        minimum (int, optional): Smallest read size in bytes [initial]
+        target (float, optional): Desired seconds per read
+    """
+
+    def __init__(self, initial=FILES_BLOCK_SIZE, maximum=FILES_MAX_BLOCK_SIZE,
+                 minimum=None, target=TARGET_READ_SECONDS):
+        self.minimum = max(1, minimum or initial)
+        self.maximum = max(self.minimum, maximum)
+        self.size = min(max(initial, self.minimum), self.maximum)
+        self.target = target
+
+    def record(self, nbytes, seconds):
+        if nbytes >= self.size and seconds < self.target / 2:
+            self.size = min(self.size * 2, self.maximum)
+        elif seconds > self.target * 2:
+            self.size = max(self.size // 2, self.minimum)
+        return self.size
+
+
+def _raw_reader(rsp):
+    """A ``readinto`` callable for the undecoded body, or None if unavailable"""
+    raw = getattr(rsp, 'raw', None)
+    if raw is None or getattr(rsp, '_content', False) is not False:
+        # Body already consumed (non-streamed request)
+        return None
+    headers = getattr(rsp, 'headers', None) or {}
+    if headers.get('Content-Encoding', 'identity').lower() != 'identity':
+        return None
+    # Reading through urllib3 rather than the http.client response under
+    # it lets urllib3 see the end of the body and keep the connection
+    if hasattr(raw, 'readinto'):
+        return raw.readinto
+    return None
+
+
+def iter_response(rsp, block_size=None, max_block_size=None, buffer_pool=None):
+    """Yield a streamed response body as views of a pooled buffer
+
+    Each view is only valid until the next one is requested, so callers
+    must write or copy it before iterating further.
+
+    Arguments:
+        rsp (Response): A ``requests`` response opened with ``stream=True``
+        block_size (int, optional): Initial read size [BACANORA_FILES_BLOCK_SIZE]
+        max_block_size (int, optional): Largest read size [BACANORA_FILES_MAX_BLOCK_SIZE]
+        buffer_pool (BufferPool, optional): Pool to borrow from [shared pool]
+
+    Raises:
+        ChunkedEncodingError: The connection failed partway through the body
+    """
+    chunker = AdaptiveChunker(initial=block_size or FILES_BLOCK_SIZE,
+                              maximum=max_block_size or FILES_MAX_BLOCK_SIZE)
+    reader = _raw_reader(rsp)
+    if reader is None:
+        for block in rsp.iter_content(chunker.size):
+            yield memoryview(block)
+        return
+    if buffer_pool is None:
+        buffer_pool = pool
+    # http.client stops quietly at a premature EOF, so check the length here
+    length = rsp.headers.get('Content-Length')
+    expected = int(length) if length is not None else None
+    received = 0
+    with buffer_pool.borrow(chunker.maximum) as buf:
+        view = memoryview(buf)
+        while True:
+            size = chunker.size
+            started = time.monotonic()
+            try:
+                count = reader(view[:size])
+            except (HTTPException, OSError, Urllib3HTTPError) as exc:
+                raise ChunkedEncodingError(exc)
+            if not count:
+                break
+            received += count
+            chunker.record(count, time.monotonic() - started)
+            yield view[:count]
+    if expected is not None and received < expected:
+        raise ChunkedEncodingError(IncompleteRead(
+            b'', expected - received))
+    # requests closes rather than pools a connection whose body it did not
+    # read itself, so hand it back now that the body is complete
+    release_conn = getattr(rsp.raw, 'release_conn', None)
+    if release_conn is not None:
+        release_conn()
+
+
+pool = BufferPool()
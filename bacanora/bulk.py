@@ -0,0 +1,404 @@
+"""
+Concurrent, failure-tolerant versions of Bacanora's single-path operations
+"""
+import os
+import posixpath
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tenacity import retry, retry_if_exception
+from tenacity import stop_after_delay
+from tenacity import wait_exponential
+
+from . import agaveutils
+from . import bacanora
+from . import circuitbreaker
+from . import direct
+from . import listing
+from . import logger as loggermodule
+from . import metadata
+from . import settings
+from .bacanora import DEFAULT_STORAGE_SYSTEM, RETRY_MAX_DELAY, RETRY_RERAISE
+from .direct import DirectOperationFailed
+
+MAX_WORKERS = settings.MAX_WORKERS
+
+logger = loggermodule.get_logger(__name__)
+
+__all__ = ['TransferResult', 'TransferReport', 'download_many', 'upload_many',
+           'delete_many', 'makedirs_many']
+
+
+class TransferResult(object):
+    """Outcome of one item in a bulk operation"""
+    __slots__ = ('source', 'destination', 'result', 'exception',
+                 'bytes', 'elapsed')
+
+    def __init__(self, source, destination=None, result=None,
+                 exception=None, bytes=0, elapsed=0.0):
+        self.source = source
+        self.destination = destination
+        self.result = result
+        self.exception = exception
+        self.bytes = bytes
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.exception is None
+
+    def __repr__(self):
+        return '<TransferResult {} -> {} ok={} bytes={}>'.format(
+            self.source, self.destination, self.ok, self.bytes)
+
+
+class TransferReport(object):
+    """Per-item results and aggregate statistics for a bulk operation
+
+    Results are listed in the same order as the requested items. Items an
+    incremental operation found already up to date are kept in ``skipped``.
+    """
+
+    def __init__(self, results, elapsed, skipped=None):
+        self.results = list(results)
+        self.elapsed = elapsed
+        self.skipped = list(skipped or [])
+
+    @property
+    def bytes(self):
+        return sum(r.bytes for r in self.results)
+
+    @property
+    def succeeded(self):
+        return [r for r in self.results if r.ok]
+
+    @property
+    def failed(self):
+        return [r for r in self.results if not r.ok]
+
+    @property
+    def throughput(self):
+        """Aggregate bytes per second over the wall time of the operation"""
+        if self.elapsed <= 0:
+            return 0.0
+        return self.bytes / self.elapsed
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+    def __repr__(self):
+        return '<TransferReport items={} failed={} skipped={} bytes={} elapsed={:.3f}s>'.format(
+            len(self.results), len(self.failed), len(self.skipped),
+            self.bytes, self.elapsed)
+
+
+def _local_size(local_filename):
+    try:
+        return os.path.getsize(os.path.join(bacanora.PWD, local_filename))
+    except OSError:
+        return 0
+
+
+def _normalize_pairs(items, default=None):
+    pairs = []
+    for item in items:
+        if isinstance(item, str):
+            pairs.append((item, default))
+        else:
+            source, destination = item
+            pairs.append((source, destination))
+    return pairs
+
+
+def _run(func, items, max_workers):
+    """Map ``func`` over ``items`` in a thread pool, capturing exceptions"""
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+    start = time.time()
+    results = [None] * len(items)
+    if len(items) > 0:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            futures = {pool.submit(func, item): pos
+                       for pos, item in enumerate(items)}
+            for future, pos in futures.items():
+                results[pos] = future.result()
+    return TransferReport(results, time.time() - start)
+
+
+def download_many(agave_client, files_to_download,
+                  system_id=DEFAULT_STORAGE_SYSTEM, max_workers=None):
+    """Download many files concurrently
+
+    Each transfer goes through ``bacanora.download()`` so it keeps the
+    direct-path attempt, API fallback and retry behavior of a single
+    download. A failed item is recorded in the report rather than
+    aborting the rest of the batch.
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        files_to_download (list): ``(remote_path, local_filename)`` tuples or bare remote paths
+        system_id (str, optional): Storage system where files are located [data-sd2e-community]
+        max_workers (int, optional): Number of concurrent transfers [BACANORA_MAX_WORKERS]
+
+    Returns:
+        TransferReport: Per-file results with aggregate bytes and wall time
+    """
+    logger.info('bacanora.download_many()')
+
+    def _download(pair):
+        remote, local = pair
+        start = time.time()
+        try:
+            local = bacanora.download(agave_client, remote,
+                                      local_filename=local,
+                                      system_id=system_id)
+            return TransferResult(remote, local, result=local,
+                                  bytes=_local_size(local),
+                                  elapsed=time.time() - start)
+        except Exception as exc:
+            logger.warning('download of {} failed: {}'.format(remote, exc))
+            return TransferResult(remote, local, exception=exc,
+                                  elapsed=time.time() - start)
+
+    report = _run(_download, _normalize_pairs(files_to_download), max_workers)
+    logger.info('downloaded {} bytes in {:.3f}s ({} failed)'.format(
+        report.bytes, report.elapsed, len(report.failed)))
+    return report
+
+
+def upload_many(agave_client, files_to_upload, destination_path=None,
+                system_id=DEFAULT_STORAGE_SYSTEM, autogrant=False,
+                max_workers=None, grant_workers=None):
+    """Upload many files concurrently, with optional pipelined world:READ grants
+
+    Uploads run in one pool. When ``autogrant`` is set, each file that
+    finishes uploading is immediately handed to a second pool that grants
+    world:READ on it, so grant round trips overlap the remaining uploads
+    instead of following each one serially.
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        files_to_upload (list): ``(local_path, destination_path)`` tuples or bare local paths
+        destination_path (str, optional): Destination directory for bare local paths
+        system_id (str, optional): Storage system for the uploads [data-sd2e-community]
+        autogrant (bool, optional): Grant world read on each uploaded file [False]
+        max_workers (int, optional): Number of concurrent uploads [BACANORA_MAX_WORKERS]
+        grant_workers (int, optional): Number of concurrent grants [half of max_workers]
+
+    Returns:
+        TransferReport: Per-file results with aggregate bytes and wall time
+    """
+    logger.info('bacanora.upload_many()')
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+    if grant_workers is None:
+        grant_workers = max(1, max_workers // 2)
+    pairs = _normalize_pairs(files_to_upload, default=destination_path)
+    for local, dest in pairs:
+        if dest is None:
+            raise ValueError(
+                'No destination_path given for {}'.format(local))
+
+    def _upload(pair):
+        local, dest = pair
+        start = time.time()
+        try:
+            bacanora.upload(agave_client, local, dest,
+                            system_id=system_id, autogrant=False)
+            size = os.path.getsize(local)
+            return TransferResult(local, dest, result=True, bytes=size,
+                                  elapsed=time.time() - start)
+        except Exception as exc:
+            logger.warning('upload of {} failed: {}'.format(local, exc))
+            return TransferResult(local, dest, exception=exc,
+                                  elapsed=time.time() - start)
+
+    def _grant(result):
+        target = os.path.join(result.destination,
+                              os.path.basename(result.source))
+        try:
+            bacanora.grant(agave_client, target, system_id=system_id)
+        except Exception as exc:
+            logger.warning('grant on {} failed: {}'.format(target, exc))
+            result.result = False
+            result.exception = exc
+        return result
+
+    start = time.time()
+    results = [None] * len(pairs)
+    if len(pairs) > 0:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as uploads, \
+                ThreadPoolExecutor(max_workers=grant_workers) as grants:
+            futures = {uploads.submit(_upload, pair): pos
+                       for pos, pair in enumerate(pairs)}
+            granting = []
+            for future in as_completed(futures):
+                result = future.result()
+                results[futures[future]] = result
+                if autogrant and result.ok:
+                    granting.append(grants.submit(_grant, result))
+            for future in granting:
+                future.result()
+    report = TransferReport(results, time.time() - start)
+    logger.info('uploaded {} bytes in {:.3f}s ({} failed)'.format(
+        report.bytes, report.elapsed, len(report.failed)))
+    return report
+
+
+@retry(retry=retry_if_exception(circuitbreaker.retryable),
+       stop=stop_after_delay(RETRY_MAX_DELAY), reraise=RETRY_RERAISE,
+       wait=wait_exponential(multiplier=2, max=64))
+def _delete(agave_client, path_to_rm, system_id):
+    """Delete one path without an existence check; False if it was absent"""
+    try:
+        return direct.delete(path_to_rm, system_id=system_id)
+    except DirectOperationFailed as exc:
+        logger.debug('direct delete unavailable: {}'.format(exc))
+        return agaveutils.files.delete(agave_client, path_to_rm,
+                                       systemId=system_id)
+    finally:
+        metadata.cache.invalidate(system_id, path_to_rm, children=True)
+
+
+def delete_many(agave_client, paths_to_rm, system_id=DEFAULT_STORAGE_SYSTEM,
+                max_workers=None):
+    """Delete many paths concurrently
+
+    Unlike ``bacanora.delete()`` no existence check is made first, and a
+    path that is already gone counts as deleted. Directories are removed
+    recursively; on the direct path the tree is scanned and cleared by a
+    pool of workers.
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        paths_to_rm (list): Agave-absolute paths to remove
+        system_id (str, optional): Storage system where paths are located [data-sd2e-community]
+        max_workers (int, optional): Number of concurrent deletions [BACANORA_MAX_WORKERS]
+
+    Returns:
+        TransferReport: Per-path results; ``result`` is False where the path did not exist
+    """
+    logger.info('bacanora.delete_many()')
+
+    def _delete_one(path):
+        start = time.time()
+        try:
+            existed = _delete(agave_client, path, system_id)
+            return TransferResult(path, result=existed,
+                                  elapsed=time.time() - start)
+        except Exception as exc:
+            logger.warning('delete of {} failed: {}'.format(path, exc))
+            return TransferResult(path, exception=exc,
+                                  elapsed=time.time() - start)
+
+    report = _run(_delete_one, list(paths_to_rm), max_workers)
+    logger.info('deleted {} paths in {:.3f}s ({} failed)'.format(
+        len(report.succeeded), report.elapsed, len(report.failed)))
+    return report
+
+
+def _leaves(paths):
+    """The paths in a set that are not an ancestor of another path in it"""
+    ancestors = set()
+    for path in paths:
+        parent = posixpath.dirname(path)
+        while parent not in ancestors and parent != posixpath.dirname(parent):
+            ancestors.add(parent)
+            parent = posixpath.dirname(parent)
+    return sorted(p for p in paths if p not in ancestors)
+
+
+@retry(retry=retry_if_exception(circuitbreaker.retryable),
+       stop=stop_after_delay(RETRY_MAX_DELAY), reraise=RETRY_RERAISE,
+       wait=wait_exponential(multiplier=2, max=64))
+def _mkdir(agave_client, path, system_id):
+    try:
+        return direct.mkdir(path, system_id=system_id)
+    except DirectOperationFailed as exc:
+        logger.debug('direct mkdir unavailable: {}'.format(exc))
+        return agaveutils.files.mkdir(agave_client, path, systemId=system_id)
+    finally:
+        metadata.cache.invalidate(system_id, path, parents=True)
+
+
+def _existing(agave_client, parent, names, system_id):
+    """Which of ``names`` are directories in ``parent``
+
+    A single name is checked with ``isdir()``; several siblings share one
+    listing of their parent.
+    """
+    if len(names) == 1:
+        path = posixpath.join(parent, names[0])
+        return set(names) if bacanora.isdir(agave_client, path,
+                                            system_id=system_id) else set()
+    try:
+        return set(entry.name for entry in listing.scandir(
+            agave_client, parent, system_id=system_id)
+            if entry.name in names and entry.is_dir())
+    except (FileNotFoundError, NotADirectoryError):
+        return set()
+
+
+def makedirs_many(agave_client, paths_to_make,
+                  system_id=DEFAULT_STORAGE_SYSTEM, max_workers=None):
+    """Create many directories, including any missing parents
+
+    The requested paths are reduced to the deepest ones, since creating a
+    directory also creates its parents. Leaves that share a parent are
+    checked with one listing of that parent, and only the missing leaves
+    are created, concurrently.
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        paths_to_make (list): Agave-absolute paths to create
+        system_id (str, optional): Storage system where paths are located [data-sd2e-community]
+        max_workers (int, optional): Concurrent checks and mkdirs [BACANORA_MAX_WORKERS]
+
+    Returns:
+        TransferReport: Per-leaf results for created directories, plus the
+        ``skipped`` leaves that already existed
+    """
+    logger.info('bacanora.makedirs_many()')
+    start = time.time()
+    leaves = _leaves(set('/' + p.strip('/') for p in paths_to_make) - {'/'})
+    siblings = {}
+    for leaf in leaves:
+        parent, name = posixpath.split(leaf)
+        siblings.setdefault(parent, []).append(name)
+
+    def _check(item):
+        parent, names = item
+        try:
+            found = _existing(agave_client, parent, names, system_id)
+            return TransferResult(parent, result=found)
+        except Exception as exc:
+            # Unknown, so attempt to create them all
+            logger.debug('could not list {}: {}'.format(parent, exc))
+            return TransferResult(parent, result=set(), exception=exc)
+
+    checked = _run(_check, list(siblings.items()), max_workers)
+    present = set(posixpath.join(r.source, name)
+                  for r in checked for name in r.result)
+    missing = [leaf for leaf in leaves if leaf not in present]
+
+    def _make(path):
+        began = time.time()
+        try:
+            return TransferResult(path, result=_mkdir(agave_client, path,
+                                                      system_id),
+                                  elapsed=time.time() - began)
+        except Exception as exc:
+            logger.warning('mkdir of {} failed: {}'.format(path, exc))
+            return TransferResult(path, exception=exc,
+                                  elapsed=time.time() - began)
+
+    report = _run(_make, missing, max_workers)
+    report = TransferReport(report.results, time.time() - start,
+                            skipped=sorted(present))
+    logger.info('created {} directories in {:.3f}s ({} existed, {} failed)'
+                .format(len(report.succeeded), report.elapsed,
+                        len(report.skipped), len(report.failed)))
+    return report
@@ -0,0 +1,254 @@
+"""
+Circuit breakers shared by every caller of an Agave API
+
+Each family of endpoints (files, permissions, actors) has one breaker per
+process. It records the outcome of recent calls and opens once their error
+rate passes ``BACANORA_CIRCUIT_ERROR_RATE``. While open, calls fail at once
+with ``CircuitOpen`` instead of adding load to a struggling service, and
+bacanora's retry decorators give up rather than wait out
+``BACANORA_RETRY_MAX_DELAY``. After ``BACANORA_CIRCUIT_RESET_TIMEOUT``
+seconds a trickle of half-open calls is let through; if they succeed the
+breaker closes again.
+
+Only failures that point at the service count against it: connection
+errors, timeouts and 5xx or 429 responses. A 404 is a successful call.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from requests.exceptions import HTTPError, RequestException
+
+from . import logger as loggermodule
+from . import settings
+
+logger = loggermodule.get_logger(__name__)
+
+__all__ = ['CircuitBreaker', 'CircuitOpen', 'get', 'guard', 'is_open',
+           'retryable', 'state', 'reset', 'FILES', 'PERMISSIONS', 'ACTORS',
+           'CLOSED', 'OPEN', 'HALF_OPEN']
+
+CIRCUIT_BREAKER = settings.CIRCUIT_BREAKER
+CIRCUIT_ERROR_RATE = settings.CIRCUIT_ERROR_RATE
+CIRCUIT_WINDOW = settings.CIRCUIT_WINDOW
+CIRCUIT_MIN_CALLS = settings.CIRCUIT_MIN_CALLS
+CIRCUIT_RESET_TIMEOUT = settings.CIRCUIT_RESET_TIMEOUT
+CIRCUIT_HALF_OPEN_CALLS = settings.CIRCUIT_HALF_OPEN_CALLS
+
+FILES = 'files'
+PERMISSIONS = 'permissions'
+ACTORS = 'actors'
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpen(Exception):
+    """An API call was refused because its circuit breaker is open"""
+    pass
+
+
+def failed_status(status):
+    """Whether an HTTP status code counts against the service"""
+    return status is None or status >= 500 or status == 429
+
+
+def is_failure(exc):
+    """Whether an exception from an API call counts against the service"""
+    if isinstance(exc, HTTPError):
+        return failed_status(getattr(exc.response, 'status_code', None))
+    return isinstance(exc, RequestException)
+
+
+def retryable(exc):
+    """Retry predicate for tenacity: anything but an open circuit"""
+    return not isinstance(exc, CircuitOpen)
+
+
+class _Call(object):
+    """Outcome of one guarded call; ``failed`` overrides the default"""
+    __slots__ = ('failed',)
+
+    def __init__(self):
+        self.failed = None
+
+
+class CircuitBreaker(object):
+    """Thread-safe breaker over a sliding window of call outcomes
+
+    Arguments:
+        name (str): Endpoint family the breaker protects
+        error_rate (float, optional): Failed fraction of the window that opens the breaker [BACANORA_CIRCUIT_ERROR_RATE]
+        window (int, optional): Recent calls considered [BACANORA_CIRCUIT_WINDOW]
+        min_calls (int, optional): Calls needed in the window before it can open [BACANORA_CIRCUIT_MIN_CALLS]
+        reset_timeout (float, optional): Seconds open before probing [BACANORA_CIRCUIT_RESET_TIMEOUT]
+        half_open_calls (int, optional): Concurrent probes, and successes needed to close [BACANORA_CIRCUIT_HALF_OPEN_CALLS]
+        enabled (bool, optional): Whether the breaker ever opens [BACANORA_CIRCUIT_BREAKER]
+    """
+
+    def __init__(self, name, error_rate=None, window=None, min_calls=None,
+                 reset_timeout=None, half_open_calls=None, enabled=None):
+        self.name = name
+        self.error_rate = CIRCUIT_ERROR_RATE if error_rate is None \
+            else error_rate
+        self.min_calls = CIRCUIT_MIN_CALLS if min_calls is None else min_calls
+        self.reset_timeout = CIRCUIT_RESET_TIMEOUT if reset_timeout is None \
+            else reset_timeout
+        self.half_open_calls = max(1, CIRCUIT_HALF_OPEN_CALLS
+                                   if half_open_calls is None
+                                   else half_open_calls)
+        self.enabled = CIRCUIT_BREAKER if enabled is None else enabled
+        self._outcomes = deque(maxlen=max(1, CIRCUIT_WINDOW
+                                          if window is None else window))
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        self.trips = 0
+        self.rejected = 0
+
+    def _trip(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._probes = 0
+        self._outcomes.clear()
+        self.trips += 1
+        logger.warning('{} API circuit opened for {}s'.format(
+            self.name, self.reset_timeout))
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and \
+                    time.monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """Admit one call, or raise ``CircuitOpen``"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._state == OPEN:
+                waited = time.monotonic() - self._opened_at
+                if waited < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpen(
+                        '{} API circuit is open; retry in {:.0f}s'.format(
+                            self.name, self.reset_timeout - waited))
+                self._state = HALF_OPEN
+                self._probes = 0
+                self._probe_successes = 0
+                logger.info('{} API circuit half-open'.format(self.name))
+            if self._state == HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    self.rejected += 1
+                    raise CircuitOpen(
+                        '{} API circuit is half-open; probe in progress'
+                        .format(self.name))
+                self._probes += 1
+
+    def record(self, ok):
+        """Record the outcome of a call admitted by ``allow()``"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                if not ok:
+                    self._trip()
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_calls:
+                        self._state = CLOSED
+                        logger.info('{} API circuit closed'.format(self.name))
+                return
+            if self._state == OPEN:
+                # Started before the breaker opened
+                return
+            self._outcomes.append(ok)
+            calls = len(self._outcomes)
+            if calls >= self.min_calls and \
+                    self._outcomes.count(False) >= self.error_rate * calls:
+                self._trip()
+
+    @contextmanager
+    def guard(self):
+        """Admit, run and record one API call
+
+        Raised exceptions are classified with ``is_failure()``. A call that
+        returns an error response without raising can set ``failed`` on
+        the yielded object.
+        """
+        self.allow()
+        call = _Call()
+        try:
+            yield call
+        except Exception as exc:
+            if call.failed is None:
+                call.failed = is_failure(exc)
+            raise
+        finally:
+            self.record(not call.failed)
+
+    def reset(self):
+        with self._lock:
+            self._state = CLOSED
+            self._outcomes.clear()
+            self._probes = 0
+            self.trips = 0
+            self.rejected = 0
+
+    def stats(self):
+        """Current state and counters, for monitoring"""
+        state = self.state
+        with self._lock:
+            calls = len(self._outcomes)
+            failures = self._outcomes.count(False)
+            retry_in = 0.0
+            if state == OPEN:
+                retry_in = max(0.0, self.reset_timeout -
+                               (time.monotonic() - self._opened_at))
+            return {'state': state,
+                    'calls': calls,
+                    'failures': failures,
+                    'error_rate': failures / calls if calls else 0.0,
+                    'trips': self.trips,
+                    'rejected': self.rejected,
+                    'retry_in': retry_in}
+
+    def __repr__(self):
+        return '<CircuitBreaker {} {}>'.format(self.name, self.state)
+
+
+breakers = {name: CircuitBreaker(name)
+            for name in (FILES, PERMISSIONS, ACTORS)}
+
+
+def get(family):
+    """The process-wide breaker for an endpoint family"""
+    return breakers[family]
+
+
+def guard(family):
+    """Context manager that admits, runs and records one API call"""
+    return breakers[family].guard()
+
+
+def is_open(family):
+    """Whether calls to an endpoint family are currently refused"""
+    return breakers[family].state == OPEN
+
+
+def state():
+    """Stats for every breaker, keyed by endpoint family"""
+    return {name: breaker.stats() for name, breaker in breakers.items()}
+
+
+def reset():
+    """Close every breaker and clear its history"""
+    for breaker in breakers.values():
+        breaker.reset()
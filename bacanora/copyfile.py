@@ -0,0 +1,167 @@
+"""
+In-kernel file copies for the direct POSIX path
+
+Copies are made with ``os.copy_file_range`` where available, then
+``os.sendfile``, then a buffered read/write loop. Only the data extents of
+the source are copied, so sparse files stay sparse.
+"""
+import errno
+import os
+import shutil
+
+from . import logger as loggermodule
+from . import settings
+
+logger = loggermodule.get_logger(__name__)
+
+__all__ = ['copy', 'copyfile', 'COPY_FILE_RANGE', 'SENDFILE', 'BUFFERED']
+
+COPY_FILE_RANGE = 'copy_file_range'
+SENDFILE = 'sendfile'
+BUFFERED = 'buffered'
+
+# Largest count passed to a single copy syscall (sendfile caps at 0x7ffff000)
+MAX_SYSCALL_CHUNK = 0x40000000
+COPY_BUFFER_SIZE = settings.COPY_BUFFER_SIZE
+
+# Errors meaning "this syscall can't do this copy", not "the copy failed"
+FALLBACK_ERRNOS = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EBADF,
+                   errno.EOPNOTSUPP, errno.ETXTBSY, errno.EPERM}
+
+# Methods the running kernel has reported as not implemented
+_UNSUPPORTED = set()
+
+
+def _methods():
+    methods = []
+    if hasattr(os, 'copy_file_range') and COPY_FILE_RANGE not in _UNSUPPORTED:
+        methods.append(COPY_FILE_RANGE)
+    if hasattr(os, 'sendfile') and SENDFILE not in _UNSUPPORTED:
+        methods.append(SENDFILE)
+    methods.append(BUFFERED)
+    return methods
+
+
+def _data_extents(fd, size):
+    """Yield (offset, length) for each region of ``fd`` that holds data"""
+    if not hasattr(os, 'SEEK_DATA') or size == 0:
+        if size > 0:
+            yield 0, size
+        return
+    pos = 0
+    while pos < size:
+        try:
+            data = os.lseek(fd, pos, os.SEEK_DATA)
+        except OSError as exc:
+            if exc.errno == errno.ENXIO:
+                return
+            # Filesystem can't report holes, so treat the rest as data
+            yield pos, size - pos
+            return
+        hole = min(os.lseek(fd, data, os.SEEK_HOLE), size)
+        if hole > data:
+            yield data, hole - data
+        pos = hole
+
+
+def _copy_file_range(fsrc, fdst, offset, length):
+    copied = 0
+    while copied < length:
+        count = min(length - copied, MAX_SYSCALL_CHUNK)
+        sent = os.copy_file_range(fsrc.fileno(), fdst.fileno(), count,
+                                  offset + copied, offset + copied)
+        if sent == 0:
+            break
+        copied += sent
+    return copied
+
+
+def _sendfile(fsrc, fdst, offset, length):
+    copied = 0
+    os.lseek(fdst.fileno(), offset, os.SEEK_SET)
+    while copied < length:
+        count = min(length - copied, MAX_SYSCALL_CHUNK)
+        sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset + copied, count)
+        if sent == 0:
+            break
+        copied += sent
+    return copied
+
+
+def _buffered(fsrc, fdst, offset, length, buffer_size=None):
+    if buffer_size is None:
+        buffer_size = COPY_BUFFER_SIZE
+    buf = bytearray(min(buffer_size, length))
+    view = memoryview(buf)
+    copied = 0
+    fsrc.seek(offset)
+    fdst.seek(offset)
+    while copied < length:
+        count = fsrc.readinto(view[:min(len(buf), length - copied)])
+        if not count:
+            break
+        written = 0
+        while written < count:
+            written += fdst.write(view[written:count])
+        copied += count
+    return copied
+
+
+COPIERS = {COPY_FILE_RANGE: _copy_file_range,
+           SENDFILE: _sendfile,
+           BUFFERED: _buffered}
+
+
+def _copy_extent(fsrc, fdst, offset, length, methods):
+    """Copy one extent, dropping to the next method when a syscall refuses"""
+    done = 0
+    while methods:
+        method = methods[0]
+        try:
+            done += COPIERS[method](fsrc, fdst, offset + done, length - done)
+            return done
+        except OSError as exc:
+            if method == BUFFERED or exc.errno not in FALLBACK_ERRNOS:
+                raise
+            if exc.errno == errno.ENOSYS:
+                _UNSUPPORTED.add(method)
+            logger.debug('{} unavailable ({}), falling back'.format(
+                method, errno.errorcode.get(exc.errno, exc.errno)))
+            methods.pop(0)
+    return done
+
+
+def copyfile(src, dst, methods=None):
+    """Copy the contents of ``src`` to ``dst``, preserving holes
+
+    Arguments:
+        src (str): Path of the source file
+        dst (str): Path of the destination file, replaced if it exists
+        methods (list, optional): Copy methods to try, in order [all available]
+
+    Returns:
+        str: The method that completed the copy
+    """
+    methods = list(methods) if methods is not None else _methods()
+    with open(src, 'rb', buffering=0) as fsrc, \
+            open(dst, 'wb', buffering=0) as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        for offset, length in _data_extents(fsrc.fileno(), size):
+            copied = _copy_extent(fsrc, fdst, offset, length, methods)
+            if copied != length:
+                raise OSError(errno.EIO, 'Short copy of {} at offset {}: {} of {} bytes'.format(
+                    src, offset, copied, length))
+        # Trailing holes are restored by extending to the source size
+        fdst.truncate(size)
+    return methods[0] if methods else BUFFERED
+
+
+def copy(src, dst, methods=None):
+    """Drop-in for ``shutil.copy`` between two file paths
+
+    Returns:
+        str: The destination path
+    """
+    copyfile(src, dst, methods=methods)
+    shutil.copymode(src, dst)
+    return dst
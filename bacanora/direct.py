@@ -1,11 +1,24 @@
 import os
 import datetime
-import shutil
+import threading
+import time
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from . import copyfile
 from . import runtimes
+from . import settings
+from . import storagesystems
 from . import logger as loggermodule
+from .metadata import StatResult
 
 logger = loggermodule.get_logger(__name__)
 
+MAX_WORKERS = settings.MAX_WORKERS
+DIRECT_HEALTH_TTL = settings.DIRECT_HEALTH_TTL
+DIRECT_AUTHORITATIVE = settings.DIRECT_AUTHORITATIVE
+# Files unlinked per task when clearing large directories
+UNLINK_BATCH = 512
+
 class DirectOperationFailed(Exception):
     pass
 
@@ -15,16 +28,85 @@ class UnknownRuntime(DirectOperationFailed):
 class UnknownStorageSystem(DirectOperationFailed):
     pass
 
-class StorageSystems():
-    prefixes = {'data-sd2e-community': {'hpc': '/work2/projects/SD2E-Community/prod/data',
-                                        'abaco': '/work/projects/SD2E-Community/prod/data',
-                                        'jupyter': os.path.join(
-                                            os.path.expanduser('~'), 'sd2e-community')}}
+class MountUnavailable(DirectOperationFailed):
+    pass
+
+class _RegistryView(type):
+    @property
+    def prefixes(cls):
+        return MappingProxyType({system_id: MappingProxyType(dict(runtimes))
+                                 for system_id, runtimes in
+                                 storagesystems.registry.prefixes.items()})
+
+class StorageSystems(metaclass=_RegistryView):
+    """Read-only view of the prefixes in storagesystems.registry
+
+    Kept for code that read the old prefixes table. Changing it never had
+    an effect on lookups; use storagesystems.registry.register() instead.
+    """
+
+# (system_id, runtime) -> (prefix, healthy, expires)
+_mounts = {}
+_mounts_lock = threading.Lock()
+
+def _probe(prefix):
+    """A mount is healthy if its prefix is a directory with something in it
+
+    An unmounted network filesystem usually leaves an empty mountpoint
+    behind, which must not be mistaken for an empty storage system.
+    """
+    try:
+        with os.scandir(prefix) as entries:
+            return next(entries, None) is not None
+    except OSError:
+        return False
+
+def mount_healthy(system_id, environment, prefix):
+    """Whether a storage system's prefix is usable, cached for BACANORA_DIRECT_HEALTH_TTL"""
+    key = (system_id, str(environment))
+    now = time.monotonic()
+    cached = _mounts.get(key)
+    if cached is not None and cached[0] == prefix and cached[2] > now:
+        return cached[1]
+    healthy = _probe(prefix)
+    if cached is None or cached[1] != healthy:
+        logger.info('{} mount at {} is {}'.format(
+            system_id, prefix, 'healthy' if healthy else 'unavailable'))
+    with _mounts_lock:
+        _mounts[key] = (prefix, healthy, now + DIRECT_HEALTH_TTL)
+    return healthy
+
+def forget_health(system_id=None):
+    """Re-probe a storage system's mount, or every mount, on next use"""
+    with _mounts_lock:
+        for key in list(_mounts):
+            if system_id is None or key[0] == system_id:
+                del _mounts[key]
+
+def available(system_id='data-sd2e-community'):
+    """Whether the direct path can serve a storage system right now
+
+    Only the cached prefix lookup and mount health check are consulted,
+    so this is cheap enough to call before every operation.
+    """
+    environ = runtimes.current()
+    try:
+        prefix = get_prefix(system_id, environ)
+    except UnknownStorageSystem:
+        return False
+    return mount_healthy(system_id, environ, prefix)
+
+def authoritative():
+    """Whether a negative answer from a healthy mount is final"""
+    return DIRECT_AUTHORITATIVE
 
 def abs_path(agave_file_path, system_id='data-sd2e-community'):
     logger.debug('agave_file_path: {}'.format(agave_file_path))
-    environ = runtimes.detect()
+    environ = runtimes.current()
     prefix = get_prefix(system_id, environ)
+    if not mount_healthy(system_id, environ, prefix):
+        raise MountUnavailable(
+            'Mount for {} at {} is unavailable'.format(system_id, prefix))
     if agave_file_path.startswith('/'):
         agave_file_path = agave_file_path[1:]
     full_path = os.path.join(prefix, agave_file_path)
@@ -32,19 +114,19 @@ def abs_path(agave_file_path, system_id='data-sd2e-community'):
     return full_path
 
 def get_prefix(storage_system, environment):
-    try:
-        return StorageSystems.prefixes[storage_system][environment]
-    except KeyError:
+    prefix = storagesystems.registry.resolve(storage_system, environment)
+    if prefix is None:
         raise UnknownStorageSystem(
             'Bacanora mapping for {} is not defined'.format(storage_system))
+    return prefix
 
 def get(file_to_download, local_filename, system_id='data-sd2e-community'):
     try:
-        full_path = abs_path(file_to_download)
+        full_path = abs_path(file_to_download, system_id=system_id)
         temp_local_filename = local_filename + '-' + str(int(datetime.datetime.utcnow().timestamp()))
         logger.debug('DIRECT_GET: {}'.format(full_path))
         if os.path.exists(full_path):
-            shutil.copy(full_path, temp_local_filename)
+            copyfile.copy(full_path, temp_local_filename)
         else:
             raise DirectOperationFailed('Remote source does not exist')
         try:
@@ -59,14 +141,14 @@ def get(file_to_download, local_filename, system_id='data-sd2e-community'):
 def put(file_to_upload, destination_path, system_id='data-sd2e-community'):
     try:
 
-        full_dest_path = abs_path(destination_path)
+        full_dest_path = abs_path(destination_path, system_id=system_id)
         filename = os.path.basename(file_to_upload)
         filename_atomic = filename + '-' + str(int(datetime.datetime.utcnow().timestamp()))
         atomic_dest_path = os.path.join(full_dest_path, filename_atomic)
         final_dest_path = os.path.join(full_dest_path, filename)
         logger.debug('DIRECT_PUT: {}'.format(atomic_dest_path))
         if os.path.exists(full_dest_path):
-            shutil.copy(file_to_upload, atomic_dest_path)
+            copyfile.copy(file_to_upload, atomic_dest_path)
         else:
             raise DirectOperationFailed('Remote destination does not exist')
         try:
@@ -78,53 +160,103 @@ def put(file_to_upload, destination_path, system_id='data-sd2e-community'):
     except UnknownStorageSystem as ustor:
         raise UnknownStorageSystem(ustor)
 
-def exists(path_to_test, system_id='data-sd2e-community'):
-    full_dest_path = abs_path(path_to_test)
+def stat(path_to_test, system_id='data-sd2e-community'):
+    """Stat a path with a single os.stat() call
+
+    Returns:
+        StatResult: Metadata for the path, or None if it does not exist
+    """
+    full_dest_path = abs_path(path_to_test, system_id=system_id)
     try:
-        if os.path.exists(full_dest_path):
-            return True
-        else:
-            return False
+        return StatResult.from_os(os.stat(full_dest_path),
+                                  path_to_test, system_id)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
     except Exception:
-        raise DirectOperationFailed('Unhandled failure with os.path.exists()')
+        # A stale or hung mount fails this way; check it again next time
+        forget_health(system_id)
+        raise DirectOperationFailed('Unhandled failure with os.stat()')
+
+def exists(path_to_test, system_id='data-sd2e-community'):
+    return stat(path_to_test, system_id=system_id) is not None
 
 def isfile(path_to_test, system_id='data-sd2e-community'):
-    full_dest_path = abs_path(path_to_test)
-    try:
-        if os.path.isfile(full_dest_path):
-            return True
-        else:
-            return False
-    except Exception:
-        raise DirectOperationFailed('Unhandled failure with os.path.isdir()')
+    record = stat(path_to_test, system_id=system_id)
+    return record is not None and record.is_file()
 
 def isdir(path_to_test, system_id='data-sd2e-community'):
-    full_dest_path = abs_path(path_to_test)
-    try:
-        if os.path.isdir(full_dest_path):
-            return True
-        else:
-            return False
-    except Exception:
-        raise DirectOperationFailed('Unhandled failure with os.path.isdir()')
+    record = stat(path_to_test, system_id=system_id)
+    return record is not None and record.is_dir()
 
 def mkdir(path_to_make, system_id='data-sd2e-community'):
-    full_dest_path = abs_path(path_to_make)
+    full_dest_path = abs_path(path_to_make, system_id=system_id)
     try:
         os.makedirs(full_dest_path)
         return True
     except Exception:
         raise DirectOperationFailed('Exception encountered with os.makedirs()')
 
+def _unlink_all(paths):
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+def rmtree(top, max_workers=None):
+    """Remove a directory tree using a pool of workers
+
+    Directories are scanned concurrently with os.scandir() and their
+    files unlinked in batches. The emptied directories are then removed
+    one depth level at a time, deepest first. Symlinks are removed, never
+    followed.
+    """
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+    levels = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        def _scan(path, depth):
+            subdirs, files = [], []
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    else:
+                        files.append(entry.path)
+            unlinks = [pool.submit(_unlink_all, files[i:i + UNLINK_BATCH])
+                       for i in range(0, len(files), UNLINK_BATCH)]
+            return path, depth, subdirs, unlinks
+
+        unlinks = []
+        pending = {pool.submit(_scan, top, 0)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, depth, subdirs, batches = future.result()
+                levels.setdefault(depth, []).append(path)
+                unlinks.extend(batches)
+                pending.update(pool.submit(_scan, subdir, depth + 1)
+                               for subdir in subdirs)
+        for future in unlinks:
+            future.result()
+        for depth in sorted(levels, reverse=True):
+            for future in [pool.submit(os.rmdir, path) for path in levels[depth]]:
+                future.result()
+
 def delete(path_to_rm, system_id='data-sd2e-community', recursive=True):
-    full_dest_path = abs_path(path_to_rm)
+    full_dest_path = abs_path(path_to_rm, system_id=system_id)
     try:
-        if os.path.isfile(full_dest_path):
+        if os.path.islink(full_dest_path) or os.path.isfile(full_dest_path):
             os.remove(full_dest_path)
             return True
         elif os.path.isdir(full_dest_path):
-            shutil.rmtree(full_dest_path)
+            if recursive:
+                rmtree(full_dest_path)
+            else:
+                os.rmdir(full_dest_path)
             return True
+        elif DIRECT_AUTHORITATIVE and not os.path.lexists(full_dest_path):
+            return False
         else:
             raise ValueError(
                 'path {} is not a file or directory'.format(path_to_rm))
@@ -0,0 +1,205 @@
+"""
+Content-addressed on-disk cache of API downloads, shareable between processes
+
+Objects are stored under ``<root>/objects`` named by a digest of the
+remote file's checksum when the listing supplies one, and otherwise of
+its storage system, path, size and modification time, so a changed
+remote file never matches a stale entry. New downloads are copied into
+the cache, so the caller's file keeps its own mode and mtime. Hits are
+hardlinked into place in ``link`` mode, giving the caller a read-only
+file, or copied in ``copy`` mode. Every hit changes the entry's inode
+change time, which drives least-recently-used eviction once the cache
+exceeds its size cap; unlike mtime, it can't be set back by a caller
+that owns a hardlinked copy.
+Inserts and evictions are serialized across processes with an exclusive
+``flock`` on ``<root>/lock``.
+"""
+import errno
+import hashlib
+import os
+import stat
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from . import copyfile
+from . import logger as loggermodule
+from . import settings
+
+logger = loggermodule.get_logger(__name__)
+
+__all__ = ['DownloadCache', 'cache', 'LINK', 'COPY']
+
+LINK = 'link'
+COPY = 'copy'
+
+
+class DownloadCache(object):
+    """Size-capped LRU cache of downloaded files
+
+    Arguments:
+        root (str): Cache directory, or None to disable the cache
+        max_bytes (int): Total size of cached objects before eviction
+        mode (str): ``link`` to hardlink hits into place, ``copy`` to copy them
+    """
+
+    def __init__(self, root=None, max_bytes=10 * 1024 ** 3, mode=LINK):
+        self.root = os.path.expanduser(root) if root else None
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.root is not None
+
+    @staticmethod
+    def key(system_id, path, size, mtime, checksum=None):
+        """Digest identifying one version of a remote file
+
+        A checksum identifies the content itself, so identical files at
+        different paths share one entry.
+        """
+        if checksum:
+            ident = '\0'.join(['checksum', str(checksum), str(size)])
+        else:
+            ident = '\0'.join([system_id, path, str(size),
+                               repr(float(mtime))])
+        return hashlib.sha256(ident.encode('utf-8')).hexdigest()
+
+    def _object(self, key):
+        return os.path.join(self.root, 'objects', key[:2], key)
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, 'lock'), 'a') as lockfile:
+            if fcntl is not None:
+                fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lockfile.fileno(), fcntl.LOCK_UN)
+
+    def _link_or_copy(self, source, temp):
+        """Hardlink ``source`` to ``temp`` in link mode, else copy it
+
+        Returns:
+            bool: True if the file was linked
+        """
+        if self.mode == LINK:
+            try:
+                os.link(source, temp)
+                return True
+            except OSError as exc:
+                if exc.errno not in (errno.EXDEV, errno.EPERM,
+                                     errno.EMLINK, errno.ENOTSUP):
+                    raise
+        copyfile.copyfile(source, temp)
+        return False
+
+    def _place(self, source, destination):
+        """Atomically put ``source`` at ``destination`` by link or copy"""
+        temp = os.path.join(os.path.dirname(os.path.abspath(destination)),
+                            '.bacanora-cache-' + uuid.uuid4().hex)
+        try:
+            if not self._link_or_copy(source, temp):
+                os.chmod(temp, 0o644)
+            os.rename(temp, destination)
+        except Exception:
+            try:
+                os.unlink(temp)
+            except OSError:
+                pass
+            raise
+
+    def fetch(self, key, destination):
+        """Serve a cached object into ``destination``
+
+        Returns:
+            bool: True on a cache hit
+        """
+        if not self.enabled:
+            return False
+        obj = self._object(key)
+        try:
+            self._place(obj, destination)
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        try:
+            os.utime(obj)
+        except OSError:
+            # Entries written by another user can't be touched; LRU is advisory
+            pass
+        self.hits += 1
+        logger.debug('download cache hit: {}'.format(key))
+        return True
+
+    def store(self, key, source):
+        """Add a freshly downloaded file to the cache"""
+        if not self.enabled:
+            return
+        obj = self._object(key)
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        temp = os.path.join(os.path.dirname(obj),
+                            '.incoming-' + uuid.uuid4().hex)
+        try:
+            # A copy, so the caller's file stays writable and its mtime
+            # stays out of the eviction order
+            copyfile.copyfile(source, temp)
+            # Read-only, so a hit hardlinked into place can't modify it
+            os.chmod(temp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            with self._locked():
+                os.rename(temp, obj)
+                self._evict()
+        except Exception:
+            try:
+                os.unlink(temp)
+            except OSError:
+                pass
+            raise
+
+    def _entries(self):
+        objects = os.path.join(self.root, 'objects')
+        for shard in os.scandir(objects) if os.path.isdir(objects) else []:
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield entry.path, st.st_size, st.st_ctime
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(e[1] for e in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+                logger.debug('evicted {} from download cache'.format(path))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        entries = list(self._entries()) if self.enabled else []
+        return {'hits': self.hits, 'misses': self.misses,
+                'objects': len(entries), 'bytes': sum(e[1] for e in entries),
+                'max_bytes': self.max_bytes, 'root': self.root}
+
+
+cache = DownloadCache(root=settings.DOWNLOAD_CACHE_DIR or None,
+                      max_bytes=settings.DOWNLOAD_CACHE_SIZE,
+                      mode=settings.DOWNLOAD_CACHE_MODE)
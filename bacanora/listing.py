@@ -0,0 +1,438 @@
+"""
+Directory listings that page through the files API
+
+``scandir()`` yields entries one page at a time and fetches the next page
+in the background while the current one is consumed, so memory use does
+not grow with the size of the directory. On the direct path it is a thin
+wrapper over ``os.scandir``. ``walk()`` lists the directories of a tree
+concurrently on a pool of workers.
+"""
+import os
+import posixpath
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.exceptions import HTTPError
+from tenacity import retry, retry_if_exception
+from tenacity import stop_after_delay
+from tenacity import wait_exponential
+
+from . import agaveutils
+from . import circuitbreaker
+from . import direct
+from . import logger as loggermodule
+from . import settings
+from .circuitbreaker import CircuitOpen
+from .direct import DirectOperationFailed
+from .metadata import StatResult, DIR, FILE, LISTING_TYPES
+
+logger = loggermodule.get_logger(__name__)
+
+__all__ = ['DirEntry', 'scandir', 'listdir', 'walk', 'walk_entries',
+           'TOPDOWN', 'COMPLETED']
+
+DEFAULT_STORAGE_SYSTEM = 'data-sd2e-community'
+RETRY_MAX_DELAY = settings.RETRY_MAX_DELAY
+RETRY_RERAISE = settings.RETRY_RERAISE
+FILES_LIST_PAGE_SIZE = settings.FILES_LIST_PAGE_SIZE
+MAX_WORKERS = settings.MAX_WORKERS
+WALK_MAX_BUFFERED = settings.WALK_MAX_BUFFERED
+
+TOPDOWN = 'topdown'
+COMPLETED = 'completed'
+
+
+def _retryable(exc):
+    if isinstance(exc, (FileNotFoundError, NotADirectoryError, CircuitOpen)):
+        return False
+    if isinstance(exc, HTTPError):
+        status = getattr(exc.response, 'status_code', None)
+        return status is None or status >= 500 or status == 429
+    return True
+
+
+class DirEntry(object):
+    """One entry of a remote directory, in the manner of ``os.DirEntry``
+
+    Arguments:
+        name (str): Entry name within its directory
+        path (str): Agave-absolute path of the entry
+        system_id (str): Storage system of the entry
+        listing (dict, optional): The files.list record for the entry
+        entry (os.DirEntry, optional): The entry from a direct-path scan
+    """
+    __slots__ = ('name', 'path', 'system_id', '_listing', '_entry', '_stat')
+
+    def __init__(self, name, path, system_id, listing=None, entry=None):
+        self.name = name
+        self.path = path
+        self.system_id = system_id
+        self._listing = listing
+        self._entry = entry
+        self._stat = None
+
+    def is_dir(self):
+        if self._entry is not None:
+            return self._entry.is_dir()
+        return LISTING_TYPES.get(self._listing.get('format')) == DIR
+
+    def is_symlink(self):
+        """Whether the entry is a symbolic link; the files API never says so"""
+        return self._entry is not None and self._entry.is_symlink()
+
+    def is_file(self):
+        if self._entry is not None:
+            return self._entry.is_file()
+        return LISTING_TYPES.get(self._listing.get('format')) == FILE
+
+    def stat(self):
+        """StatResult for the entry; costs one os.stat on the direct path"""
+        if self._stat is None:
+            if self._entry is not None:
+                self._stat = StatResult.from_os(self._entry.stat(), self.path,
+                                                self.system_id)
+            else:
+                self._stat = StatResult.from_listing(self._listing, self.path,
+                                                     self.system_id)
+        return self._stat
+
+    def __repr__(self):
+        return '<DirEntry {!r}>'.format(self.name)
+
+
+@retry(retry=retry_if_exception(_retryable), reraise=RETRY_RERAISE,
+       stop=stop_after_delay(RETRY_MAX_DELAY), wait=wait_exponential(multiplier=2, max=64))
+def _page(agave_client, path, system_id, page_size, offset):
+    try:
+        return agaveutils.files.list_page(agave_client, path, system_id,
+                                          page_size, offset=offset)
+    except HTTPError as herr:
+        if getattr(herr.response, 'status_code', None) == 404:
+            raise FileNotFoundError(
+                'No such directory: agave://{}{}'.format(system_id, path))
+        raise
+
+
+def _direct_entries(iterator, path, system_id):
+    with iterator:
+        for entry in iterator:
+            yield DirEntry(entry.name, posixpath.join(path, entry.name),
+                           system_id, entry=entry)
+
+
+def _api_entries(agave_client, path, system_id, page_size, page):
+    pool = ThreadPoolExecutor(max_workers=1)
+    offset = 0
+    try:
+        while page:
+            offset += len(page)
+            upcoming = None
+            if len(page) >= page_size:
+                upcoming = pool.submit(_page, agave_client, path, system_id,
+                                       page_size, offset)
+            for listing in page:
+                name = listing.get('name')
+                if name == '.':
+                    continue
+                yield DirEntry(name, posixpath.join(path, name), system_id,
+                               listing=listing)
+            page = upcoming.result() if upcoming is not None else None
+    finally:
+        pool.shutdown(wait=False)
+
+
+def scandir(agave_client, path, system_id=DEFAULT_STORAGE_SYSTEM,
+            page_size=None):
+    """Iterate over the entries of a remote directory
+
+    The first page is fetched before returning, so a missing directory is
+    reported immediately. Later pages are requested in the background one
+    page ahead of the caller.
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        path (str): Agave-absolute path of the directory
+        system_id (str, optional): Storage system where files are located [data-sd2e-community]
+        page_size (int, optional): Entries per files.list call [BACANORA_FILES_LIST_PAGE_SIZE]
+
+    Raises:
+        FileNotFoundError: The directory does not exist
+        NotADirectoryError: The path is a file
+
+    Returns:
+        iterator: ``DirEntry`` objects in listing order, excluding ``.``
+    """
+    logger.info('bacanora.scandir()')
+    path = '/' + path.strip('/')
+    try:
+        iterator = os.scandir(direct.abs_path(path, system_id=system_id))
+        return _direct_entries(iterator, path, system_id)
+    except (FileNotFoundError, NotADirectoryError):
+        if direct.authoritative() or \
+                circuitbreaker.is_open(circuitbreaker.FILES):
+            logger.debug('trusting direct path: {} is not a directory'
+                         .format(path))
+            raise
+        logger.info('using Agave API')
+    except (DirectOperationFailed, OSError) as exc:
+        logger.info('using Agave API')
+        logger.debug('direct scandir unavailable: {}'.format(exc))
+    page_size = max(2, page_size or FILES_LIST_PAGE_SIZE)
+    page = _page(agave_client, path, system_id, page_size, 0)
+    if len(page) == 1 and page[0].get('name') != '.' and \
+            LISTING_TYPES.get(page[0].get('format')) == FILE:
+        # Listing a file returns just the file itself
+        raise NotADirectoryError(
+            'Not a directory: agave://{}{}'.format(system_id, path))
+    return _api_entries(agave_client, path, system_id, page_size, page)
+
+
+def listdir(agave_client, path, system_id=DEFAULT_STORAGE_SYSTEM,
+            page_size=None):
+    """List the names in a remote directory
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        path (str): Agave-absolute path of the directory
+        system_id (str, optional): Storage system where files are located [data-sd2e-community]
+        page_size (int, optional): Entries per files.list call [BACANORA_FILES_LIST_PAGE_SIZE]
+
+    Raises:
+        FileNotFoundError: The directory does not exist
+        NotADirectoryError: The path is a file
+
+    Returns:
+        list: Entry names in listing order, excluding ``.``
+    """
+    logger.info('bacanora.listdir()')
+    return [entry.name for entry in scandir(agave_client, path,
+                                            system_id=system_id,
+                                            page_size=page_size)]
+
+
+class _Walker(object):
+    """Lists directories on a thread pool, each listing queueing its children
+
+    Results are published keyed by path in completion order. A directory
+    that the caller pruned, or anything below it, is not listed. At most
+    ``max_buffered`` listings are running or waiting to be taken at once;
+    further directories wait as paths until the caller catches up, except
+    one the caller is waiting for, which starts straight away.
+    """
+
+    def __init__(self, agave_client, system_id, max_workers, page_size,
+                 followlinks, max_buffered=None):
+        self.client = agave_client
+        self.system_id = system_id
+        self.page_size = page_size
+        self.followlinks = followlinks
+        self.pool = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        self.limit = max(1, max_workers, max_buffered or WALK_MAX_BUFFERED)
+        self.cond = threading.Condition()
+        self.done = {}
+        self.order = []
+        self.pending = 0
+        self.active = 0
+        self.deferred = deque()
+        self.pruned = set()
+        self.closed = False
+
+    def _is_pruned(self, path):
+        while path not in self.pruned:
+            parent = posixpath.dirname(path)
+            if parent == path:
+                return False
+            path = parent
+        return True
+
+    def _start(self, path):
+        """Begin listing ``path``; called with ``cond`` held"""
+        self.active += 1
+        self.pool.submit(self._list, path)
+
+    def _drop(self):
+        """Forget one pending listing; called with ``cond`` held"""
+        self.pending -= 1
+        self.cond.notify_all()
+
+    def _release(self):
+        """Free a slot taken by a consumed listing and fill any free slots"""
+        self.active -= 1
+        while self.deferred and self.active < self.limit and not self.closed:
+            path = self.deferred.popleft()
+            if self._is_pruned(path):
+                self._drop()
+            else:
+                self._start(path)
+
+    def submit(self, path, reserved=False):
+        """Queue a listing; ``reserved`` if it is already counted as pending"""
+        with self.cond:
+            if self.closed or self._is_pruned(path):
+                if reserved:
+                    self._drop()
+                return
+            if not reserved:
+                self.pending += 1
+            if self.active < self.limit:
+                self._start(path)
+            else:
+                self.deferred.append(path)
+                # take() may be waiting for exactly this path
+                self.cond.notify_all()
+
+    def _list(self, path):
+        dirs, files, exc = [], [], None
+        try:
+            for entry in scandir(self.client, path, system_id=self.system_id,
+                                 page_size=self.page_size):
+                if entry.is_dir():
+                    dirs.append(entry)
+                else:
+                    files.append(entry)
+        except Exception as err:
+            exc = err
+        children = [entry.path for entry in dirs
+                    if self.followlinks or not entry.is_symlink()]
+        # Publish before queueing the children so a parent is always
+        # available first, and so pruning can stop them being listed
+        with self.cond:
+            if self._is_pruned(path):
+                # Pruned while it was being listed; nobody will take it
+                self._release()
+                self._drop()
+                return
+            self.done[path] = (dirs, files, exc)
+            self.order.append(path)
+            self.pending += len(children) - 1
+            self.cond.notify_all()
+        for child in children:
+            self.submit(child, reserved=True)
+
+    def take(self, path=None):
+        """Wait for the listing of ``path``, or of any directory if None
+
+        Returns:
+            tuple: ``(path, dirs, files, exc)``, or None once all are consumed
+        """
+        with self.cond:
+            while True:
+                if path is not None and path in self.done:
+                    self.order.remove(path)
+                    self._release()
+                    return (path,) + self.done.pop(path)
+                if path is not None and path in self.deferred:
+                    # The caller needs it next, so it may exceed the limit
+                    self.deferred.remove(path)
+                    self._start(path)
+                while path is None and self.order:
+                    found = self.order.pop(0)
+                    result = self.done.pop(found)
+                    self._release()
+                    if not self._is_pruned(found):
+                        return (found,) + result
+                if path is None and self.pending == 0:
+                    return None
+                self.cond.wait()
+
+    def prune(self, path):
+        with self.cond:
+            self.pruned.add(path)
+            # Finished listings below it will never be taken
+            for found in [p for p in self.order if self._is_pruned(p)]:
+                self.order.remove(found)
+                del self.done[found]
+                self._release()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.deferred.clear()
+        self.pool.shutdown(wait=False)
+
+
+def walk_entries(agave_client, top, system_id=DEFAULT_STORAGE_SYSTEM,
+                 order=TOPDOWN, max_workers=None, page_size=None,
+                 onerror=None, followlinks=False):
+    """Like ``walk()``, but yields lists of ``DirEntry`` instead of names
+
+    Removing entries from the yielded directory list prunes the walk.
+    """
+    if order not in (TOPDOWN, COMPLETED):
+        raise ValueError('Unknown walk order {!r}'.format(order))
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+    top = '/' + top.strip('/')
+    walker = _Walker(agave_client, system_id, max_workers, page_size,
+                     followlinks)
+    stack = [top]
+    try:
+        walker.submit(top)
+        while True:
+            if order == TOPDOWN:
+                if not stack:
+                    return
+                result = walker.take(stack.pop())
+            else:
+                result = walker.take()
+                if result is None:
+                    return
+            path, dirs, files, exc = result
+            if exc is not None:
+                if onerror is not None:
+                    onerror(exc)
+                continue
+            listed = list(dirs)
+            yield path, dirs, files
+            kept = set(id(entry) for entry in dirs)
+            for entry in listed:
+                if id(entry) not in kept:
+                    walker.prune(entry.path)
+            if order == TOPDOWN:
+                # Only directories the walker has already queued can be taken
+                stack.extend(entry.path for entry in reversed(listed)
+                             if id(entry) in kept and
+                             (followlinks or not entry.is_symlink()))
+    finally:
+        walker.close()
+
+
+def walk(agave_client, top, system_id=DEFAULT_STORAGE_SYSTEM, order=TOPDOWN,
+         max_workers=None, page_size=None, onerror=None, followlinks=False):
+    """Generate the names in a remote directory tree, in the manner of ``os.walk``
+
+    Directories are listed concurrently; every finished listing queues
+    its subdirectories, so independent subtrees proceed in parallel.
+    With ``order='topdown'`` results are yielded in the same order as
+    ``os.walk``. With ``order='completed'`` each directory is yielded as
+    soon as its listing arrives, parents always before their children.
+    Removing names from ``dirnames`` in place prunes the walk.
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        top (str): Agave-absolute path of the directory to walk
+        system_id (str, optional): Storage system where files are located [data-sd2e-community]
+        order (str, optional): ``topdown`` or ``completed`` [topdown]
+        max_workers (int, optional): Concurrent directory listings [BACANORA_MAX_WORKERS]
+        page_size (int, optional): Entries per files.list call [BACANORA_FILES_LIST_PAGE_SIZE]
+        onerror (callable, optional): Called with the exception when a listing fails
+        followlinks (bool, optional): Descend into symlinked directories on the direct path [False]
+
+    Returns:
+        iterator: ``(dirpath, dirnames, filenames)`` tuples
+    """
+    logger.info('bacanora.walk()')
+    entries = walk_entries(agave_client, top, system_id=system_id, order=order,
+                           max_workers=max_workers, page_size=page_size,
+                           onerror=onerror, followlinks=followlinks)
+    try:
+        for path, dirs, files in entries:
+            dirnames = [entry.name for entry in dirs]
+            yield path, dirnames, [entry.name for entry in files]
+            if len(dirnames) != len(dirs) or \
+                    any(a != b.name for a, b in zip(dirnames, dirs)):
+                kept = set(dirnames)
+                dirs[:] = [entry for entry in dirs if entry.name in kept]
+    finally:
+        entries.close()
@@ -0,0 +1,202 @@
+"""
+Path metadata records and an opt-in cache for them
+"""
+import calendar
+import posixpath
+import re
+import stat as statmodule
+import threading
+import time
+from collections import OrderedDict
+
+from . import settings
+
+__all__ = ['StatResult', 'MetadataCache', 'cache', 'normpath',
+           'FILE', 'DIR', 'OTHER']
+
+FILE = 'file'
+DIR = 'dir'
+OTHER = 'other'
+
+LISTING_TYPES = {'folder': DIR, 'raw': FILE, 'file': FILE}
+
+TIMESTAMP_REGEX = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(\.\d+)?'
+    r'(Z|[+-]\d{2}:?\d{2})?$')
+
+
+def normpath(path):
+    """Normalize an Agave-absolute path for use as a cache key"""
+    return posixpath.normpath('/' + path.lstrip('/'))
+
+
+def parse_timestamp(value):
+    """Convert an Agave ISO-8601 lastModified value to POSIX seconds"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = TIMESTAMP_REGEX.match(str(value).strip())
+    if match is None:
+        return None
+    fields = [int(f) for f in match.groups()[:6]]
+    seconds = float(calendar.timegm(tuple(fields)))
+    if match.group(7):
+        seconds += float(match.group(7))
+    offset = match.group(8)
+    if offset and offset != 'Z':
+        sign = -1 if offset[0] == '-' else 1
+        offset = offset[1:].replace(':', '')
+        seconds -= sign * (int(offset[:2]) * 3600 + int(offset[2:]) * 60)
+    return seconds
+
+
+class StatResult(object):
+    """Compact metadata record for a file or directory
+
+    Built from a single ``os.stat`` call on the direct path or a single
+    ``files.list`` entry from the Agave API. ``mode`` is only known on the
+    direct path, and ``permissions`` and ``checksum`` only from the API.
+    """
+    __slots__ = ('path', 'system_id', 'type', 'size', 'mtime', 'mode',
+                 'permissions', 'via', 'checksum')
+
+    def __init__(self, path, system_id, type, size=0, mtime=None, mode=None,
+                 permissions=None, via=None, checksum=None):
+        self.path = path
+        self.system_id = system_id
+        self.type = type
+        self.size = size
+        self.mtime = mtime
+        self.mode = mode
+        self.permissions = permissions
+        self.via = via
+        self.checksum = checksum
+
+    @classmethod
+    def from_os(cls, st, path, system_id):
+        if statmodule.S_ISDIR(st.st_mode):
+            path_type = DIR
+        elif statmodule.S_ISREG(st.st_mode):
+            path_type = FILE
+        else:
+            path_type = OTHER
+        return cls(path, system_id, path_type, size=st.st_size,
+                   mtime=st.st_mtime, mode=statmodule.S_IMODE(st.st_mode),
+                   via='direct')
+
+    @classmethod
+    def from_listing(cls, listing, path, system_id):
+        return cls(path, system_id,
+                   LISTING_TYPES.get(listing.get('format'), OTHER),
+                   size=listing.get('length', 0) or 0,
+                   mtime=parse_timestamp(listing.get('lastModified')),
+                   permissions=listing.get('permissions'),
+                   via='api', checksum=listing.get('checksum'))
+
+    def is_file(self):
+        return self.type == FILE
+
+    def is_dir(self):
+        return self.type == DIR
+
+    def __repr__(self):
+        return '<StatResult {}{} type={} size={} mtime={}>'.format(
+            self.system_id, self.path, self.type, self.size, self.mtime)
+
+
+class MetadataCache(object):
+    """TTL- and size-bounded LRU cache keyed by (system_id, path)
+
+    A cached value of ``None`` records that a path does not exist, so
+    negative answers are served from the cache as well. The cache is
+    inert until enabled.
+    """
+
+    def __init__(self, ttl=30, maxsize=10000, enabled=False):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def enable(self, ttl=None, maxsize=None):
+        if ttl is not None:
+            self.ttl = ttl
+        if maxsize is not None:
+            self.maxsize = maxsize
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        self.clear()
+
+    def get(self, system_id, path):
+        """Look up a path
+
+        Returns:
+            tuple: ``(hit, value)`` where ``hit`` is False on a miss
+        """
+        if not self.enabled:
+            return False, None
+        key = (system_id, normpath(path))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, system_id, path, value):
+        if not self.enabled:
+            return
+        key = (system_id, normpath(path))
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, system_id, path, parents=False, children=False):
+        """Drop a path and, optionally, its ancestors or descendants"""
+        if not self.enabled:
+            return
+        path = normpath(path)
+        with self._lock:
+            self._entries.pop((system_id, path), None)
+            if parents:
+                parent = path
+                while parent != '/':
+                    parent = posixpath.dirname(parent)
+                    self._entries.pop((system_id, parent), None)
+            if children:
+                prefix = path.rstrip('/') + '/'
+                for key in [k for k in self._entries
+                            if k[0] == system_id and k[1].startswith(prefix)]:
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters and current occupancy"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'size': len(self._entries),
+                    'maxsize': self.maxsize, 'ttl': self.ttl,
+                    'enabled': self.enabled}
+
+
+cache = MetadataCache(ttl=settings.METADATA_CACHE_TTL,
+                      maxsize=settings.METADATA_CACHE_SIZE,
+                      enabled=settings.METADATA_CACHE)
@@ -0,0 +1,434 @@
+"""
+In-process metrics for bacanora operations, in Prometheus text format
+
+Public operations are wrapped with ``instrument()``, which counts each
+call and times it, labeled by operation, the path that served it
+(``direct``, ``api`` or ``cache``, or ``none`` if it ended before
+choosing one), storage system and outcome. Bytes
+moved and tenacity retries are counted too. Collection is off unless
+``BACANORA_METRICS`` is set; disabled, an instrumented call costs two
+flag checks.
+
+``write()`` saves the current values for a node_exporter textfile
+collector, and ``serve()`` publishes them on a local HTTP endpoint. The
+``BACANORA_METRICS_FILE`` and ``BACANORA_METRICS_PORT`` settings do the
+same automatically, at exit and on import respectively.
+
+Functions added with ``add_sink()`` receive a record of every finished
+operation, even while the registry itself is disabled; ``bacanora.trace``
+uses this to log a per-call timeline.
+"""
+import atexit
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from . import circuitbreaker
+from . import logger as loggermodule
+from . import settings
+
+logger = loggermodule.get_logger(__name__)
+
+__all__ = ['Counter', 'Histogram', 'Registry', 'registry', 'instrument',
+           'via', 'transferred', 'retried', 'exposition', 'write', 'serve',
+           'add_sink', 'remove_sink']
+
+METRICS = settings.METRICS
+METRICS_FILE = settings.METRICS_FILE
+METRICS_PORT = settings.METRICS_PORT
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                    10.0, 30.0, 60.0, 120.0, 300.0)
+
+DIRECT = 'direct'
+API = 'api'
+CACHE = 'cache'
+NONE = 'none'
+
+# Arguments naming the remote path an operation acts on, as traced
+PATH_ARGUMENTS = ('file_to_download', 'destination_path', 'pems_grant_target',
+                  'path_to_stat', 'path_to_test', 'path_to_make', 'path_to_rm')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n') \
+        .replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = ['{}="{}"'.format(n, _escape(v)) for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append('{}="{}"'.format(*extra))
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    """Monotonic totals keyed by label values"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        return self._values.get(tuple(labels), 0)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield self.name, _labels(self.labelnames, labels), value
+
+
+class Histogram(object):
+    """Cumulative bucket counts, sum and count keyed by label values"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = \
+                    [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, labels=()):
+        series = self._values.get(tuple(labels))
+        return series[2] if series else 0
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2]))
+                           for k, v in self._values.items())
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, hits in zip(self.buckets + (float('inf'),), counts):
+                cumulative += hits
+                yield (self.name + '_bucket',
+                       _labels(self.labelnames, labels,
+                               ('le', _number(bound))), cumulative)
+            yield self.name + '_sum', _labels(self.labelnames, labels), total
+            yield self.name + '_count', _labels(self.labelnames, labels), count
+
+
+class Registry(object):
+    """The set of metrics bacanora maintains
+
+    Arguments:
+        enabled (bool, optional): Whether instrumented calls are recorded [BACANORA_METRICS]
+    """
+
+    def __init__(self, enabled=None):
+        self.enabled = METRICS if enabled is None else enabled
+        self.operations = Counter(
+            'bacanora_operations_total', 'Completed bacanora operations',
+            ('operation', 'path', 'system', 'outcome'))
+        self.duration = Histogram(
+            'bacanora_operation_duration_seconds',
+            'Wall time of bacanora operations, including retries',
+            ('operation', 'path', 'system', 'outcome'))
+        self.bytes = Counter(
+            'bacanora_bytes_total', 'Bytes downloaded or uploaded',
+            ('operation', 'path', 'system'))
+        self.retries = Counter(
+            'bacanora_retries_total', 'Attempts retried after a failure',
+            ('operation',))
+        self.metrics = [self.operations, self.duration, self.bytes,
+                        self.retries]
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+    def exposition(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP {} {}'.format(metric.name,
+                                               metric.documentation))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append('{}{} {}'.format(name, labels, _number(value)))
+        lines.append('# HELP bacanora_circuit_open Whether an API circuit '
+                     'breaker is refusing calls')
+        lines.append('# TYPE bacanora_circuit_open gauge')
+        for family, stats in sorted(circuitbreaker.state().items()):
+            lines.append('bacanora_circuit_open{{family="{}"}} {}'.format(
+                family, int(stats['state'] == circuitbreaker.OPEN)))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+_local = threading.local()
+_sinks = []
+
+
+def add_sink(sink):
+    """Pass a dict describing each finished operation to ``sink``
+
+    Sinks run on the calling thread, so they should only enqueue.
+    """
+    _sinks.append(sink)
+
+
+def remove_sink(sink):
+    try:
+        _sinks.remove(sink)
+    except ValueError:
+        pass
+
+
+def _active():
+    return registry.enabled or bool(_sinks)
+
+
+class _Operation(object):
+    __slots__ = ('path', 'bytes', 'retries')
+
+    def __init__(self):
+        self.path = None
+        self.bytes = 0
+        self.retries = None
+
+
+def _locator(func, candidates):
+    """Name, position and default of the first of ``candidates`` func takes"""
+    code = func.__code__
+    names = code.co_varnames[:code.co_argcount]
+    for name in candidates:
+        if name in names:
+            pos = names.index(name)
+            defaults = func.__defaults__ or ()
+            offset = pos - (len(names) - len(defaults))
+            return name, pos, defaults[offset] if offset >= 0 else None
+    return None, None, None
+
+
+def _argument(args, kwargs, locator):
+    """Value of a located argument in one call"""
+    name, pos, default = locator
+    if name is None:
+        return None
+    if name in kwargs:
+        return kwargs[name]
+    return args[pos] if len(args) > pos else default
+
+
+def instrument(func):
+    """Record calls to a public operation in ``registry``
+
+    The operation name is the function's name. Put it above any tenacity
+    decorator so a call is observed once however many attempts it takes.
+    """
+    operation = func.__name__
+    inner = getattr(func, '__wrapped__', func)
+    system_locator = _locator(inner, ('system_id',))
+    path_locator = _locator(inner, PATH_ARGUMENTS)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not registry.enabled and not _sinks:
+            return func(*args, **kwargs)
+        system = _argument(args, kwargs, system_locator)
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        op = _Operation()
+        stack.append(op)
+        outcome = 'error'
+        error = None
+        started = time.time()
+        start = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+            outcome = 'ok'
+            return result
+        except BaseException as exc:
+            error = type(exc).__name__
+            raise
+        finally:
+            elapsed = time.monotonic() - start
+            stack.pop()
+            route = op.path or NONE
+            if registry.enabled:
+                labels = (operation, route, system or '', outcome)
+                registry.operations.inc(labels)
+                registry.duration.observe(labels, elapsed)
+                if op.bytes:
+                    registry.bytes.inc((operation, route, system or ''),
+                                       op.bytes)
+            if _sinks:
+                target = _argument(args, kwargs, path_locator)
+                record = {'operation': operation,
+                          'path': target if isinstance(target, str)
+                          else None,
+                          'system': system,
+                          'route': route,
+                          'start': started,
+                          'end': started + elapsed,
+                          'elapsed': elapsed,
+                          'outcome': outcome,
+                          'error': error,
+                          'bytes': op.bytes,
+                          'retries': op.retries or [],
+                          'thread': threading.current_thread().name}
+                for sink in list(_sinks):
+                    try:
+                        sink(record)
+                    except Exception as exc:
+                        logger.debug('metrics sink failed: {}'.format(exc))
+    return wrapper
+
+
+def _current():
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+
+def via(path):
+    """Note the path serving the operation in progress on this thread"""
+    if _active():
+        op = _current()
+        if op is not None:
+            op.path = path
+
+
+def transferred(nbytes):
+    """Add to the bytes moved by the operation in progress on this thread"""
+    if _active():
+        op = _current()
+        if op is not None:
+            op.bytes += nbytes
+
+
+def retried(retry_state):
+    """tenacity ``before_sleep`` hook counting retried attempts"""
+    if registry.enabled:
+        registry.retries.inc((getattr(retry_state.fn, '__name__', ''),))
+    if _sinks:
+        op = _current()
+        if op is not None:
+            if op.retries is None:
+                op.retries = []
+            outcome = retry_state.outcome
+            exc = outcome.exception() if outcome is not None else None
+            action = retry_state.next_action
+            op.retries.append({
+                'attempt': retry_state.attempt_number,
+                'wait': action.sleep if action is not None else None,
+                'error': type(exc).__name__ if exc is not None else None})
+
+
+def exposition():
+    return registry.exposition()
+
+
+def write(filename=None):
+    """Atomically write the current metrics to a file
+
+    Arguments:
+        filename (str, optional): Destination [BACANORA_METRICS_FILE]
+
+    Returns:
+        str: The file written
+    """
+    filename = filename or METRICS_FILE
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp = tempfile.mkstemp(dir=directory, prefix='.bacanora-metrics-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(registry.exposition())
+        os.chmod(temp, 0o644)
+        os.rename(temp, filename)
+    except Exception:
+        os.unlink(temp)
+        raise
+    return filename
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = registry.exposition().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(port=None, addr='127.0.0.1'):
+    """Publish the metrics over HTTP from a daemon thread
+
+    Arguments:
+        port (int, optional): Port to listen on; 0 picks a free one [BACANORA_METRICS_PORT]
+        addr (str, optional): Address to bind [127.0.0.1]
+
+    Returns:
+        HTTPServer: The running server; ``server_address`` gives the port
+    """
+    server = _Server((addr, METRICS_PORT if port is None else port),
+                     _Handler)
+    thread = threading.Thread(target=server.serve_forever,
+                              name='bacanora-metrics', daemon=True)
+    thread.start()
+    logger.info('serving metrics on http://{}:{}/'.format(
+        *server.server_address))
+    return server
+
+
+if settings.TRACE_FILE:
+    from . import trace
+    trace.start(settings.TRACE_FILE)
+if registry.enabled and METRICS_FILE:
+    atexit.register(write)
+if registry.enabled and METRICS_PORT:
+    try:
+        serve()
+    except OSError as exc:
+        logger.warning('Unable to serve metrics on port {}: {}'.format(
+            METRICS_PORT, exc))
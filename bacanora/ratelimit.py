@@ -0,0 +1,51 @@
+"""
+Rate limiting shared by concurrent Agave API callers
+"""
+import threading
+import time
+
+__all__ = ['TokenBucket']
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket
+
+    Tokens accrue at ``rate`` per second up to ``burst``. Each call to
+    ``consume()`` blocks until enough tokens are available, so any number
+    of threads sharing one bucket are collectively held to ``rate``. A
+    ``rate`` of ``None`` or ``0`` disables limiting.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate) if rate else 0.0
+        if burst is None:
+            burst = max(1.0, self.rate)
+        self.burst = float(burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def consume(self, tokens=1):
+        """Take ``tokens`` from the bucket, sleeping until they are available
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
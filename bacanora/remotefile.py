@@ -0,0 +1,273 @@
+"""
+Seekable, read-only file objects over Agave-managed storage
+
+On the direct path these are plain POSIX files. Otherwise reads are served
+from HTTP Range requests against the files media endpoint. Fixed-size
+blocks are kept in a small LRU cache, and sequential access triggers
+background read-ahead of the following blocks.
+"""
+import io
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from agavepy.agave import AgaveError
+
+from . import agaveutils
+from . import direct
+from . import logger as loggermodule
+from . import settings
+from .agaveutils import rest
+from .direct import DirectOperationFailed
+
+logger = loggermodule.get_logger(__name__)
+
+__all__ = ['RemoteFile', 'open']
+
+DEFAULT_STORAGE_SYSTEM = 'data-sd2e-community'
+REMOTE_BLOCK_SIZE = settings.REMOTE_BLOCK_SIZE
+REMOTE_CACHE_BLOCKS = settings.REMOTE_CACHE_BLOCKS
+REMOTE_READAHEAD = settings.REMOTE_READAHEAD
+
+
+class RemoteFile(io.RawIOBase):
+    """Read-only, seekable view of a remote file backed by Range requests
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        path (str): Agave-absolute path of the file
+        system_id (str): Storage system where file is located
+        size (int): Size of the file in bytes
+        block_size (int, optional): Bytes per Range request [BACANORA_REMOTE_BLOCK_SIZE]
+        cache_blocks (int, optional): Blocks kept in memory [BACANORA_REMOTE_CACHE_BLOCKS]
+        readahead (int, optional): Blocks prefetched on sequential reads [BACANORA_REMOTE_READAHEAD]
+    """
+
+    def __init__(self, agave_client, path, system_id, size, block_size=None,
+                 cache_blocks=None, readahead=None):
+        super(RemoteFile, self).__init__()
+        self.client = agave_client
+        self.name = path
+        self.system_id = system_id
+        self.size = size
+        self.block_size = block_size or REMOTE_BLOCK_SIZE
+        self.cache_blocks = max(1, cache_blocks or REMOTE_CACHE_BLOCKS)
+        self.readahead = REMOTE_READAHEAD if readahead is None else readahead
+        self._pos = 0
+        self._last_block = None
+        self._blocks = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._pool = None
+        # Whether the server honors Range; otherwise one response is streamed
+        self._ranges = True
+        self._stream = None
+        self._stream_pos = 0
+        self._stream_lock = threading.Lock()
+        if self.readahead > 0:
+            self._pool = ThreadPoolExecutor(max_workers=self.readahead)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError('Invalid whence ({})'.format(whence))
+        if pos < 0:
+            raise ValueError('Negative seek position {}'.format(pos))
+        self._pos = pos
+        return pos
+
+    @staticmethod
+    def _read(rsp, count):
+        """Read up to ``count`` bytes from a streamed response"""
+        data = bytearray()
+        while len(data) < count:
+            chunk = rsp.raw.read(count - len(data), decode_content=True)
+            if not chunk:
+                break
+            data += chunk
+        return bytes(data)
+
+    def _close_stream(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def _sequential(self, start, end):
+        """Serve a block from one whole-file stream, for servers without ranges"""
+        with self._stream_lock:
+            if self._stream is None or self._stream_pos > start:
+                self._close_stream()
+                self._stream = rest.get_media(self.client, self.system_id,
+                                              self.name, stream=True)
+                self._stream_pos = 0
+            while self._stream_pos < start:
+                skipped = self._read(self._stream, min(start - self._stream_pos,
+                                                       self.block_size))
+                if not skipped:
+                    break
+                self._stream_pos += len(skipped)
+            data = self._read(self._stream, end - start + 1)
+            self._stream_pos += len(data)
+        return data
+
+    def _fetch(self, index):
+        start = index * self.block_size
+        end = min(self.size, start + self.block_size) - 1
+        if not self._ranges:
+            data = self._sequential(start, end)
+        else:
+            rsp = rest.get_media(self.client, self.system_id, self.name,
+                                 start=start, end=end, stream=True)
+            if rsp.status_code == 206:
+                with rsp:
+                    data = self._read(rsp, end - start + 1)
+            elif rsp.status_code == 200:
+                # Server ignored the range; keep reading this one response
+                # rather than fetching the whole file for every block
+                logger.info('server ignored range request; reading {} '
+                            'sequentially'.format(self.name))
+                self._ranges = False
+                with self._stream_lock:
+                    self._close_stream()
+                    self._stream = rsp
+                    self._stream_pos = 0
+                data = self._sequential(start, end)
+            else:
+                rsp.close()
+                raise AgaveError('Unexpected status {} reading {}'.format(
+                    rsp.status_code, self.name))
+        if len(data) != end - start + 1:
+            raise AgaveError('Short read of {} at byte {}'.format(
+                self.name, start))
+        return data
+
+    def _store(self, index, data):
+        with self._lock:
+            self._blocks[index] = data
+            self._blocks.move_to_end(index)
+            while len(self._blocks) > self.cache_blocks:
+                self._blocks.popitem(last=False)
+
+    def _prefetch(self, index):
+        def _task():
+            try:
+                self._store(index, self._fetch(index))
+            finally:
+                with self._lock:
+                    self._pending.pop(index, None)
+        with self._lock:
+            if index in self._blocks or index in self._pending:
+                return
+            self._pending[index] = self._pool.submit(_task)
+
+    def _block(self, index):
+        with self._lock:
+            data = self._blocks.get(index)
+            if data is not None:
+                self._blocks.move_to_end(index)
+            pending = self._pending.get(index)
+        if data is None and pending is not None:
+            try:
+                pending.result()
+            except Exception as exc:
+                logger.debug('read-ahead of block {} failed: {}'.format(index, exc))
+            with self._lock:
+                data = self._blocks.get(index)
+        if data is None:
+            data = self._fetch(index)
+            self._store(index, data)
+        sequential = self._last_block is not None and index == self._last_block + 1
+        self._last_block = index
+        if self._pool is not None and self._ranges and \
+                (sequential or index == 0):
+            last = (self.size - 1) // self.block_size
+            for ahead in range(index + 1, min(last, index + self.readahead) + 1):
+                self._prefetch(ahead)
+        return data
+
+    def readinto(self, b):
+        view = memoryview(b).cast('B')
+        filled = 0
+        while filled < len(view) and self._pos < self.size:
+            index, offset = divmod(self._pos, self.block_size)
+            data = self._block(index)
+            count = min(len(data) - offset, len(view) - filled)
+            if count <= 0:
+                break
+            view[filled:filled + count] = data[offset:offset + count]
+            filled += count
+            self._pos += count
+        return filled
+
+    def readall(self):
+        return self.read(max(0, self.size - self._pos))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        with self._lock:
+            self._blocks.clear()
+        with self._stream_lock:
+            self._close_stream()
+        super(RemoteFile, self).close()
+
+
+def open(agave_client, path, mode='rb', system_id=DEFAULT_STORAGE_SYSTEM,
+         encoding=None, block_size=None, cache_blocks=None, readahead=None):
+    """Open a remote file for reading without staging a local copy
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        path (str): Agave-absolute path of the file
+        mode (str, optional): ``rb`` for bytes or ``r`` for text [rb]
+        system_id (str, optional): Storage system where file is located [data-sd2e-community]
+        encoding (str, optional): Text encoding when mode is ``r``
+        block_size (int, optional): Bytes per Range request [BACANORA_REMOTE_BLOCK_SIZE]
+        cache_blocks (int, optional): Blocks kept in memory [BACANORA_REMOTE_CACHE_BLOCKS]
+        readahead (int, optional): Blocks prefetched on sequential reads [BACANORA_REMOTE_READAHEAD]
+
+    Raises:
+        FileNotFoundError: The path does not exist or is not a file
+
+    Returns:
+        A seekable binary or text file object
+    """
+    logger.info('bacanora.open()')
+    if mode not in ('r', 'rb'):
+        raise ValueError("Unsupported mode '{}'; only 'r' and 'rb' are available".format(mode))
+    handle = None
+    try:
+        handle = io.open(direct.abs_path(path, system_id=system_id), 'rb')
+    except (DirectOperationFailed, OSError) as exc:
+        logger.debug('direct open unavailable: {}'.format(exc))
+    if handle is None:
+        logger.info('using Agave API')
+        listing = agaveutils.files.describe(agave_client, path,
+                                            systemId=system_id)
+        if listing is None or listing.get('format') == 'folder':
+            raise FileNotFoundError(
+                'No such file: agave://{}{}'.format(system_id, path))
+        handle = RemoteFile(agave_client, path, system_id,
+                            int(listing.get('length', 0) or 0),
+                            block_size=block_size, cache_blocks=cache_blocks,
+                            readahead=readahead)
+    if mode == 'r':
+        if isinstance(handle, RemoteFile):
+            handle = io.BufferedReader(handle)
+        return io.TextIOWrapper(handle, encoding=encoding)
+    return handle
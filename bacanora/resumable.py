@@ -0,0 +1,239 @@
+"""
+Resumable downloads from the Agave files media endpoint
+
+A download in progress is written to ``<destination>.bacanora-part`` next
+to a small JSON checkpoint describing the remote file. If the transfer
+is interrupted, the next attempt sends a ``Range`` request for the bytes
+that are still missing. It starts over only if the server ignores the
+range or the remote file has changed.
+"""
+import json
+import os
+
+from agavepy.agave import AgaveError
+from requests.exceptions import HTTPError, RequestException
+
+from . import agaveutils
+from . import buffers
+from . import logger as loggermodule
+from . import segmented
+from . import settings
+from .agaveutils import rest
+
+logger = loggermodule.get_logger(__name__)
+
+__all__ = ['Checkpoint', 'fetch', 'supported', 'discard', 'partial_paths']
+
+PART_SUFFIX = '.bacanora-part'
+CHECKPOINT_SUFFIX = PART_SUFFIX + '.json'
+FILES_BLOCK_SIZE = settings.FILES_BLOCK_SIZE
+
+
+class Checkpoint(object):
+    """Identity of the remote file behind a partial download"""
+    __slots__ = ('system_id', 'path', 'size', 'last_modified', 'etag')
+
+    def __init__(self, system_id, path, size=None, last_modified=None,
+                 etag=None):
+        self.system_id = system_id
+        self.path = path
+        self.size = size
+        self.last_modified = last_modified
+        self.etag = etag
+
+    @classmethod
+    def load(cls, filename):
+        try:
+            with open(filename, 'r') as f:
+                return cls(**json.load(f))
+        except Exception:
+            return None
+
+    def save(self, filename):
+        temp = filename + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump({k: getattr(self, k) for k in self.__slots__}, f)
+        os.rename(temp, filename)
+
+    def matches(self, system_id, path):
+        return self.system_id == system_id and self.path == path
+
+    @property
+    def validator(self):
+        """Value for an If-Range header, if the server supplied one"""
+        return self.etag or self.last_modified
+
+
+def partial_paths(destination):
+    return destination + PART_SUFFIX, destination + CHECKPOINT_SUFFIX
+
+
+def discard(destination):
+    """Remove any partial download and checkpoint for ``destination``"""
+    for filename in partial_paths(destination):
+        try:
+            os.unlink(filename)
+        except FileNotFoundError:
+            pass
+
+
+def supported(agave_client):
+    """Whether raw media requests can be authenticated for this client"""
+    try:
+        rest.api_server(agave_client)
+        rest.auth(agave_client)
+        return True
+    except Exception as exc:
+        logger.debug('resumable downloads unavailable: {}'.format(exc))
+        return False
+
+
+def _unchanged(agave_client, checkpoint):
+    """Compare a checkpoint against the current files listing"""
+    listing = agaveutils.files.describe(agave_client, checkpoint.path,
+                                        systemId=checkpoint.system_id)
+    if listing is None:
+        return False
+    length = listing.get('length')
+    if checkpoint.size is not None and length is not None:
+        return int(length) == checkpoint.size
+    return True
+
+
+def _resume_offset(agave_client, file_to_download, destination, system_id):
+    part, sidecar = partial_paths(destination)
+    checkpoint = Checkpoint.load(sidecar)
+    if checkpoint is None or not checkpoint.matches(system_id, file_to_download) \
+            or not os.path.exists(part):
+        return 0, None
+    offset = os.path.getsize(part)
+    if offset == 0:
+        return 0, None
+    if checkpoint.size is not None and offset > checkpoint.size:
+        return 0, None
+    if not _unchanged(agave_client, checkpoint):
+        logger.info('{} changed since last attempt; restarting'.format(
+            file_to_download))
+        return 0, None
+    return offset, checkpoint
+
+
+def fetch(agave_client, file_to_download, destination,
+          system_id, block_size=None, segments=None, segment_threshold=None):
+    """Download a file to ``destination``, resuming any earlier partial copy
+
+    A fresh download whose size reaches the segment threshold is handed
+    to ``segmented.fetch()`` as soon as the response headers reveal it.
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        file_to_download (str): Agave-absolute path of the file
+        destination (str): Local path of the finished file
+        system_id (str): Storage system where file is located
+        block_size (int, optional): Initial bytes per read from the response [BACANORA_FILES_BLOCK_SIZE]
+        segments (int, optional): Concurrent streams for large files [BACANORA_FILES_SEGMENTS]
+        segment_threshold (int, optional): Minimum size for a segmented download [BACANORA_FILES_SEGMENT_THRESHOLD]
+
+    Raises:
+        HTTPError: The files service returned an error status
+        AgaveError: The transfer was interrupted and can be resumed
+
+    Returns:
+        int: Size of the downloaded file in bytes
+    """
+    if block_size is None:
+        block_size = FILES_BLOCK_SIZE
+    part, sidecar = partial_paths(destination)
+    offset, checkpoint = _resume_offset(agave_client, file_to_download,
+                                        destination, system_id)
+    headers = {}
+    if offset and checkpoint.validator:
+        headers['If-Range'] = checkpoint.validator
+    try:
+        rsp = rest.get_media(agave_client, system_id, file_to_download,
+                             start=offset or None, headers=headers)
+    except HTTPError as herr:
+        status = getattr(herr.response, 'status_code', None)
+        if status == 416 and offset:
+            # Interrupted after the last byte but before the rename
+            total = rest.content_range(herr.response)[2]
+            if total == offset and checkpoint.size in (None, offset):
+                logger.info('{} was already complete'.format(
+                    file_to_download))
+                return _finish(part, destination, sidecar, offset)
+        if status in (404, 416):
+            discard(destination)
+        raise
+    except RequestException as exc:
+        raise AgaveError('Failed to reach files service for {}: {}'.format(
+            file_to_download, exc))
+
+    with rsp:
+        start, _, total = rest.content_range(rsp)
+        if rsp.status_code == 206:
+            if start != offset or (checkpoint is not None and total is not None
+                                   and checkpoint.size is not None
+                                   and total != checkpoint.size):
+                discard(destination)
+                raise AgaveError(
+                    '{} changed during resume; restarting'.format(file_to_download))
+            if checkpoint is None:
+                checkpoint = Checkpoint(system_id, file_to_download, size=total)
+                checkpoint.save(sidecar)
+        else:
+            if offset:
+                logger.info('server ignored range request; restarting')
+            offset = 0
+            total = None
+            if not rsp.headers.get('Content-Encoding'):
+                length = rsp.headers.get('Content-Length')
+                total = int(length) if length is not None else None
+            if segmented.eligible(total, segments, segment_threshold):
+                rsp.close()
+                discard(destination)
+                try:
+                    return segmented.fetch(agave_client, file_to_download,
+                                           destination, system_id, total,
+                                           segments=segments,
+                                           block_size=block_size)
+                except segmented.RangesNotSupported:
+                    logger.info('server ignored range request; using one stream')
+                    return fetch(agave_client, file_to_download, destination,
+                                 system_id, block_size=block_size, segments=1)
+            checkpoint = Checkpoint(system_id, file_to_download, size=total,
+                                    last_modified=rsp.headers.get('Last-Modified'),
+                                    etag=rsp.headers.get('ETag'))
+            checkpoint.save(sidecar)
+
+        if offset:
+            logger.info('resuming {} at byte {}'.format(file_to_download, offset))
+        written = 0
+        with open(part, 'r+b' if offset else 'wb') as f:
+            f.seek(offset)
+            f.truncate()
+            try:
+                for block in buffers.iter_response(rsp, block_size):
+                    f.write(block)
+                    written += len(block)
+            except RequestException as exc:
+                raise AgaveError('Download of {} interrupted at byte {}: {}'.format(
+                    file_to_download, offset + written, exc))
+
+    size = offset + written
+    if checkpoint.size is not None and size != checkpoint.size:
+        raise AgaveError('Download of {} incomplete: {} of {} bytes'.format(
+            file_to_download, size, checkpoint.size))
+    return _finish(part, destination, sidecar, size)
+
+
+def _finish(part, destination, sidecar, size):
+    """Move a complete partial download into place"""
+    try:
+        os.rename(part, destination)
+    except Exception as rexc:
+        raise OSError('Atomic rename failed after download', rexc)
+    try:
+        os.unlink(sidecar)
+    except FileNotFoundError:
+        pass
+    return size
@@ -3,7 +3,7 @@ from . import logger as loggermodule
 
 logger = loggermodule.get_logger(__name__)
 
-__all__ = ['ABACO', 'JUPYTER', 'HPC', 'LOCALHOST', 'ALL', 'detect']
+__all__ = ['ABACO', 'JUPYTER', 'HPC', 'LOCALHOST', 'ALL', 'detect', 'current']
 
 ABACO = 'abaco'
 JUPYTER = 'jupyter'
@@ -39,3 +39,12 @@ def detect():
             return BacanoraRuntime(runtime)
     logger.debug('runtime: {}'.format(DEFAULT_RUNTIME))
     return BacanoraRuntime(DEFAULT_RUNTIME)
+
+_CURRENT = None
+
+def current():
+    """Runtime detected on first call, cached for the life of the process"""
+    global _CURRENT
+    if _CURRENT is None:
+        _CURRENT = detect()
+    return _CURRENT
@@ -0,0 +1,153 @@
+"""
+Parallel multi-stream downloads of large files from the Agave media endpoint
+
+The file is split into byte ranges that are fetched concurrently and
+written in place into a preallocated temporary file. The temporary file
+is renamed to the destination only after every segment has arrived in
+full.
+"""
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from agavepy.agave import AgaveError
+from requests.exceptions import RequestException
+
+from . import buffers
+from . import logger as loggermodule
+from . import settings
+from .agaveutils import rest
+
+logger = loggermodule.get_logger(__name__)
+
+__all__ = ['RangesNotSupported', 'fetch', 'split', 'eligible']
+
+SEGMENTS_SUFFIX = '.bacanora-segments'
+FILES_BLOCK_SIZE = settings.FILES_BLOCK_SIZE
+FILES_SEGMENTS = settings.FILES_SEGMENTS
+FILES_SEGMENT_THRESHOLD = settings.FILES_SEGMENT_THRESHOLD
+SEGMENT_ATTEMPTS = 3
+
+
+class RangesNotSupported(AgaveError):
+    """The server answered a range request with the whole file"""
+    pass
+
+
+def eligible(size, segments=None, threshold=None):
+    """Whether a file of ``size`` bytes should be downloaded in segments"""
+    if segments is None:
+        segments = FILES_SEGMENTS
+    if threshold is None:
+        threshold = FILES_SEGMENT_THRESHOLD
+    return size is not None and size > 0 and segments > 1 and \
+        size >= threshold
+
+
+def split(size, segments):
+    """Divide ``size`` bytes into at most ``segments`` inclusive (start, end) ranges"""
+    if size <= 0:
+        return []
+    segments = max(1, min(segments, size))
+    step = int(math.ceil(size / float(segments)))
+    return [(start, min(start + step, size) - 1)
+            for start in range(0, size, step)]
+
+
+def _preallocate(filename, size):
+    with open(filename, 'wb') as f:
+        f.truncate(size)
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+            except OSError:
+                # Not all filesystems support it; the sparse file still works
+                pass
+
+
+def _fetch_segment(agave_client, file_to_download, system_id, filename,
+                   start, end, size, block_size):
+    """Fetch bytes start..end into ``filename``, resuming within the segment"""
+    pos = start
+    last_exc = None
+    for attempt in range(SEGMENT_ATTEMPTS):
+        try:
+            rsp = rest.get_media(agave_client, system_id, file_to_download,
+                                 start=pos, end=end)
+            with rsp:
+                if rsp.status_code != 206:
+                    raise RangesNotSupported(
+                        'Range request for {} returned {}'.format(
+                            file_to_download, rsp.status_code))
+                got_start, _, total = rest.content_range(rsp)
+                if got_start != pos or (total is not None and total != size):
+                    raise AgaveError('{} changed during download'.format(
+                        file_to_download))
+                with open(filename, 'r+b') as f:
+                    f.seek(pos)
+                    for block in buffers.iter_response(rsp, block_size):
+                        block = block[:end + 1 - pos]
+                        f.write(block)
+                        pos += len(block)
+                        if pos > end:
+                            break
+        except RequestException as exc:
+            last_exc = exc
+            logger.debug('segment {}-{} of {} interrupted at {}: {}'.format(
+                start, end, file_to_download, pos, exc))
+        if pos > end:
+            return pos - start
+    raise AgaveError('Segment {}-{} of {} incomplete at byte {}: {}'.format(
+        start, end, file_to_download, pos, last_exc))
+
+
+def fetch(agave_client, file_to_download, destination, system_id, size,
+          segments=None, block_size=None):
+    """Download a file of known size as concurrent byte-range segments
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        file_to_download (str): Agave-absolute path of the file
+        destination (str): Local path of the finished file
+        system_id (str): Storage system where file is located
+        size (int): Size of the remote file in bytes
+        segments (int, optional): Number of concurrent segments [BACANORA_FILES_SEGMENTS]
+        block_size (int, optional): Initial bytes per read from each response [BACANORA_FILES_BLOCK_SIZE]
+
+    Raises:
+        RangesNotSupported: The server does not honor range requests
+        AgaveError: A segment could not be completed
+
+    Returns:
+        int: Size of the downloaded file in bytes
+    """
+    if segments is None:
+        segments = FILES_SEGMENTS
+    if block_size is None:
+        block_size = FILES_BLOCK_SIZE
+    ranges = split(size, segments)
+    logger.info('downloading {} in {} segments'.format(
+        file_to_download, len(ranges)))
+    temp = destination + SEGMENTS_SUFFIX
+    _preallocate(temp, size)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, len(ranges))) as pool:
+            futures = [pool.submit(_fetch_segment, agave_client,
+                                   file_to_download, system_id, temp,
+                                   start, end, size, block_size)
+                       for start, end in ranges]
+            received = sum(future.result() for future in futures)
+        if received != size or os.path.getsize(temp) != size:
+            raise AgaveError('Download of {} incomplete: {} of {} bytes'.format(
+                file_to_download, received, size))
+        try:
+            os.rename(temp, destination)
+        except Exception as rexc:
+            raise OSError('Atomic rename failed after download', rexc)
+    except Exception:
+        try:
+            os.unlink(temp)
+        except OSError:
+            pass
+        raise
+    return size
@@ -0,0 +1,141 @@
+"""
+Shared, pooled HTTP session for bacanora's own API calls
+
+A single ``requests.Session`` per process keeps connections to the API
+server alive between calls, so bursts of small requests skip the TCP
+and TLS handshakes. Its connection pool is sized for the worker threads
+that share it. Connections must not be shared with a forked child, so
+the session is dropped in the child and rebuilt on first use there.
+
+AgavePy's generated calls (``files.list``, ``updatePermissions``,
+``actors.sendMessage`` and so on) go through a ``requests.Session`` owned
+by the client's ``SynchronousHttpClient``. ``attach()`` mounts the same
+kind of pooled adapter, with default timeouts, on that session; it is
+re-mounted in forked children.
+"""
+import os
+import threading
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import logger as loggermodule
+from . import settings
+
+logger = loggermodule.get_logger(__name__)
+
+__all__ = ['get', 'reset', 'request', 'attach', 'PooledAdapter',
+           'DEFAULT_TIMEOUT']
+
+HTTP_POOL_SIZE = settings.HTTP_POOL_SIZE
+DEFAULT_TIMEOUT = (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT)
+
+_session = None
+_pid = None
+_lock = threading.Lock()
+# AgavePy sessions given a pooled adapter by attach()
+_attached = weakref.WeakSet()
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter that applies default timeouts to requests sent without one"""
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super(PooledAdapter, self).__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super(PooledAdapter, self).send(request, **kwargs)
+
+
+def _mount(session, pool_size=None):
+    pool_size = max(1, pool_size or HTTP_POOL_SIZE)
+    adapter = PooledAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.bacanora_pid = os.getpid()
+
+
+def build(pool_size=None):
+    """Create a session whose adapters keep ``pool_size`` connections per host"""
+    session = requests.Session()
+    _mount(session, pool_size)
+    return session
+
+
+def _agavepy_session(agave_client):
+    # Agave.__getattr__ invents resources for unknown names, so only look
+    # at the attributes AgavePy actually sets
+    swagger = vars(agave_client).get('all') \
+        if hasattr(agave_client, '__dict__') else None
+    session = getattr(getattr(swagger, 'http_client', None), 'session', None)
+    return session if isinstance(session, requests.Session) else None
+
+
+def attach(agave_client):
+    """Pool an AgavePy client's own API calls through bacanora's adapter
+
+    Cheap enough to call before every AgavePy call; a session is only
+    changed the first time it is seen in each process. Clients without an
+    AgavePy session, such as test doubles, are left alone.
+
+    Returns:
+        bool: Whether the client's session is pooled
+    """
+    session = _agavepy_session(agave_client)
+    if session is None:
+        return False
+    if getattr(session, 'bacanora_pid', None) != os.getpid():
+        with _lock:
+            if getattr(session, 'bacanora_pid', None) != os.getpid():
+                _mount(session)
+                _attached.add(session)
+    return True
+
+
+def get():
+    """The process-wide session, built on first use in each process"""
+    global _session, _pid
+    session = _session
+    if session is not None and _pid == os.getpid():
+        return session
+    with _lock:
+        if _session is None or _pid != os.getpid():
+            logger.debug('creating HTTP session in process {}'.format(
+                os.getpid()))
+            _session = build()
+            _pid = os.getpid()
+        return _session
+
+
+def reset():
+    """Close the shared session; the next call builds a new one"""
+    global _session, _pid
+    with _lock:
+        session, _session, _pid = _session, None, None
+    if session is not None:
+        session.close()
+
+
+def _after_fork_in_child():
+    global _session, _pid, _lock
+    # Sockets belong to the parent, so drop them without closing. The lock
+    # may have been held by another thread at fork time.
+    _session, _pid = None, None
+    _lock = threading.Lock()
+    for session in list(_attached):
+        # Fresh adapters; the parent's pools are abandoned, not closed
+        _mount(session)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def request(method, url, **kwargs):
+    """``requests.request`` through the shared session with default timeouts"""
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+    return get().request(method, url, **kwargs)
@@ -35,10 +35,130 @@ LOG_LEVEL = os.environ.get('BACANORA_LOG_LEVEL', 'DEBUG')
 LOG_VERBOSE = parse_boolean(os.environ.get(
     'BACANORA_LOG_VERBOSE', '0'))
 
-# Download block size
+# Download block size; API downloads start here and grow adaptively
 FILES_BLOCK_SIZE = int(os.environ.get(
-    'BACANORA_FILES_BLOCK_SIZE ', '4096'))
+    'BACANORA_FILES_BLOCK_SIZE', '65536'))
+FILES_MAX_BLOCK_SIZE = int(os.environ.get(
+    'BACANORA_FILES_MAX_BLOCK_SIZE', str(8 * 1024 * 1024)))
+
+# Released download buffers of each size kept for reuse
+FILES_BUFFER_POOL_SIZE = int(os.environ.get(
+    'BACANORA_FILES_BUFFER_POOL_SIZE', '8'))
 
 # Whether to do file operations atomically (adds overhead)
 FILES_ATOMIC_OPERATIONS = parse_boolean(os.environ.get(
     'BACANORA_FILES_ATOMIC_OPERATIONS', '1'))
+
+# Worker threads used by bulk and recursive operations
+MAX_WORKERS = int(os.environ.get(
+    'BACANORA_MAX_WORKERS', '8'))
+
+# Maximum permission update calls per second across all workers
+PEMS_RATE_LIMIT = float(os.environ.get(
+    'BACANORA_PEMS_RATE_LIMIT', '10'))
+
+# Opt-in cache of exists/isfile/isdir answers from the files API
+METADATA_CACHE = parse_boolean(os.environ.get(
+    'BACANORA_METADATA_CACHE', '0'))
+METADATA_CACHE_TTL = float(os.environ.get(
+    'BACANORA_METADATA_CACHE_TTL', '30'))
+METADATA_CACHE_SIZE = int(os.environ.get(
+    'BACANORA_METADATA_CACHE_SIZE', '10000'))
+
+# Storage system to POSIX prefix mappings, as a JSON file and/or document
+STORAGE_SYSTEMS_FILE = os.environ.get(
+    'BACANORA_STORAGE_SYSTEMS_FILE', '')
+STORAGE_SYSTEMS = os.environ.get(
+    'BACANORA_STORAGE_SYSTEMS', '')
+
+# Buffer size for direct-path copies when no in-kernel copy is available
+COPY_BUFFER_SIZE = int(os.environ.get(
+    'BACANORA_COPY_BUFFER_SIZE', '1048576'))
+
+# Whether API downloads keep a partial file and resume with Range requests
+FILES_RESUMABLE = parse_boolean(os.environ.get(
+    'BACANORA_FILES_RESUMABLE', '1'))
+
+# Concurrent byte-range streams for large API downloads, and the size
+# in bytes at which a download is split into segments
+FILES_SEGMENTS = int(os.environ.get(
+    'BACANORA_FILES_SEGMENTS', '4'))
+FILES_SEGMENT_THRESHOLD = int(os.environ.get(
+    'BACANORA_FILES_SEGMENT_THRESHOLD', str(64 * 1024 * 1024)))
+
+# Optional on-disk cache of API downloads shared across executions
+DOWNLOAD_CACHE_DIR = os.environ.get(
+    'BACANORA_DOWNLOAD_CACHE_DIR', '')
+DOWNLOAD_CACHE_SIZE = int(os.environ.get(
+    'BACANORA_DOWNLOAD_CACHE_SIZE', str(10 * 1024 ** 3)))
+DOWNLOAD_CACHE_MODE = os.environ.get(
+    'BACANORA_DOWNLOAD_CACHE_MODE', 'link')
+
+# Block size, in-memory block count and read-ahead depth for bacanora.open()
+REMOTE_BLOCK_SIZE = int(os.environ.get(
+    'BACANORA_REMOTE_BLOCK_SIZE', str(4 * 1024 * 1024)))
+REMOTE_CACHE_BLOCKS = int(os.environ.get(
+    'BACANORA_REMOTE_CACHE_BLOCKS', '16'))
+REMOTE_READAHEAD = int(os.environ.get(
+    'BACANORA_REMOTE_READAHEAD', '2'))
+
+# Shared HTTP session used for bacanora's own API calls
+HTTP_POOL_SIZE = int(os.environ.get(
+    'BACANORA_HTTP_POOL_SIZE', str(MAX_WORKERS * FILES_SEGMENTS)))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get(
+    'BACANORA_HTTP_CONNECT_TIMEOUT', '10'))
+HTTP_READ_TIMEOUT = float(os.environ.get(
+    'BACANORA_HTTP_READ_TIMEOUT', '300'))
+
+# Operations in flight per event loop, and threads for direct-path calls, in bacanora.aio
+AIO_CONCURRENCY = int(os.environ.get(
+    'BACANORA_AIO_CONCURRENCY', '100'))
+AIO_EXECUTOR_WORKERS = int(os.environ.get(
+    'BACANORA_AIO_EXECUTOR_WORKERS', '4'))
+
+# Entries requested per files.list call when paging through a directory
+FILES_LIST_PAGE_SIZE = int(os.environ.get(
+    'BACANORA_FILES_LIST_PAGE_SIZE', '250'))
+# Directory listings a walk keeps running or waiting to be yielded
+WALK_MAX_BUFFERED = int(os.environ.get(
+    'BACANORA_WALK_MAX_BUFFERED', '64'))
+
+# Circuit breakers over the files, permissions and actors APIs: the failed
+# fraction of the last CIRCUIT_WINDOW calls that opens one, the seconds it
+# stays open, and the probe calls admitted when it half-opens
+CIRCUIT_BREAKER = parse_boolean(os.environ.get(
+    'BACANORA_CIRCUIT_BREAKER', '1'))
+CIRCUIT_ERROR_RATE = float(os.environ.get(
+    'BACANORA_CIRCUIT_ERROR_RATE', '0.5'))
+CIRCUIT_WINDOW = int(os.environ.get(
+    'BACANORA_CIRCUIT_WINDOW', '20'))
+CIRCUIT_MIN_CALLS = int(os.environ.get(
+    'BACANORA_CIRCUIT_MIN_CALLS', '10'))
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get(
+    'BACANORA_CIRCUIT_RESET_TIMEOUT', '30'))
+CIRCUIT_HALF_OPEN_CALLS = int(os.environ.get(
+    'BACANORA_CIRCUIT_HALF_OPEN_CALLS', '1'))
+
+# Seconds a direct-path mount health probe is trusted, and whether a
+# healthy mount's "does not exist" answer skips confirming with the API
+DIRECT_HEALTH_TTL = float(os.environ.get(
+    'BACANORA_DIRECT_HEALTH_TTL', '60'))
+DIRECT_AUTHORITATIVE = parse_boolean(os.environ.get(
+    'BACANORA_DIRECT_AUTHORITATIVE', '0'))
+
+# Operation metrics, optionally written to a Prometheus textfile at exit
+# and/or served on a local port
+METRICS = parse_boolean(os.environ.get(
+    'BACANORA_METRICS', '0'))
+METRICS_FILE = os.environ.get(
+    'BACANORA_METRICS_FILE', '')
+METRICS_PORT = int(os.environ.get(
+    'BACANORA_METRICS_PORT', '0'))
+
+# Per-call JSON lines trace, and how often its background writer flushes
+TRACE_FILE = os.environ.get(
+    'BACANORA_TRACE_FILE', '')
+TRACE_FLUSH_INTERVAL = float(os.environ.get(
+    'BACANORA_TRACE_FLUSH_INTERVAL', '1'))
+TRACE_QUEUE_SIZE = int(os.environ.get(
+    'BACANORA_TRACE_QUEUE_SIZE', '10000'))
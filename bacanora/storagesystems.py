@@ -0,0 +1,101 @@
+"""
+Registry mapping Agave storage systems to POSIX prefixes in each runtime
+"""
+import copy
+import json
+import os
+import threading
+
+from . import logger as loggermodule
+from . import settings
+
+logger = loggermodule.get_logger(__name__)
+
+__all__ = ['DEFAULT_PREFIXES', 'StorageSystemRegistry', 'registry']
+
+DEFAULT_PREFIXES = {'data-sd2e-community': {'hpc': '/work2/projects/SD2E-Community/prod/data',
+                                            'abaco': '/work/projects/SD2E-Community/prod/data',
+                                            'jupyter': os.path.join(
+                                                os.path.expanduser('~'), 'sd2e-community')}}
+
+
+class StorageSystemRegistry(object):
+    """Maps (system_id, runtime) to the POSIX prefix where the system is mounted
+
+    The built-in defaults are extended by a JSON file named in
+    ``BACANORA_STORAGE_SYSTEMS_FILE`` and then by a JSON document in
+    ``BACANORA_STORAGE_SYSTEMS``, both shaped like ``DEFAULT_PREFIXES``.
+    Configuration is loaded on first use and each resolution is cached.
+    """
+
+    def __init__(self, prefixes=None, config_file=None, config=None):
+        if prefixes is None:
+            prefixes = DEFAULT_PREFIXES
+        self.defaults = copy.deepcopy(prefixes)
+        self.config_file = config_file
+        self.config = config
+        self._prefixes = None
+        self._resolved = {}
+        self._lock = threading.RLock()
+
+    def _load(self):
+        prefixes = copy.deepcopy(self.defaults)
+        sources = []
+        if self.config_file:
+            try:
+                with open(os.path.expanduser(self.config_file), 'r') as f:
+                    sources.append(json.load(f))
+            except Exception as exc:
+                logger.warning('Failed to load storage systems from {}: {}'.format(
+                    self.config_file, exc))
+        if self.config:
+            try:
+                sources.append(json.loads(self.config))
+            except ValueError as exc:
+                logger.warning('Failed to parse BACANORA_STORAGE_SYSTEMS: {}'.format(exc))
+        for source in sources:
+            for system_id, runtimes in source.items():
+                for runtime, prefix in runtimes.items():
+                    prefixes.setdefault(system_id, {})[runtime.lower()] = prefix
+        return prefixes
+
+    @property
+    def prefixes(self):
+        with self._lock:
+            if self._prefixes is None:
+                self._prefixes = self._load()
+            return self._prefixes
+
+    def register(self, system_id, runtime, prefix):
+        """Add or replace the prefix for a storage system in one runtime"""
+        with self._lock:
+            self.prefixes.setdefault(system_id, {})[str(runtime).lower()] = prefix
+            self._resolved.pop((system_id, str(runtime).lower()), None)
+
+    def resolve(self, system_id, runtime):
+        """POSIX prefix for a storage system, or None if it is not mounted
+
+        Returns:
+            str: Absolute prefix path
+        """
+        key = (system_id, str(runtime))
+        try:
+            return self._resolved[key]
+        except KeyError:
+            pass
+        with self._lock:
+            prefix = self.prefixes.get(system_id, {}).get(str(runtime))
+            if prefix is not None:
+                prefix = os.path.expandvars(os.path.expanduser(prefix))
+            self._resolved[key] = prefix
+            return prefix
+
+    def reload(self):
+        """Discard cached configuration and resolutions"""
+        with self._lock:
+            self._prefixes = None
+            self._resolved = {}
+
+
+registry = StorageSystemRegistry(config_file=settings.STORAGE_SYSTEMS_FILE,
+                                 config=settings.STORAGE_SYSTEMS)
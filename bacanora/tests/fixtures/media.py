@@ -0,0 +1,226 @@
+import json
+import re
+import threading
+import time
+import pytest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from requests import Response
+from requests.exceptions import HTTPError
+
+MEDIA = re.compile(r'^/files/v2/media/system/(?P<system>[^/]+)(?P<path>/[^?]*)')
+FILES = re.compile(r'^/files/v2/(?P<collection>\w+)/system/(?P<system>[^/]+)(?P<path>/[^?]*)')
+RANGE = re.compile(r'^bytes=(\d+)-(\d*)$')
+MODIFIED = '2020-01-02T03:04:05.000-05:00'
+
+
+class MediaServer(ThreadingMixIn, HTTPServer):
+    """Minimal stand-in for the Agave files media endpoint"""
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), MediaHandler)
+        self.files = {}
+        self.honor_ranges = True
+        self.fail_after = None
+        self.requests = []
+        # Client addresses seen, one per TCP connection
+        self.peers = set()
+        # (method, collection, path, JSON body) of non-download calls
+        self.calls = []
+        # Directories listed through MediaFiles.list
+        self.listings = []
+        # Directories created through MediaFiles.manage
+        self.dirs = set()
+        # lastModified of files stored through MediaFiles.importData
+        self.modified = {}
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address)
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _record(self):
+        match = FILES.match(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        try:
+            body = json.loads(raw.decode('utf-8')) if raw else None
+        except ValueError:
+            body = None
+        self.server.calls.append((self.command, match.group('collection'),
+                                  match.group('path'), body))
+        return match
+
+    def do_PUT(self):
+        self._record()
+        self._json(200, {'status': 'success', 'result': {}})
+
+    def do_POST(self):
+        self._record()
+        self._json(200, {'status': 'success', 'result': {}})
+
+    def do_DELETE(self):
+        match = self._record()
+        if self.server.files.pop(match.group('path'), None) is None:
+            self._json(404, {'status': 'error', 'message': 'not found'})
+        else:
+            self._json(200, {'status': 'success', 'result': {}})
+
+    def _listing(self, path):
+        files = self.server.files
+        if path in files:
+            return {'name': path.split('/')[-1], 'format': 'raw',
+                    'type': 'file', 'length': len(files[path])}
+        if any(name.startswith(path.rstrip('/') + '/') for name in files):
+            return {'name': '.', 'format': 'folder', 'type': 'dir',
+                    'length': 0}
+        return None
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, self.headers.get('Range')))
+        server.peers.add(self.client_address)
+        listing = FILES.match(self.path)
+        if listing and listing.group('collection') == 'listings':
+            entry = self._listing(listing.group('path'))
+            if entry is None:
+                return self._json(404, {'status': 'error',
+                                        'message': 'not found'})
+            return self._json(200, {'status': 'success', 'result': [entry]})
+        match = MEDIA.match(self.path)
+        content = server.files.get(match.group('path')) if match else None
+        if content is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        start, end = 0, len(content) - 1
+        status = 200
+        range_match = RANGE.match(self.headers.get('Range') or '')
+        if range_match and server.honor_ranges:
+            start = int(range_match.group(1))
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header('Content-Range',
+                                 'bytes */{}'.format(len(content)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if range_match.group(2):
+                end = min(end, int(range_match.group(2)))
+            status = 206
+        body = content[start:end + 1]
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, end, len(content)))
+        self.end_headers()
+        if server.fail_after is not None:
+            # Simulate a dropped connection partway through the body
+            cutoff, server.fail_after = server.fail_after, None
+            self.wfile.write(body[:cutoff])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+class MediaFiles(object):
+    def __init__(self, server):
+        self.server = server
+
+    def list(self, systemId, filePath, limit=None, offset=None):
+        files = self.server.files
+        modified = self.server.modified
+        content = files.get(filePath)
+        if content is not None:
+            return [{'name': filePath.split('/')[-1], 'format': 'raw',
+                     'type': 'file', 'length': len(content),
+                     'lastModified': modified.get(filePath, MODIFIED)}]
+        prefix = filePath.rstrip('/') + '/'
+        children = {}
+        for name in sorted(self.server.dirs):
+            if name.startswith(prefix):
+                child = name[len(prefix):].partition('/')[0]
+                children[child] = {'name': child, 'length': 0,
+                                   'format': 'folder', 'type': 'dir'}
+        for name in sorted(files):
+            if name.startswith(prefix):
+                child, _, rest = name[len(prefix):].partition('/')
+                children[child] = {'name': child, 'length': 0,
+                                   'format': 'folder', 'type': 'dir'} if rest \
+                    else {'name': child, 'format': 'raw', 'type': 'file',
+                          'length': len(files[name]),
+                          'lastModified': modified.get(name, MODIFIED)}
+        if not children and filePath.rstrip('/') not in self.server.dirs:
+            rsp = Response()
+            rsp.status_code = 404
+            raise HTTPError('404 Client Error: Not Found', response=rsp)
+        self.server.listings.append(filePath)
+        entries = [{'name': '.', 'format': 'folder', 'type': 'dir',
+                    'length': 0}] + list(children.values())
+        offset = offset or 0
+        return entries[offset:offset + limit if limit else None]
+
+    def importData(self, systemId, filePath, fileToUpload):
+        with fileToUpload:
+            content = fileToUpload.read()
+        name = fileToUpload.name.split('/')[-1]
+        path = filePath.rstrip('/') + '/' + name
+        self.server.files[path] = content
+        self.server.modified[path] = time.time()
+
+    def delete(self, filePath, systemId):
+        prefix = filePath.rstrip('/') + '/'
+        doomed = [name for name in self.server.files
+                  if name == filePath or name.startswith(prefix)]
+        if not doomed:
+            rsp = Response()
+            rsp.status_code = 404
+            raise HTTPError('404 Client Error: Not Found', response=rsp)
+        for name in doomed:
+            del self.server.files[name]
+
+    def manage(self, systemId, body, filePath):
+        path = '/' + (filePath.rstrip('/') + '/' + body['path']).strip('/')
+        self.server.calls.append(('PUT', 'media', filePath, body))
+        while path != '/':
+            self.server.dirs.add(path)
+            path = path.rsplit('/', 1)[0] or '/'
+
+
+class MediaClient(object):
+    """Just enough of an Agave client to authenticate raw media requests"""
+    token = None
+    nonce = 'bacanora-test'
+
+    def __init__(self, server):
+        self.api_server = server.url
+        self.files = MediaFiles(server)
+
+
+@pytest.fixture
+def media_server():
+    server = MediaServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
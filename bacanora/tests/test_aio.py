@@ -0,0 +1,99 @@
+import asyncio
+import os
+
+import pytest
+from requests.exceptions import HTTPError
+
+from .. import aio
+from .fixtures.media import media_server, MediaClient
+
+SYSTEM = 'bacanora-test'
+CONTENT = os.urandom(100000)
+
+
+def run(coro):
+    async def _main():
+        try:
+            return await coro
+        finally:
+            await aio.close()
+    return asyncio.run(_main())
+
+
+@pytest.fixture
+def native(media_server, tmpdir, monkeypatch):
+    pytest.importorskip('aiohttp')
+    monkeypatch.setattr(aio._sync, 'PWD', str(tmpdir))
+    media_server.files['/data/file.bin'] = CONTENT
+    media_server.files['/data/sub/other.txt'] = b'other'
+    return MediaClient(media_server)
+
+
+def test_stat_and_exists(native):
+    record = run(aio.stat(native, '/data/file.bin', system_id=SYSTEM))
+    assert record.is_file() and record.size == len(CONTENT)
+    assert record.via == 'api'
+    assert run(aio.isdir(native, '/data/sub', system_id=SYSTEM))
+    assert not run(aio.exists(native, '/data/missing', system_id=SYSTEM))
+    with pytest.raises(FileNotFoundError):
+        run(aio.stat(native, '/data/missing', system_id=SYSTEM))
+
+
+def test_download(native, tmpdir):
+    name = run(aio.download(native, '/data/file.bin', system_id=SYSTEM))
+    assert name == 'file.bin'
+    assert tmpdir.join('file.bin').read_binary() == CONTENT
+    with pytest.raises(HTTPError):
+        run(aio.download(native, '/data/missing', system_id=SYSTEM))
+    assert [p.basename for p in tmpdir.listdir()] == ['file.bin']
+
+
+def test_grant_mkdir_delete(native, media_server):
+    assert run(aio.grant(native, '/data/file.bin', system_id=SYSTEM))
+    assert run(aio.mkdir(native, '/data/new', system_id=SYSTEM))
+    assert run(aio.delete(native, '/data/sub/other.txt', system_id=SYSTEM))
+    assert media_server.calls == [
+        ('POST', 'pems', '/data/file.bin',
+         {'username': 'world', 'permission': 'READ', 'recursive': False}),
+        ('PUT', 'media', '/', {'action': 'mkdir', 'path': '/data/new'}),
+        ('DELETE', 'media', '/data/sub/other.txt', None)]
+
+
+def test_concurrency_is_bounded(native, media_server, monkeypatch):
+    monkeypatch.setattr(aio, 'AIO_CONCURRENCY', 3)
+
+    async def _many():
+        return await asyncio.gather(*[
+            aio.exists(native, '/data/file.bin', system_id=SYSTEM)
+            for _ in range(100)])
+    assert all(run(_many()))
+    assert len(media_server.peers) <= 3
+
+
+def test_fallback_without_aiohttp(media_server, monkeypatch):
+    media_server.files['/data/file.bin'] = CONTENT
+    monkeypatch.setattr(aio, 'aiohttp', None)
+    client = MediaClient(media_server)
+    assert run(aio.isfile(client, '/data/file.bin', system_id=SYSTEM))
+    assert not [r for r in media_server.requests if 'listings' in r[0]]
+
+
+def test_no_direct_calls_without_direct_path(native, tmpdir, monkeypatch):
+    queued = []
+    in_executor = aio._in_executor
+
+    async def _record(func, *args, **kwargs):
+        queued.append(func)
+        return await in_executor(func, *args, **kwargs)
+    monkeypatch.setattr(aio, '_in_executor', _record)
+    record = run(aio.stat(native, '/data/file.bin', system_id=SYSTEM))
+    assert record.via == 'api'
+    run(aio.download(native, '/data/file.bin', system_id=SYSTEM))
+    src = tmpdir.join('up.txt')
+    src.write('up')
+    assert run(aio.upload(native, str(src), '/data', system_id=SYSTEM))
+    assert run(aio.mkdir(native, '/data/new', system_id=SYSTEM))
+    assert run(aio.delete(native, '/data/sub/other.txt', system_id=SYSTEM))
+    # Only the downloaded blocks were written on the executor
+    assert queued and all(getattr(func, '__module__', None) !=
+                          aio.direct.__name__ for func in queued)
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+import requests
+from requests.exceptions import ChunkedEncodingError
+
+from .. import buffers
+from .fixtures.media import media_server
+
+CONTENT = os.urandom(300001)
+
+
+def media(server, path):
+    return requests.get(server.url + '/files/v2/media/system/bacanora-test' + path,
+                        stream=True)
+
+
+def test_pool_reuses_released_buffers():
+    pool = buffers.BufferPool(max_free=1)
+    with pool.borrow(1024) as first:
+        pass
+    with pool.borrow(1024) as second:
+        assert second is first
+        # A second concurrent borrower gets a fresh buffer
+        with pool.borrow(1024) as third:
+            assert third is not first
+    assert pool.stats()['free'] == 1
+    assert pool.stats()['allocated'] == 2
+
+
+def test_chunker_grows_on_fast_reads_and_shrinks_on_slow():
+    chunker = buffers.AdaptiveChunker(initial=1024, maximum=4096, target=1.0)
+    assert chunker.record(1024, 0.01) == 2048
+    assert chunker.record(2048, 0.01) == 4096
+    assert chunker.record(4096, 0.01) == 4096
+    # Short reads at end of body don't grow the size
+    assert chunker.record(10, 0.01) == 4096
+    assert chunker.record(4096, 5.0) == 2048
+    assert chunker.record(2048, 5.0) == 1024
+    assert chunker.record(1024, 5.0) == 1024
+
+
+def test_iter_response_reads_into_pooled_buffer(media_server):
+    media_server.files['/data/file.bin'] = CONTENT
+    pool = buffers.BufferPool()
+    with media(media_server, '/data/file.bin') as rsp:
+        blocks = [bytes(b) for b in buffers.iter_response(
+            rsp, block_size=4096, max_block_size=65536, buffer_pool=pool)]
+    assert b''.join(blocks) == CONTENT
+    assert max(len(b) for b in blocks) > 4096
+    assert pool.stats()['free'] == 1
+    with media(media_server, '/data/file.bin') as rsp:
+        assert sum(len(b) for b in buffers.iter_response(
+            rsp, max_block_size=65536, buffer_pool=pool)) == len(CONTENT)
+    assert pool.stats()['reused'] == 1
+
+
+def test_iter_response_reports_dropped_connection(media_server):
+    media_server.files['/data/file.bin'] = CONTENT
+    media_server.fail_after = 1000
+    received = 0
+    with pytest.raises(ChunkedEncodingError):
+        with media(media_server, '/data/file.bin') as rsp:
+            for block in buffers.iter_response(rsp, block_size=512):
+                received += len(block)
+    assert received == 1000
@@ -0,0 +1,81 @@
+import os
+import pytest
+from requests.exceptions import HTTPError
+
+from .. import bulk
+
+
+class FakeResponse(object):
+    def __init__(self, content):
+        self.content = content
+
+    def iter_content(self, size):
+        for pos in range(0, len(self.content), size):
+            yield self.content[pos:pos + size]
+
+
+class FakeFiles(object):
+    def __init__(self, contents):
+        self.contents = contents
+        self.granted = []
+
+    def importData(self, systemId, filePath, fileToUpload):
+        with fileToUpload:
+            content = fileToUpload.read()
+        name = os.path.basename(fileToUpload.name)
+        self.contents[os.path.join(filePath, name)] = content
+
+    def updatePermissions(self, systemId, filePath, body):
+        if filePath not in self.contents:
+            raise HTTPError('404 Client Error: Not Found')
+        self.granted.append(filePath)
+
+    def download(self, systemId, filePath):
+        if filePath not in self.contents:
+            raise HTTPError('404 Client Error: Not Found')
+        return FakeResponse(self.contents[filePath])
+
+
+class FakeAgave(object):
+    def __init__(self, contents):
+        self.files = FakeFiles(contents)
+
+
+@pytest.fixture
+def workdir(tmpdir, monkeypatch):
+    monkeypatch.setattr(bulk.bacanora, 'PWD', str(tmpdir))
+    monkeypatch.chdir(tmpdir)
+    return tmpdir
+
+
+def test_download_many(workdir):
+    contents = {'/sample/{}.txt'.format(i): os.urandom(1000 + i)
+                for i in range(12)}
+    ag = FakeAgave(contents)
+    pairs = [(path, os.path.basename(path)) for path in sorted(contents)]
+    report = bulk.download_many(ag, pairs + ['/sample/missing.txt'],
+                                system_id='bacanora-test', max_workers=4)
+    assert len(report) == 13
+    assert len(report.failed) == 1
+    assert report.results[-1].source == '/sample/missing.txt'
+    assert report.bytes == sum(len(c) for c in contents.values())
+    for result in report.succeeded:
+        with open(os.path.join(str(workdir), result.destination), 'rb') as f:
+            assert f.read() == contents[result.source]
+
+
+def test_upload_many_autogrant(workdir):
+    local_files = []
+    for i in range(8):
+        path = os.path.join(str(workdir), 'up-{}.bin'.format(i))
+        with open(path, 'wb') as f:
+            f.write(os.urandom(512))
+        local_files.append(path)
+    ag = FakeAgave({})
+    report = bulk.upload_many(ag, local_files, destination_path='/uploads',
+                              system_id='bacanora-test', autogrant=True,
+                              max_workers=4)
+    assert len(report.failed) == 0
+    assert report.bytes == 8 * 512
+    assert sorted(ag.files.granted) == sorted(
+        '/uploads/' + os.path.basename(p) for p in local_files)
@@ -0,0 +1,123 @@
+import time
+
+import pytest
+from requests import Response
+from requests.exceptions import ConnectionError, HTTPError
+
+from .. import bacanora
+from .. import circuitbreaker
+from .. import listing
+from ..circuitbreaker import CircuitBreaker, CircuitOpen
+from .test_storagesystems import posix_system
+
+SYSTEM = 'bacanora-test'
+
+
+class FailingFiles(object):
+    def __init__(self):
+        self.calls = 0
+
+    def list(self, **kwargs):
+        self.calls += 1
+        raise ConnectionError('connection refused')
+
+
+class FailingClient(object):
+    def __init__(self):
+        self.files = FailingFiles()
+
+
+def fail(breaker, exc):
+    with pytest.raises(type(exc)):
+        with breaker.guard():
+            raise exc
+
+
+@pytest.fixture
+def tripped(monkeypatch):
+    breaker = CircuitBreaker(circuitbreaker.FILES, min_calls=1,
+                             reset_timeout=60, enabled=True)
+    monkeypatch.setitem(circuitbreaker.breakers, circuitbreaker.FILES,
+                        breaker)
+    fail(breaker, ConnectionError('down'))
+    return breaker
+
+
+def test_opens_and_recovers():
+    breaker = CircuitBreaker('files', error_rate=0.5, window=4, min_calls=4,
+                             reset_timeout=0.2, half_open_calls=1,
+                             enabled=True)
+    for _ in range(2):
+        with breaker.guard():
+            pass
+    fail(breaker, ConnectionError('down'))
+    assert breaker.state == circuitbreaker.CLOSED
+    fail(breaker, ConnectionError('down'))
+    assert breaker.state == circuitbreaker.OPEN
+    with pytest.raises(CircuitOpen):
+        with breaker.guard():
+            pass
+    stats = breaker.stats()
+    assert stats['trips'] == 1 and stats['rejected'] == 1
+    assert 0 < stats['retry_in'] <= 0.2
+
+    time.sleep(0.25)
+    assert breaker.state == circuitbreaker.HALF_OPEN
+    with breaker.guard():
+        # Only a trickle of probes is admitted
+        with pytest.raises(CircuitOpen):
+            with breaker.guard():
+                pass
+    assert breaker.state == circuitbreaker.CLOSED
+
+
+def test_failed_probe_reopens():
+    breaker = CircuitBreaker('actors', min_calls=1, reset_timeout=0.1,
+                             enabled=True)
+    fail(breaker, ConnectionError('down'))
+    time.sleep(0.15)
+    fail(breaker, ConnectionError('still down'))
+    assert breaker.state == circuitbreaker.OPEN
+    assert breaker.trips == 2
+
+
+def test_client_errors_do_not_count():
+    breaker = CircuitBreaker('files', min_calls=2, enabled=True)
+    rsp = Response()
+    rsp.status_code = 404
+    for _ in range(5):
+        fail(breaker, HTTPError('404 Client Error', response=rsp))
+        fail(breaker, FileNotFoundError('nope'))
+    with breaker.guard() as call:
+        call.failed = circuitbreaker.failed_status(403)
+    assert breaker.state == circuitbreaker.CLOSED
+    with breaker.guard() as call:
+        call.failed = circuitbreaker.failed_status(503)
+    assert breaker.stats()['failures'] == 1
+
+
+def test_disabled_never_opens():
+    breaker = CircuitBreaker('files', min_calls=1, enabled=False)
+    for _ in range(3):
+        fail(breaker, ConnectionError('down'))
+    assert breaker.state == circuitbreaker.CLOSED
+
+
+def test_open_circuit_fails_fast(tripped):
+    client = FailingClient()
+    start = time.time()
+    with pytest.raises(CircuitOpen):
+        bacanora.exists(client, '/data/file.txt', system_id=SYSTEM)
+    assert time.time() - start < 1
+    assert client.files.calls == 0
+    assert circuitbreaker.state()['files']['state'] == circuitbreaker.OPEN
+
+
+def test_open_circuit_trusts_direct(tripped, posix_system):
+    posix_system.join('here.txt').write('x')
+    client = FailingClient()
+    assert bacanora.isfile(client, '/here.txt', system_id=SYSTEM)
+    assert not bacanora.exists(client, '/missing', system_id=SYSTEM)
+    with pytest.raises(FileNotFoundError):
+        listing.listdir(client, '/missing', system_id=SYSTEM)
+    assert client.files.calls == 0
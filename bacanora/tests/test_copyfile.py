@@ -0,0 +1,41 @@
+import os
+import pytest
+
+from .. import copyfile
+
+METHODS = [m for m in (copyfile.COPY_FILE_RANGE, copyfile.SENDFILE)
+           if hasattr(os, m)] + [copyfile.BUFFERED]
+
+
+@pytest.fixture
+def sparse_file(tmpdir):
+    path = str(tmpdir.join('sparse.bin'))
+    with open(path, 'wb') as f:
+        f.write(os.urandom(70000))
+        f.seek(8 * 1024 * 1024, os.SEEK_CUR)
+        f.write(os.urandom(5000))
+        f.truncate(f.tell() + 3 * 1024 * 1024)
+    return path
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_copy_preserves_content_and_holes(sparse_file, tmpdir, method):
+    dst = str(tmpdir.join('copy-' + method))
+    copyfile.copy(sparse_file, dst, methods=[method])
+    with open(sparse_file, 'rb') as a, open(dst, 'rb') as b:
+        assert a.read() == b.read()
+    src_st, dst_st = os.stat(sparse_file), os.stat(dst)
+    assert src_st.st_mode == dst_st.st_mode
+    if src_st.st_blocks * 512 < src_st.st_size:
+        assert dst_st.st_blocks <= src_st.st_blocks
+
+
+def test_copy_falls_back(sparse_file, tmpdir, monkeypatch):
+    def refuse(*args, **kwargs):
+        raise OSError(copyfile.errno.EXDEV, 'Invalid cross-device link')
+    monkeypatch.setitem(copyfile.COPIERS, copyfile.COPY_FILE_RANGE, refuse)
+    monkeypatch.setitem(copyfile.COPIERS, copyfile.SENDFILE, refuse)
+    dst = str(tmpdir.join('fallback'))
+    assert copyfile.copyfile(sparse_file, dst) == copyfile.BUFFERED
+    with open(sparse_file, 'rb') as a, open(dst, 'rb') as b:
+        assert a.read() == b.read()
@@ -0,0 +1,36 @@
+import os
+
+from .. import bulk
+from .. import direct
+from .fixtures.media import media_server, MediaClient
+from .test_storagesystems import posix_system
+
+SYSTEM = 'bacanora-test'
+
+
+def test_rmtree_parallel(tmpdir):
+    outside = tmpdir.mkdir('outside')
+    outside.join('keep.txt').write('keep')
+    top = tmpdir.mkdir('scratch')
+    for d in range(5):
+        sub = top.mkdir('d{}'.format(d)).mkdir('inner')
+        for f in range(300):
+            sub.join('f{}.dat'.format(f)).write('x')
+    top.join('link').mksymlinkto(outside)
+    direct.rmtree(str(top), max_workers=4)
+    assert not top.exists()
+    assert outside.join('keep.txt').read() == 'keep'
+
+
+def test_delete_many(posix_system, media_server):
+    posix_system.mkdir('out').mkdir('run1').join('a.txt').write('a')
+    posix_system.join('single.txt').write('s')
+    media_server.files['/api/only.txt'] = b'api'
+    report = bulk.delete_many(
+        MediaClient(media_server),
+        ['/out', '/single.txt', '/api/only.txt', '/never/existed'],
+        system_id=SYSTEM, max_workers=2)
+    assert not report.failed
+    assert [r.result for r in report] == [True, True, True, False]
+    assert os.listdir(str(posix_system)) == []
+    assert media_server.files == {}
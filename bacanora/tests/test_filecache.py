@@ -0,0 +1,89 @@
+import os
+import pytest
+
+from .. import bacanora
+from .. import filecache
+
+
+class FakeResponse(object):
+    def __init__(self, content):
+        self.content = content
+
+    def iter_content(self, size):
+        yield self.content
+
+
+class FakeFiles(object):
+    def __init__(self, content):
+        self.content = content
+        self.downloads = 0
+
+    def list(self, systemId, filePath, limit=None, offset=None):
+        return [{'name': 'ref.csv', 'format': 'raw', 'length': len(self.content),
+                 'lastModified': '2019-01-01T00:00:00.000-06:00'}]
+
+    def download(self, systemId, filePath):
+        self.downloads += 1
+        return FakeResponse(self.content)
+
+
+class FakeAgave(object):
+    def __init__(self, content):
+        self.files = FakeFiles(content)
+
+
+def write(path, size):
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+
+
+def test_eviction_is_lru(tmpdir):
+    cache = filecache.DownloadCache(str(tmpdir.join('cache')), max_bytes=2500)
+    for name in ('a', 'b', 'c'):
+        write(str(tmpdir.join(name)), 1000)
+    cache.store('aa01', str(tmpdir.join('a')))
+    cache.store('bb02', str(tmpdir.join('b')))
+    assert cache.fetch('aa01', str(tmpdir.join('out')))
+    # Like download_tree() setting the remote mtime on a linked hit
+    os.utime(str(tmpdir.join('out')), (0, 0))
+    cache.store('cc03', str(tmpdir.join('c')))
+    assert not cache.fetch('bb02', str(tmpdir.join('out')))
+    assert cache.stats()['objects'] == 2
+
+
+def test_download_served_from_cache(tmpdir, monkeypatch):
+    monkeypatch.setattr(bacanora, 'PWD', str(tmpdir))
+    monkeypatch.setattr(filecache, 'cache', filecache.DownloadCache(
+        str(tmpdir.join('cache'))))
+    ag = FakeAgave(b'plate,map\n')
+    for name in ('first.csv', 'second.csv'):
+        bacanora.download(ag, '/reference/ref.csv', name,
+                          system_id='bacanora-test')
+        with open(str(tmpdir.join(name)), 'rb') as f:
+            assert f.read() == b'plate,map\n'
+    assert ag.files.downloads == 1
+    assert filecache.cache.hits == 1
+
+
+def test_stored_download_stays_writable(tmpdir):
+    cache = filecache.DownloadCache(str(tmpdir.join('cache')))
+    source = str(tmpdir.join('a'))
+    write(source, 1000)
+    mode = os.stat(source).st_mode
+    cache.store('aa01', source)
+    assert not os.path.samefile(cache._object('aa01'), source)
+    assert os.stat(source).st_mode == mode
+    with open(source, 'ab') as f:
+        f.write(b'more')
+    assert os.path.getsize(cache._object('aa01')) == 1000
+    # Hits in link mode share the read-only cache object
+    assert cache.fetch('aa01', str(tmpdir.join('hit')))
+    assert os.path.samefile(cache._object('aa01'), str(tmpdir.join('hit')))
+    assert not os.stat(str(tmpdir.join('hit'))).st_mode & 0o222
+
+
+def test_checksum_key_ignores_path():
+    key = filecache.DownloadCache.key
+    assert key('sys', '/a.csv', 10, None, checksum='abc') == \
+        key('other', '/b.csv', 10, 5.0, checksum='abc')
+    assert key('sys', '/a.csv', 10, 5.0) != key('sys', '/b.csv', 10, 5.0)
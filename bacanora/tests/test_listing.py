@@ -0,0 +1,171 @@
+import posixpath
+import time
+
+import pytest
+
+from .. import listing
+from .fixtures.media import media_server, MediaClient
+from .test_storagesystems import posix_system
+
+SYSTEM = 'bacanora-test'
+
+
+class CountingFiles(object):
+    def __init__(self, files):
+        self.files = files
+        self.calls = []
+
+    def list(self, systemId, filePath, limit=None, offset=None):
+        self.calls.append((limit, offset))
+        return self.files.list(systemId, filePath, limit=limit, offset=offset)
+
+
+def test_scandir_pages(media_server):
+    for i in range(23):
+        media_server.files['/big/f{:02d}.txt'.format(i)] = b'x' * i
+    media_server.files['/big/sub/g.txt'] = b'g'
+    client = MediaClient(media_server)
+    client.files = CountingFiles(client.files)
+    entries = list(listing.scandir(client, '/big', system_id=SYSTEM,
+                                   page_size=5))
+    assert [e.name for e in entries] == \
+        ['f{:02d}.txt'.format(i) for i in range(23)] + ['sub']
+    assert entries[-1].is_dir() and entries[3].is_file()
+    assert entries[3].stat().size == 3
+    # 25 entries including '.' in pages of 5, plus the empty final page
+    assert client.files.calls == [(5, offset) for offset in range(0, 30, 5)]
+
+
+def test_listdir_errors(media_server):
+    media_server.files['/data/a.txt'] = b'a'
+    client = MediaClient(media_server)
+    assert listing.listdir(client, '/data', system_id=SYSTEM) == ['a.txt']
+    with pytest.raises(FileNotFoundError):
+        listing.listdir(client, '/missing', system_id=SYSTEM)
+    with pytest.raises(NotADirectoryError):
+        listing.scandir(client, '/data/a.txt', system_id=SYSTEM)
+
+
+def test_scandir_direct(posix_system):
+    posix_system.mkdir('data').join('a.txt').write('abc')
+    posix_system.join('data').mkdir('sub')
+    entries = sorted(listing.scandir(None, '/data', system_id=SYSTEM),
+                     key=lambda e: e.name)
+    assert [(e.name, e.path, e.is_dir()) for e in entries] == \
+        [('a.txt', '/data/a.txt', False), ('sub', '/data/sub', True)]
+    assert entries[0].stat().via == 'direct'
+
+
+def tree_files(files):
+    for path in ('/t/a.txt', '/t/x/b.txt', '/t/x/deep/c.txt', '/t/y/d.txt',
+                 '/t/y/skip/e.txt', '/t/z/f.txt'):
+        files[path] = b'.'
+
+
+def test_walk_topdown_matches_os_walk_order(media_server):
+    tree_files(media_server.files)
+    result = list(listing.walk(MediaClient(media_server), '/t',
+                               system_id=SYSTEM, max_workers=4))
+    assert result == [('/t', ['x', 'y', 'z'], ['a.txt']),
+                      ('/t/x', ['deep'], ['b.txt']),
+                      ('/t/x/deep', [], ['c.txt']),
+                      ('/t/y', ['skip'], ['d.txt']),
+                      ('/t/y/skip', [], ['e.txt']),
+                      ('/t/z', [], ['f.txt'])]
+
+
+def test_walk_completed_order_and_pruning(media_server):
+    tree_files(media_server.files)
+    seen = []
+    for dirpath, dirnames, filenames in listing.walk(
+            MediaClient(media_server), '/t', system_id=SYSTEM,
+            order=listing.COMPLETED, max_workers=4):
+        seen.append(dirpath)
+        if 'skip' in dirnames:
+            dirnames.remove('skip')
+    assert seen[0] == '/t'
+    assert sorted(seen) == ['/t', '/t/x', '/t/x/deep', '/t/y', '/t/z']
+    assert seen.index('/t/x') < seen.index('/t/x/deep')
+
+
+class SlowParentEntry(object):
+    """A directory whose symlink check, made while its parent's listing is
+    finishing, stalls long enough for a sibling's listing to complete"""
+
+    def __init__(self, path, delay):
+        self.path = path
+        self.name = posixpath.basename(path)
+        self.delay = delay
+
+    def is_dir(self):
+        return True
+
+    def is_symlink(self):
+        time.sleep(self.delay)
+        return False
+
+
+@pytest.mark.parametrize('order', [listing.TOPDOWN, listing.COMPLETED])
+def test_walk_parent_before_children(monkeypatch, order):
+    tree = {'/t': ['/t/a', '/t/b'], '/t/a': ['/t/a/deep'], '/t/b': [],
+            '/t/a/deep': []}
+
+    def scandir(agave_client, path, system_id=None, page_size=None):
+        # The second child delays the parent's listing after the first
+        # child has been found, which is when a fast child used to win
+        return [SlowParentEntry(child, 0.2 if i else 0)
+                for i, child in enumerate(tree[path])]
+
+    monkeypatch.setattr(listing, 'scandir', scandir)
+    seen = [dirpath for dirpath, _, _ in listing.walk(
+        None, '/t', system_id=SYSTEM, order=order, max_workers=4)]
+    assert sorted(seen) == sorted(tree)
+    for path in seen:
+        if path != '/t':
+            assert seen.index(posixpath.dirname(path)) < seen.index(path)
+
+
+@pytest.mark.parametrize('order', [listing.TOPDOWN, listing.COMPLETED])
+def test_walk_buffers_bounded(monkeypatch, order):
+    tree = {'/t': ['/t/d{:02d}'.format(i) for i in range(40)]}
+    for child in list(tree['/t']):
+        tree[child] = [child + '/g{}'.format(i) for i in range(3)]
+        for grandchild in tree[child]:
+            tree[grandchild] = []
+    started = []
+
+    def scandir(agave_client, path, system_id=None, page_size=None):
+        started.append(path)
+        return [SlowParentEntry(child, 0) for child in tree[path]]
+
+    monkeypatch.setattr(listing, 'scandir', scandir)
+    monkeypatch.setattr(listing, 'WALK_MAX_BUFFERED', 4)
+    seen = []
+    for dirpath, _, _ in listing.walk(None, '/t', system_id=SYSTEM,
+                                      order=order, max_workers=2):
+        seen.append(dirpath)
+        # Listings started but not yet yielded, plus one forced start
+        assert len(started) - len(seen) <= 4 + 1
+    assert sorted(seen) == sorted(tree)
+    if order == listing.TOPDOWN:
+        assert seen == ['/t'] + [path for child in tree['/t']
+                                 for path in [child] + tree[child]]
+
+
+def test_walk_errors(media_server):
+    errors = []
+    assert list(listing.walk(MediaClient(media_server), '/missing',
+                             system_id=SYSTEM, onerror=errors.append)) == []
+    assert isinstance(errors[0], FileNotFoundError)
+
+
+def test_walk_direct(posix_system):
+    root = posix_system.mkdir('t')
+    root.mkdir('x').mkdir('deep').join('c.txt').write('c')
+    root.join('a.txt').write('a')
+    root.join('link').mksymlinkto(root.join('x'))
+    result = {d: (sorted(n), f) for d, n, f in
+              listing.walk(None, '/t', system_id=SYSTEM)}
+    assert result == {'/t': (['link', 'x'], ['a.txt']),
+                      '/t/x': (['deep'], []),
+                      '/t/x/deep': ([], ['c.txt'])}
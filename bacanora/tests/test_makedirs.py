@@ -0,0 +1,30 @@
+from .. import bulk
+from .fixtures.media import media_server, MediaClient
+from .test_storagesystems import posix_system
+
+SYSTEM = 'bacanora-test'
+
+
+def test_makedirs_many_api(media_server):
+    media_server.dirs.update(['/out', '/out/a', '/out/a/d'])
+    report = bulk.makedirs_many(
+        MediaClient(media_server),
+        ['/out/a/b', '/out/a/b/c/', 'out/a/d', '/out/a/e', '/new/x/y',
+         '/out/a'], system_id=SYSTEM, max_workers=3)
+    assert [r.source for r in report] == ['/new/x/y', '/out/a/b/c', '/out/a/e']
+    assert not report.failed and report.skipped == ['/out/a/d']
+    # The siblings under /out/a share a single listing
+    assert media_server.listings == ['/out/a']
+    assert sorted(c[3]['path'] for c in media_server.calls) == \
+        ['/new/x/y', '/out/a/b/c', '/out/a/e']
+
+
+def test_makedirs_many_direct(posix_system, media_server):
+    posix_system.mkdir('out').mkdir('done')
+    report = bulk.makedirs_many(MediaClient(media_server),
+                                ['/out/done', '/out/x/y', '/out/z'],
+                                system_id=SYSTEM)
+    assert len(report.succeeded) == 2 and report.skipped == ['/out/done']
+    assert posix_system.join('out', 'x', 'y').isdir()
+    assert posix_system.join('out', 'z').isdir()
+    assert media_server.calls == []
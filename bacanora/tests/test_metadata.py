@@ -0,0 +1,88 @@
+import pytest
+from requests.exceptions import HTTPError
+
+from .. import bacanora
+from .. import metadata
+
+
+class NotFound(HTTPError):
+    def __init__(self):
+        super(NotFound, self).__init__('404 Client Error: Not Found')
+        self.response = type('Response', (), {'status_code': 404})()
+
+
+class FakeFiles(object):
+    def __init__(self, listings):
+        self.listings = listings
+        self.calls = 0
+
+    def list(self, systemId, filePath, limit=None, offset=None):
+        self.calls += 1
+        if filePath not in self.listings:
+            raise NotFound()
+        return [self.listings[filePath]]
+
+
+class FakeAgave(object):
+    def __init__(self, listings):
+        self.files = FakeFiles(listings)
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    c = metadata.MetadataCache(ttl=60, maxsize=3, enabled=True)
+    monkeypatch.setattr(metadata, 'cache', c)
+    return c
+
+
+def test_cache_lru_and_ttl():
+    c = metadata.MetadataCache(ttl=60, maxsize=2, enabled=True)
+    c.put('sys', '/a', 1)
+    c.put('sys', '/b/', 2)
+    assert c.get('sys', 'a') == (True, 1)
+    c.put('sys', '/c', 3)
+    assert c.get('sys', '/b') == (False, None)
+    assert c.get('sys', '/a') == (True, 1)
+    c.ttl = -1
+    c.put('sys', '/d', 4)
+    assert c.get('sys', '/d') == (False, None)
+    stats = c.stats()
+    assert stats['hits'] == 2 and stats['misses'] == 2
+    assert stats['evictions'] == 2
+
+
+def test_cache_invalidate():
+    c = metadata.MetadataCache(enabled=True)
+    for path in ('/p', '/p/q', '/p/q/r', '/p/qr'):
+        c.put('sys', path, None)
+    c.invalidate('sys', '/p/q', children=True)
+    assert c.get('sys', '/p/q/r')[0] is False
+    assert c.get('sys', '/p/qr')[0] is True
+    c.invalidate('sys', '/p/qr/s', parents=True)
+    assert c.get('sys', '/p')[0] is False
+
+
+def test_one_listing_answers_all(cache):
+    ag = FakeAgave({'/data/f.txt': {'name': 'f.txt', 'format': 'raw',
+                                    'length': 10}})
+    system_id = 'bacanora-test'
+    assert bacanora.exists(ag, '/data/f.txt', system_id=system_id)
+    assert bacanora.isfile(ag, '/data/f.txt', system_id=system_id)
+    assert not bacanora.isdir(ag, '/data/f.txt', system_id=system_id)
+    assert not bacanora.exists(ag, '/data/nope', system_id=system_id)
+    assert not bacanora.isdir(ag, '/data/nope', system_id=system_id)
+    assert ag.files.calls == 2
+
+
+def test_stat_from_listing(cache):
+    ag = FakeAgave({'/data/d': {'name': '.', 'format': 'folder', 'length': 0,
+                                'lastModified': '2019-03-01T12:00:00.000-06:00',
+                                'permissions': 'READ'}})
+    record = bacanora.stat(ag, '/data/d', system_id='bacanora-test')
+    assert record.is_dir() and not record.is_file()
+    assert record.mtime == 1551463200.0
+    assert record.permissions == 'READ' and record.via == 'api'
+    with pytest.raises(FileNotFoundError):
+        bacanora.stat(ag, '/data/nope', system_id='bacanora-test')
+    assert bacanora.isdir(ag, '/data/d', system_id='bacanora-test')
+    assert ag.files.calls == 2
@@ -0,0 +1,142 @@
+import urllib.request
+
+import pytest
+from requests import Response
+from requests.exceptions import HTTPError
+from tenacity import retry, stop_after_attempt
+
+from .. import bacanora
+from .. import metrics
+from ..agaveutils import reactors
+from .test_storagesystems import posix_system, ApiClient
+
+SYSTEM = 'bacanora-test'
+
+
+class MissingFiles(object):
+    def list(self, **kwargs):
+        rsp = Response()
+        rsp.status_code = 404
+        raise HTTPError('404 Client Error: Not Found', response=rsp)
+
+
+class MissingClient(object):
+    files = MissingFiles()
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = metrics.Registry(enabled=True)
+    monkeypatch.setattr(metrics, 'registry', registry)
+    return registry
+
+
+def test_operations_by_path(registry, posix_system, monkeypatch, tmpdir):
+    posix_system.join('data.bin').write_binary(b'x' * 1000)
+    monkeypatch.chdir(tmpdir.mkdir('work'))
+    monkeypatch.setattr(bacanora, 'PWD', str(tmpdir.join('work')))
+    client = ApiClient()
+    assert bacanora.exists(client, '/data.bin', system_id=SYSTEM)
+    assert bacanora.exists(client, '/missing', system_id=SYSTEM)
+    bacanora.download(client, '/data.bin', system_id=SYSTEM)
+    with pytest.raises(FileNotFoundError):
+        bacanora.stat(MissingClient(), '/data.bin',
+                      system_id='bacanora-missing')
+
+    ops = registry.operations
+    assert ops.value(('exists', 'direct', SYSTEM, 'ok')) == 1
+    assert ops.value(('exists', 'api', SYSTEM, 'ok')) == 1
+    assert ops.value(('download', 'direct', SYSTEM, 'ok')) == 1
+    assert ops.value(('stat', 'api', 'bacanora-missing', 'error')) == 1
+    assert registry.bytes.value(('download', 'direct', SYSTEM)) == 1000
+    assert registry.duration.count(('exists', 'api', SYSTEM, 'ok')) == 1
+
+
+def test_one_observation_per_call(registry, posix_system, monkeypatch):
+    monkeypatch.setattr(bacanora.direct, 'DIRECT_AUTHORITATIVE', True)
+    posix_system.join('old.txt').write('x')
+    client = ApiClient()
+    assert bacanora.mkdir(client, '/made', system_id=SYSTEM)
+    assert bacanora.delete(client, '/old.txt', system_id=SYSTEM)
+    ops = registry.operations
+    assert ops.value(('mkdir', 'direct', SYSTEM, 'ok')) == 1
+    assert ops.value(('delete', 'direct', SYSTEM, 'ok')) == 1
+    assert ops.value(('isdir', 'direct', SYSTEM, 'ok')) == 0
+    assert ops.value(('exists', 'direct', SYSTEM, 'ok')) == 0
+    assert client.files.calls == []
+
+
+def test_early_failure_not_counted_as_direct(registry):
+    @metrics.instrument
+    def broken(agave_client, path, system_id='sys'):
+        raise ValueError('bad arguments')
+
+    with pytest.raises(ValueError):
+        broken(None, '/a')
+    ops = registry.operations
+    assert ops.value(('broken', metrics.NONE, 'sys', 'error')) == 1
+    assert ops.value(('broken', metrics.DIRECT, 'sys', 'error')) == 0
+
+
+def test_actor_calls_labeled_api(registry):
+    class Actors(object):
+        def sendMessage(self, **kwargs):
+            return {'executionId': 'exec-1'}
+
+    class ActorClient(object):
+        actors = Actors()
+
+    assert reactors.send_message(ActorClient(), 'actor-1', 'hi') == 'exec-1'
+    assert registry.operations.value(
+        ('send_message', 'api', '', 'ok')) == 1
+
+
+def test_retries_counted(registry):
+    attempts = []
+
+    @metrics.instrument
+    @retry(stop=stop_after_attempt(3), reraise=True,
+           before_sleep=metrics.retried)
+    def flaky(system_id='sys'):
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise IOError('try again')
+        return True
+
+    assert flaky()
+    assert registry.retries.value(('flaky',)) == 2
+    assert registry.operations.value(('flaky', 'none', 'sys', 'ok')) == 1
+
+
+def test_disabled_records_nothing(posix_system):
+    registry = metrics.registry
+    assert not registry.enabled
+    bacanora.exists(ApiClient(), '/missing', system_id=SYSTEM)
+    assert registry.operations.value(('exists', 'api', SYSTEM, 'ok')) == 0
+
+
+def test_exposition(registry, tmpdir):
+    labels = ('download', 'api', 'data-sd2e-community', 'ok')
+    registry.operations.inc(labels)
+    registry.duration.observe(labels, 0.3)
+    registry.duration.observe(labels, 7)
+    text = registry.exposition()
+    assert '# TYPE bacanora_operation_duration_seconds histogram' in text
+    assert ('bacanora_operations_total{operation="download",path="api",'
+            'system="data-sd2e-community",outcome="ok"} 1') in text
+    assert 'le="0.25"} 0\n' in text
+    assert 'le="0.5"} 1\n' in text
+    assert 'le="+Inf"} 2\n' in text
+    assert 'bacanora_circuit_open{family="files"} 0' in text
+
+    target = metrics.write(str(tmpdir.join('bacanora.prom')))
+    assert open(target).read() == registry.exposition()
+
+    server = metrics.serve(port=0)
+    try:
+        url = 'http://127.0.0.1:{}/metrics'.format(server.server_address[1])
+        with urllib.request.urlopen(url) as rsp:
+            assert rsp.read().decode('utf-8') == registry.exposition()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,79 @@
+import os
+import pytest
+
+from ..agaveutils.recursive import PemAgent
+
+TREE = {'/proj': (['a', 'b'], ['top.txt']),
+        '/proj/a': (['c'], ['a1.txt', 'a2.txt']),
+        '/proj/a/c': ([], ['c1.txt']),
+        '/proj/b': ([], ['b1.txt', 'broken.txt'])}
+
+
+class FakeFiles(object):
+    def __init__(self):
+        self.granted = []
+
+    def list(self, systemId, filePath, limit=None, offset=0):
+        dirs, files = TREE[filePath]
+        listing = [{'name': '.', 'format': 'folder'}]
+        listing.extend({'name': d, 'format': 'folder'} for d in dirs)
+        listing.extend({'name': f, 'format': 'raw'} for f in files)
+        return listing[offset:offset + limit if limit else None]
+
+    def updatePermissions(self, systemId, filePath, body):
+        if filePath.endswith('broken.txt'):
+            raise ValueError('permission denied')
+        self.granted.append(filePath)
+
+
+class FakeAgave(object):
+    def __init__(self):
+        self.files = FakeFiles()
+
+
+def expected_grants():
+    paths = set()
+    for root, (dirs, files) in TREE.items():
+        paths.add(root)
+        paths.update(os.path.join(root, n) for n in dirs + files)
+    paths.discard('/proj/b/broken.txt')
+    return sorted(paths)
+
+
+def test_grant_collects_failures():
+    ag = FakeAgave()
+    seen = []
+    agent = PemAgent(ag, max_workers=4, rate=0)
+    assert agent.grant('data-test', '/proj', progress=seen.append) is True
+    assert sorted(ag.files.granted) == expected_grants()
+    assert [p for p, e in agent.failures] == ['/proj/b/broken.txt']
+    assert seen[-1] == {'granted': len(expected_grants()),
+                        'listed': len(TREE), 'failed': 1}
+
+
+def test_grant_not_permissive_still_returns():
+    agent = PemAgent(FakeAgave(), max_workers=2, rate=0)
+    assert agent.grant('data-test', '/proj', permissive=False) is True
+    assert len(agent.failures) == 1
+
+
+def test_grant_survives_failing_progress():
+    ag = FakeAgave()
+
+    def progress(snapshot):
+        raise RuntimeError('callback bug')
+    agent = PemAgent(ag, max_workers=2, rate=0)
+    assert agent.grant('data-test', '/proj', progress=progress) is True
+    assert sorted(ag.files.granted) == expected_grants()
+
+
+def test_grant_missing_root_raises():
+    agent = PemAgent(FakeAgave(), max_workers=2, rate=0)
+    with pytest.raises(Exception):
+        agent.grant('data-test', '/nope')
+
+
+def test_listdir_follows_pages(monkeypatch):
+    monkeypatch.setattr('bacanora.agaveutils.recursive.LIST_PAGE_SIZE', 2)
+    agent = PemAgent(FakeAgave())
+    assert agent.listdir('data', '/proj/a')[:2] == (['c'], ['a1.txt', 'a2.txt'])
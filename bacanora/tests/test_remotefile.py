@@ -0,0 +1,54 @@
+import io
+import os
+import pytest
+
+from .. import remotefile
+from .fixtures.media import media_server, MediaClient
+
+CONTENT = os.urandom(10000)
+
+
+@pytest.fixture
+def client(media_server):
+    media_server.files['/data/table.bin'] = CONTENT
+    return MediaClient(media_server)
+
+
+def test_random_and_sequential_reads(client, media_server):
+    f = remotefile.open(client, '/data/table.bin', system_id='bacanora-test',
+                        block_size=1024, cache_blocks=4, readahead=2)
+    assert isinstance(f, remotefile.RemoteFile)
+    f.seek(-100, io.SEEK_END)
+    assert f.read() == CONTENT[-100:]
+    f.seek(1000)
+    assert f.read(3000) == CONTENT[1000:4000]
+    assert f.tell() == 4000
+    f.seek(0)
+    assert f.read() == CONTENT
+    assert f.read(10) == b''
+    f.close()
+
+
+def test_block_cache_limits_requests(client, media_server):
+    with remotefile.open(client, '/data/table.bin', system_id='bacanora-test',
+                         block_size=4096, readahead=0) as f:
+        for _ in range(5):
+            f.seek(10)
+            f.read(20)
+    assert len(media_server.requests) == 1
+
+
+def test_missing_file(client):
+    with pytest.raises(FileNotFoundError):
+        remotefile.open(client, '/data/none.bin', system_id='bacanora-test')
+
+
+def test_ranges_ignored_streams_once(client, media_server):
+    media_server.honor_ranges = False
+    with remotefile.open(client, '/data/table.bin', system_id='bacanora-test',
+                         block_size=1024, cache_blocks=1, readahead=2) as f:
+        assert f.read() == CONTENT
+        f.seek(500)
+        assert f.read(100) == CONTENT[500:600]
+    # One whole-file response for the pass, and one more after seeking back
+    assert len(media_server.requests) == 2
@@ -0,0 +1,81 @@
+import os
+import pytest
+from agavepy.agave import AgaveError
+
+from .. import resumable
+from .. import sessions
+from .fixtures.media import media_server, MediaClient
+
+CONTENT = os.urandom(100000)
+
+
+@pytest.fixture
+def interrupted(media_server, tmpdir):
+    media_server.files['/data/big.bin'] = CONTENT
+    media_server.fail_after = 30000
+    dest = str(tmpdir.join('big.bin'))
+    client = MediaClient(media_server)
+    with pytest.raises(AgaveError):
+        resumable.fetch(client, '/data/big.bin', dest, 'bacanora-test',
+                        block_size=4096)
+    part, sidecar = resumable.partial_paths(dest)
+    assert 0 < os.path.getsize(part) <= 30000
+    assert os.path.exists(sidecar)
+    return client, dest
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_resume_with_range(interrupted, media_server):
+    client, dest = interrupted
+    size = resumable.fetch(client, '/data/big.bin', dest, 'bacanora-test')
+    assert size == len(CONTENT) and read(dest) == CONTENT
+    assert media_server.requests[-1][1].startswith('bytes=')
+    assert media_server.requests[-1][1] != 'bytes=0-'
+    assert not any(os.path.exists(p) for p in resumable.partial_paths(dest))
+
+
+def test_restart_when_ranges_ignored(interrupted, media_server):
+    client, dest = interrupted
+    media_server.honor_ranges = False
+    resumable.fetch(client, '/data/big.bin', dest, 'bacanora-test')
+    assert read(dest) == CONTENT
+
+
+def test_restart_when_remote_changed(interrupted, media_server):
+    client, dest = interrupted
+    media_server.files['/data/big.bin'] = CONTENT[:50000]
+    resumable.fetch(client, '/data/big.bin', dest, 'bacanora-test')
+    assert read(dest) == CONTENT[:50000]
+    assert media_server.requests[-1][1] is None
+
+
+def test_finish_complete_part(media_server, tmpdir):
+    # Killed after the last byte was written but before the rename
+    media_server.files['/data/big.bin'] = CONTENT
+    dest = str(tmpdir.join('big.bin'))
+    part, sidecar = resumable.partial_paths(dest)
+    with open(part, 'wb') as f:
+        f.write(CONTENT)
+    resumable.Checkpoint('bacanora-test', '/data/big.bin',
+                         size=len(CONTENT)).save(sidecar)
+    size = resumable.fetch(MediaClient(media_server), '/data/big.bin', dest,
+                           'bacanora-test')
+    assert size == len(CONTENT) and read(dest) == CONTENT
+    assert media_server.requests[-1][1] == 'bytes={}-'.format(len(CONTENT))
+    assert not any(os.path.exists(p) for p in resumable.partial_paths(dest))
+
+
+def test_fetches_reuse_connection(media_server, tmpdir):
+    sessions.reset()
+    media_server.files['/data/big.bin'] = CONTENT
+    client = MediaClient(media_server)
+    for i in range(5):
+        dest = str(tmpdir.join('copy{}.bin'.format(i)))
+        resumable.fetch(client, '/data/big.bin', dest, 'bacanora-test',
+                        block_size=4096)
+        assert read(dest) == CONTENT
+    assert len(media_server.peers) == 1
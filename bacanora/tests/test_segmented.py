@@ -0,0 +1,57 @@
+import os
+
+from .. import resumable
+from .. import segmented
+from .fixtures.media import media_server, MediaClient
+
+CONTENT = os.urandom(250001)
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_split_covers_file():
+    ranges = segmented.split(10, 3)
+    assert ranges == [(0, 3), (4, 7), (8, 9)]
+    assert segmented.split(2, 8) == [(0, 0), (1, 1)]
+
+
+def test_segmented_download(media_server, tmpdir):
+    media_server.files['/data/big.bin'] = CONTENT
+    media_server.fail_after = 1000
+    dest = str(tmpdir.join('big.bin'))
+    size = resumable.fetch(MediaClient(media_server), '/data/big.bin', dest,
+                           'bacanora-test', segments=4,
+                           segment_threshold=100000)
+    assert size == len(CONTENT) and read(dest) == CONTENT
+    ranges = [r for _, r in media_server.requests if r]
+    assert len(ranges) >= 4
+    assert not os.path.exists(dest + segmented.SEGMENTS_SUFFIX)
+
+
+def test_small_or_unranged_files_use_one_stream(media_server, tmpdir):
+    media_server.files['/data/big.bin'] = CONTENT
+    media_server.honor_ranges = False
+    dest = str(tmpdir.join('big.bin'))
+    client = MediaClient(media_server)
+    resumable.fetch(client, '/data/big.bin', dest, 'bacanora-test',
+                    segments=4, segment_threshold=100000)
+    assert read(dest) == CONTENT
+    media_server.requests[:] = []
+    media_server.files['/data/small.bin'] = CONTENT[:5000]
+    resumable.fetch(client, '/data/small.bin', dest, 'bacanora-test',
+                    segments=4, segment_threshold=100000)
+    assert read(dest) == CONTENT[:5000]
+    assert media_server.requests == [(
+        '/files/v2/media/system/bacanora-test/data/small.bin?x-nonce=bacanora-test', None)]
+
+
+def test_empty_file_with_zero_threshold(media_server, tmpdir):
+    media_server.files['/data/empty.bin'] = b''
+    dest = str(tmpdir.join('empty.bin'))
+    assert not segmented.eligible(0, segments=4, threshold=0)
+    size = resumable.fetch(MediaClient(media_server), '/data/empty.bin', dest,
+                           'bacanora-test', segments=4, segment_threshold=0)
+    assert size == 0 and read(dest) == b''
@@ -0,0 +1,103 @@
+import os
+
+import pytest
+from agavepy.swaggerpy.http_client import SynchronousHttpClient
+
+from .. import sessions
+from ..agaveutils import rest
+from .fixtures.media import media_server, MediaClient
+
+
+@pytest.fixture
+def fresh_session():
+    sessions.reset()
+    yield
+    sessions.reset()
+
+
+def test_session_shared_and_sized(fresh_session):
+    session = sessions.get()
+    assert sessions.get() is session
+    adapter = session.get_adapter('https://api.example.org/')
+    assert adapter._pool_maxsize == sessions.HTTP_POOL_SIZE
+
+
+def test_session_rebuilt_in_new_process(fresh_session, monkeypatch):
+    session = sessions.get()
+    pid = os.getpid()
+    monkeypatch.setattr(os, 'getpid', lambda: pid + 1)
+    assert sessions.get() is not session
+
+
+def test_session_dropped_after_fork(fresh_session):
+    if not hasattr(os, 'fork'):
+        pytest.skip('fork not available')
+    session = sessions.get()
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        os.write(write, b'1' if sessions._session is None else b'0')
+        os._exit(0)
+    os.close(write)
+    assert os.read(read, 1) == b'1'
+    os.close(read)
+    os.waitpid(pid, 0)
+    assert sessions.get() is session
+
+
+def test_requests_reuse_connections(fresh_session, media_server):
+    media_server.files['/data/a.txt'] = b'hello'
+    client = MediaClient(media_server)
+    for _ in range(3):
+        with rest.get_media(client, 'bacanora-test', '/data/a.txt') as rsp:
+            assert rsp.content == b'hello'
+    assert len(media_server.peers) == 1
+
+
+class AgavePyClient(object):
+    """The attributes AgavePy sets on an Agave client"""
+
+    def __init__(self):
+        self.all = SwaggerClient()
+
+
+class SwaggerClient(object):
+    def __init__(self):
+        self.http_client = SynchronousHttpClient()
+
+
+def test_attach_pools_agavepy_session():
+    ag = AgavePyClient()
+    session = ag.all.http_client.session
+    assert sessions.attach(ag)
+    adapter = session.get_adapter('https://api.example.org/')
+    assert isinstance(adapter, sessions.PooledAdapter)
+    assert adapter._pool_maxsize == sessions.HTTP_POOL_SIZE
+    assert adapter.timeout == sessions.DEFAULT_TIMEOUT
+    assert sessions.attach(ag)
+    assert session.get_adapter('https://api.example.org/') is adapter
+    assert not sessions.attach(object())
+
+
+def test_attached_session_remounted_after_fork():
+    if not hasattr(os, 'fork'):
+        pytest.skip('fork not available')
+    ag = AgavePyClient()
+    sessions.attach(ag)
+    session = ag.all.http_client.session
+    adapter = session.get_adapter('https://api.example.org/')
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        remounted = session.get_adapter('https://api.example.org/')
+        ok = remounted is not adapter and \
+            session.bacanora_pid == os.getpid()
+        os.write(write, b'1' if ok else b'0')
+        os._exit(0)
+    os.close(write)
+    assert os.read(read, 1) == b'1'
+    os.close(read)
+    os.waitpid(pid, 0)
+    assert session.get_adapter('https://api.example.org/') is adapter
@@ -0,0 +1,116 @@
+import json
+import os
+import pytest
+
+from .. import bacanora
+from .. import bulk
+from .. import direct
+from .. import runtimes
+from .. import storagesystems
+
+
+@pytest.fixture
+def posix_system(tmpdir, monkeypatch):
+    registry = storagesystems.StorageSystemRegistry()
+    registry.register('bacanora-test', runtimes.current(), str(tmpdir))
+    monkeypatch.setattr(storagesystems, 'registry', registry)
+    return tmpdir
+
+
+def test_registry_sources(tmpdir):
+    config_file = tmpdir.join('systems.json')
+    config_file.write(json.dumps({'data-projects': {'HPC': '/work/projects',
+                                                    'abaco': '/corral'}}))
+    registry = storagesystems.StorageSystemRegistry(
+        config_file=str(config_file),
+        config=json.dumps({'data-projects': {'abaco': '$HOME/projects'}}))
+    assert registry.resolve('data-projects', 'hpc') == '/work/projects'
+    assert registry.resolve('data-projects', 'abaco') == os.path.join(
+        os.environ['HOME'], 'projects')
+    assert registry.resolve('data-projects', 'jupyter') is None
+    assert registry.resolve('data-sd2e-community', 'hpc') is not None
+
+
+def test_direct_operations_honor_system(posix_system, tmpdir):
+    src = tmpdir.mkdir('local').join('input.txt')
+    src.write('bacanora')
+    posix_system.mkdir('dest')
+    direct.put(str(src), '/dest', system_id='bacanora-test')
+    assert direct.isfile('/dest/input.txt', system_id='bacanora-test')
+    with pytest.raises(direct.UnknownStorageSystem):
+        direct.stat('/dest/input.txt', system_id='bacanora-missing')
+    target = str(tmpdir.join('local', 'output.txt'))
+    direct.get('/dest/input.txt', target, system_id='bacanora-test')
+    with open(target) as f:
+        assert f.read() == 'bacanora'
+
+
+class ApiFiles(object):
+    def __init__(self):
+        self.calls = []
+
+    def list(self, **kwargs):
+        self.calls.append(('list', kwargs['filePath']))
+        return [{'name': '.', 'format': 'folder', 'type': 'dir'}]
+
+    def delete(self, **kwargs):
+        self.calls.append(('delete', kwargs['filePath']))
+
+
+class ApiClient(object):
+    def __init__(self):
+        self.files = ApiFiles()
+
+
+def test_mount_health_is_cached(posix_system, monkeypatch):
+    probes = []
+    probe = direct._probe
+    monkeypatch.setattr(direct, '_probe',
+                        lambda prefix: probes.append(prefix) or probe(prefix))
+    # An empty prefix looks like an unmounted mountpoint
+    with pytest.raises(direct.MountUnavailable):
+        direct.stat('/anything', system_id='bacanora-test')
+    posix_system.join('present.txt').write('x')
+    with pytest.raises(direct.MountUnavailable):
+        direct.abs_path('/present.txt', system_id='bacanora-test')
+    assert len(probes) == 1
+    direct.forget_health('bacanora-test')
+    assert direct.isfile('/present.txt', system_id='bacanora-test')
+    assert direct.exists('/present.txt', system_id='bacanora-test')
+    assert len(probes) == 2
+
+
+def test_unhealthy_mount_uses_api(posix_system, monkeypatch):
+    direct.forget_health()
+
+    def skipped(*args, **kwargs):
+        raise AssertionError('direct path used on an unhealthy mount')
+    monkeypatch.setattr(direct, 'stat', skipped)
+    client = ApiClient()
+    assert bacanora.exists(client, '/anything', system_id='bacanora-test')
+    assert client.files.calls == [('list', '/anything')]
+
+
+def test_authoritative_negatives(posix_system, monkeypatch):
+    monkeypatch.setattr(direct, 'DIRECT_AUTHORITATIVE', True)
+    posix_system.join('present.txt').write('x')
+    client = ApiClient()
+    assert not bacanora.exists(client, '/missing.txt',
+                               system_id='bacanora-test')
+    assert bacanora.isfile(client, '/present.txt', system_id='bacanora-test')
+    report = bulk.delete_many(client, ['/missing.txt'],
+                              system_id='bacanora-test')
+    assert report.results[0].result is False
+    assert client.files.calls == []
+
+    monkeypatch.setattr(direct, 'DIRECT_AUTHORITATIVE', False)
+    assert bacanora.exists(client, '/missing.txt', system_id='bacanora-test')
+    assert client.files.calls == [('list', '/missing.txt')]
+
+
+def test_direct_prefixes_view(posix_system):
+    prefixes = direct.StorageSystems.prefixes
+    assert prefixes['bacanora-test'][str(runtimes.current()).lower()] == \
+        str(posix_system)
+    with pytest.raises(TypeError):
+        prefixes['bacanora-test']['hpc'] = '/elsewhere'
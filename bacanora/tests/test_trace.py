@@ -0,0 +1,125 @@
+import json
+import time
+
+from .. import bacanora
+from .. import metrics
+from .. import trace
+from ..agaveutils import reactors
+from .test_storagesystems import posix_system, ApiClient
+
+SYSTEM = 'bacanora-test'
+
+
+def test_trace_records(posix_system, tmpdir):
+    posix_system.join('present.txt').write('x')
+    filename = str(tmpdir.join('trace.jsonl'))
+    tracer = trace.start(filename, flush_interval=0.05)
+    try:
+        client = ApiClient()
+        assert bacanora.exists(client, '/present.txt', system_id=SYSTEM)
+        assert bacanora.isdir(client, '/missing', system_id=SYSTEM)
+    finally:
+        trace.stop()
+    assert tracer.written == 2 and tracer.dropped == 0
+    records = trace.load(filename)
+    assert [(r['operation'], r['path'], r['route'], r['outcome'])
+            for r in records] == [('exists', '/present.txt', 'direct', 'ok'),
+                                  ('isdir', '/missing', 'api', 'ok')]
+    assert records[0]['system'] == SYSTEM
+    assert records[0]['start'] <= records[0]['end']
+    # Calls made after stop() are not traced
+    bacanora.exists(client, '/present.txt', system_id=SYSTEM)
+    assert len(trace.load(filename)) == 2
+
+
+class Actors(object):
+    def sendMessage(self, **kwargs):
+        return {'executionId': 'exec-1'}
+
+
+class ActorClient(object):
+    actors = Actors()
+
+
+def test_path_found_by_name(posix_system):
+    posix_system.join('present.txt').write('x')
+    records = []
+    metrics.add_sink(records.append)
+    try:
+        bacanora.exists(ApiClient(), path_to_test='/present.txt',
+                        system_id=SYSTEM)
+        reactors.send_message(ActorClient(), 'actor-1', 'hi')
+    finally:
+        metrics.remove_sink(records.append)
+    assert [(r['operation'], r['path']) for r in records] == \
+        [('exists', '/present.txt'), ('send_message', None)]
+
+
+def test_flushes_under_steady_load(tmpdir):
+    filename = str(tmpdir.join('t.jsonl'))
+    tracer = trace.Tracer(filename, flush_interval=0.05)
+    try:
+        deadline = time.monotonic() + 2
+        # Records keep arriving faster than the flush interval
+        while time.monotonic() < deadline and not trace.load(filename):
+            tracer.record({'operation': 'exists'})
+            time.sleep(0.005)
+        assert trace.load(filename)
+    finally:
+        tracer.close()
+
+
+def test_full_queue_drops(tmpdir):
+    tracer = trace.Tracer(str(tmpdir.join('t.jsonl')), queue_size=1)
+    tracer.queue.put(trace._STOP)
+    tracer._thread.join()
+    tracer.record({'operation': 'exists'})
+    tracer.record({'operation': 'exists'})
+    assert tracer.dropped == 1
+    tracer.close()
+
+
+def records():
+    base = {'system': 'data-sd2e-community', 'outcome': 'ok', 'error': None,
+            'bytes': 0, 'retries': [], 'start': 100.0}
+    rows = [
+        dict(base, operation='download', path='/a', route='api',
+             elapsed=4.0, bytes=8000000,
+             retries=[{'attempt': 1, 'wait': 2.0, 'error': 'AgaveError'}]),
+        dict(base, operation='download', path='/b', route='direct',
+             elapsed=1.0, bytes=1000000),
+        dict(base, operation='exists', path='/c', route='direct',
+             elapsed=0.01),
+        dict(base, operation='exists', path='/d', route='api', elapsed=0.2,
+             outcome='error', error='CircuitOpen'),
+    ]
+    for row in rows:
+        row['end'] = row['start'] + row['elapsed']
+    return rows
+
+
+def test_summarize():
+    summary = trace.summarize(records(), top=2)
+    assert summary['calls'] == 4 and summary['span'] == 4.0
+    assert [r['path'] for r in summary['slowest']] == ['/a', '/b']
+    download = summary['operations']['download']
+    assert download['attempts'] == 3
+    assert download['retry_amplification'] == 1.5
+    assert download['direct_hit_rate'] == 0.5
+    assert download['throughput'][50] == 1000000.0
+    assert download['throughput'][99] == 2000000.0
+    exists = summary['operations']['exists']
+    assert exists['errors'] == 1 and exists['latency'][50] == 0.01
+
+
+def test_main(tmpdir, capsys):
+    filename = tmpdir.join('trace.jsonl')
+    filename.write('\n'.join(json.dumps(r) for r in records()) +
+                   '\n{"truncated')
+    assert trace.main([str(filename), '--top', '1']) == 0
+    out = capsys.readouterr().out
+    assert out.startswith('4 calls over 4.0s')
+    assert 'download' in out and '(CircuitOpen)' not in out
+    assert '/a via api ok after 1 retries' in out
+    assert trace.main([str(filename), '--json']) == 0
+    assert json.loads(capsys.readouterr().out)['calls'] == 4
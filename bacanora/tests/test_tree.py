@@ -0,0 +1,154 @@
+import errno
+import os
+
+import pytest
+
+from .. import bacanora
+from .. import listing
+from .. import tree
+from .fixtures.media import media_server, MediaClient
+from .test_filecache import FakeAgave
+from .test_storagesystems import posix_system
+
+SYSTEM = 'bacanora-test'
+
+
+def populate(files):
+    files['/exp/a.txt'] = b'a' * 10
+    files['/exp/raw/b.bin'] = os.urandom(5000)
+    files['/exp/raw/deep/c.bin'] = os.urandom(300)
+    files['/other/d.txt'] = b'd'
+
+
+def test_download_tree_api(media_server, tmpdir):
+    populate(media_server.files)
+    client = MediaClient(media_server)
+    dest = tmpdir.join('mirror')
+    report = tree.download_tree(client, '/exp', str(dest), system_id=SYSTEM,
+                                max_workers=3)
+    assert len(report.succeeded) == 3 and not report.failed
+    assert dest.join('raw', 'deep', 'c.bin').read_binary() == \
+        media_server.files['/exp/raw/deep/c.bin']
+    assert not dest.join('d.txt').exists()
+    assert sorted(media_server.listings) == ['/exp', '/exp/raw',
+                                             '/exp/raw/deep']
+
+    # A re-run only lists, unless a remote file changed
+    media_server.files['/exp/a.txt'] = b'a' * 11
+    fetched = len(media_server.requests)
+    report = tree.download_tree(client, '/exp', str(dest), system_id=SYSTEM)
+    assert [r.source for r in report.results] == ['/exp/a.txt']
+    assert len(report.skipped) == 2
+    assert len(media_server.requests) == fetched + 1
+    assert dest.join('a.txt').read_binary() == b'a' * 11
+
+
+def test_download_renames_within_destination(tmpdir, monkeypatch):
+    monkeypatch.setattr(bacanora, 'PWD', str(tmpdir.mkdir('work')))
+    rename = os.rename
+
+    def same_device_only(src, dst):
+        # As if the working directory were on another filesystem
+        if os.path.dirname(src) != os.path.dirname(dst):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        rename(src, dst)
+    monkeypatch.setattr(os, 'rename', same_device_only)
+    dest = tmpdir.mkdir('mirror').join('ref.csv')
+    bacanora.download(FakeAgave(b'plate,map\n'), '/reference/ref.csv',
+                      str(dest), system_id=SYSTEM)
+    assert dest.read_binary() == b'plate,map\n'
+    assert tmpdir.join('work').listdir() == []
+
+
+def test_download_tree_direct(posix_system, tmpdir):
+    remote = posix_system.mkdir('exp')
+    remote.join('a.txt').write('hello')
+    remote.mkdir('empty')
+    remote.mkdir('sub').join('b.txt').write('world')
+    dest = tmpdir.join('mirror')
+    report = tree.download_tree(None, '/exp', str(dest), system_id=SYSTEM)
+    assert len(report.succeeded) == 2
+    assert dest.join('sub', 'b.txt').read() == 'world'
+    assert dest.join('empty').isdir()
+    assert dest.join('a.txt').mtime() == remote.join('a.txt').mtime()
+    report = tree.download_tree(None, '/exp', str(dest), system_id=SYSTEM)
+    assert len(report) == 0 and len(report.skipped) == 2
+
+
+def test_download_tree_missing(media_server, tmpdir):
+    with pytest.raises(FileNotFoundError):
+        tree.download_tree(MediaClient(media_server), '/nope', str(tmpdir),
+                           system_id=SYSTEM)
+
+
+def make_local(root):
+    root.join('a.txt').write('aaaa')
+    root.mkdir('x').mkdir('y').join('b.txt').write('bb')
+    root.join('x').mkdir('empty')
+    root.mkdir('z').join('c.txt').write('c')
+    return root
+
+
+def test_upload_tree_api(media_server, tmpdir):
+    local = make_local(tmpdir.mkdir('results'))
+    media_server.files['/dest/z/c.txt'] = b'c'
+    # Older than the remote copy's lastModified
+    local.join('z', 'c.txt').setmtime(1000000000)
+    client = MediaClient(media_server)
+    plan = tree.upload_tree(client, str(local), '/dest', system_id=SYSTEM,
+                            dry_run=True)
+    assert plan.mkdirs == ['/dest/x/empty', '/dest/x/y']
+    assert sorted(dest for _, dest in plan.uploads) == ['/dest', '/dest/x/y']
+    assert plan.skipped == [str(local.join('z', 'c.txt'))]
+    assert media_server.calls == []
+
+    report = tree.upload_tree(client, str(local), '/dest', system_id=SYSTEM)
+    assert len(report.succeeded) == 2 and len(report.skipped) == 1
+    assert sorted(c[3]['path'] for c in media_server.calls) == \
+        ['/dest/x/empty', '/dest/x/y']
+    assert media_server.files['/dest/x/y/b.txt'] == b'bb'
+
+    plan = tree.upload_tree(client, str(local), '/dest', system_id=SYSTEM,
+                            dry_run=True)
+    assert not plan.mkdirs and not plan.uploads and len(plan.skipped) == 3
+
+
+def test_upload_plan_survives_vanished_subdirectory(media_server, tmpdir,
+                                                     monkeypatch):
+    local = make_local(tmpdir.mkdir('results'))
+    for path in ('a.txt', 'x/y/b.txt', 'z/c.txt'):
+        local.join(path).setmtime(1000000000)
+        media_server.files['/dest/' + path] = local.join(path).read_binary()
+    client = MediaClient(media_server)
+    scandir = listing.scandir
+    failure = FileNotFoundError('No such directory: /dest/x')
+
+    def vanishing(agave_client, path, **kwargs):
+        if path == '/dest/x':
+            raise failure
+        return scandir(agave_client, path, **kwargs)
+    monkeypatch.setattr(listing, 'scandir', vanishing)
+    plan = tree.upload_tree(client, str(local), '/dest', system_id=SYSTEM,
+                            dry_run=True)
+    # Only the vanished subtree is planned again
+    assert plan.mkdirs == ['/dest/x/empty', '/dest/x/y']
+    assert plan.uploads == [(str(local.join('x', 'y', 'b.txt')), '/dest/x/y')]
+    assert sorted(plan.skipped) == [str(local.join('a.txt')),
+                                    str(local.join('z', 'c.txt'))]
+
+    failure = PermissionError('Permission denied: /dest/x')
+    with pytest.raises(PermissionError):
+        tree.upload_tree(client, str(local), '/dest', system_id=SYSTEM,
+                         dry_run=True)
+
+
+def test_upload_tree_direct(posix_system, media_server, tmpdir):
+    local = make_local(tmpdir.mkdir('results'))
+    report = tree.upload_tree(MediaClient(media_server), str(local), '/dest',
+                              system_id=SYSTEM)
+    assert len(report.succeeded) == 3
+    assert posix_system.join('dest', 'x', 'y', 'b.txt').read() == 'bb'
+    assert posix_system.join('dest', 'x', 'empty').isdir()
+    report = tree.upload_tree(MediaClient(media_server), str(local), '/dest',
+                              system_id=SYSTEM)
+    assert len(report) == 0 and len(report.skipped) == 3
@@ -0,0 +1,258 @@
+"""
+Per-call JSON lines trace of bacanora operations
+
+When ``BACANORA_TRACE_FILE`` is set, or after ``start()``, every
+instrumented operation appends one JSON object to the trace file. It
+records the start and end times, operation, file ``path``, storage
+system, ``route`` taken (``direct``, ``api``, ``cache`` or ``none``),
+outcome and exception type, bytes moved, and each retried attempt with
+the wait that followed it. Records are queued by the calling thread and
+written by a background thread, which flushes every
+``BACANORA_TRACE_FLUSH_INTERVAL`` seconds. If the queue fills up,
+records are dropped rather than blocking the caller.
+
+``bacanora-trace FILE`` summarizes a trace: the slowest calls, retry
+amplification, direct-path hit rate, and latency and throughput
+percentiles per operation.
+"""
+import argparse
+import atexit
+import json
+import math
+import os
+import queue
+import sys
+import threading
+import time
+
+from . import logger as loggermodule
+from . import metrics
+from . import settings
+
+logger = loggermodule.get_logger(__name__)
+
+__all__ = ['Tracer', 'start', 'stop', 'load', 'summarize', 'format_summary',
+           'main']
+
+TRACE_FLUSH_INTERVAL = settings.TRACE_FLUSH_INTERVAL
+TRACE_QUEUE_SIZE = settings.TRACE_QUEUE_SIZE
+
+_STOP = object()
+
+
+class Tracer(object):
+    """Buffered writer of operation records to a JSON lines file
+
+    Arguments:
+        filename (str): File to append records to
+        flush_interval (float, optional): Seconds between flushes [BACANORA_TRACE_FLUSH_INTERVAL]
+        queue_size (int, optional): Records held before new ones are dropped [BACANORA_TRACE_QUEUE_SIZE]
+    """
+
+    def __init__(self, filename, flush_interval=None, queue_size=None):
+        self.filename = filename
+        self.flush_interval = TRACE_FLUSH_INTERVAL if flush_interval is None \
+            else flush_interval
+        self.queue = queue.Queue(
+            TRACE_QUEUE_SIZE if queue_size is None else queue_size)
+        self.dropped = 0
+        self.written = 0
+        self._file = open(filename, 'a', buffering=1024 * 1024)
+        self._thread = threading.Thread(target=self._run,
+                                        name='bacanora-trace', daemon=True)
+        self._thread.start()
+
+    def record(self, record):
+        """Queue one record; never blocks"""
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        flushed = time.monotonic()
+        while True:
+            # Flush on schedule even while records keep arriving
+            wait = flushed + self.flush_interval - time.monotonic()
+            try:
+                item = self.queue.get(timeout=max(0, wait))
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                break
+            if item is not None:
+                try:
+                    self._file.write(json.dumps(item, default=str) + '\n')
+                    self.written += 1
+                except Exception as exc:
+                    logger.debug('failed to trace {}: {}'.format(item, exc))
+            if time.monotonic() - flushed >= self.flush_interval:
+                self._file.flush()
+                flushed = time.monotonic()
+        self._file.flush()
+
+    def close(self):
+        """Write out everything queued so far and close the file"""
+        if self._thread.is_alive():
+            self.queue.put(_STOP)
+            self._thread.join()
+        self._file.close()
+        if self.dropped:
+            logger.warning('{} trace records dropped'.format(self.dropped))
+
+
+_tracer = None
+
+
+def start(filename=None, flush_interval=None, queue_size=None):
+    """Begin tracing operations to a file, replacing any active tracer
+
+    Arguments:
+        filename (str, optional): JSON lines file to append to [BACANORA_TRACE_FILE]
+
+    Returns:
+        Tracer: The active tracer
+    """
+    global _tracer
+    stop()
+    _tracer = Tracer(filename or settings.TRACE_FILE,
+                     flush_interval=flush_interval, queue_size=queue_size)
+    metrics.add_sink(_tracer.record)
+    return _tracer
+
+
+def stop():
+    """Stop tracing and flush the trace file"""
+    global _tracer
+    if _tracer is not None:
+        metrics.remove_sink(_tracer.record)
+        _tracer.close()
+        _tracer = None
+
+
+atexit.register(stop)
+
+
+def load(filename):
+    """Records from a trace file, skipping any partial or corrupt lines"""
+    records = []
+    with open(filename, 'r') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def _percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return None
+    rank = int(math.ceil(fraction * len(values))) - 1
+    return values[max(0, min(len(values) - 1, rank))]
+
+
+def summarize(records, top=10):
+    """Aggregate statistics for a list of trace records
+
+    Returns:
+        dict: ``calls``, ``span``, ``slowest``, plus per-operation
+        ``operations`` entries with calls, errors, attempts, retry
+        amplification, direct hit rate, latency and throughput percentiles
+    """
+    by_operation = {}
+    for record in records:
+        by_operation.setdefault(record.get('operation'), []).append(record)
+    operations = {}
+    for name, group in sorted(by_operation.items(), key=lambda i: str(i[0])):
+        attempts = sum(1 + len(r.get('retries') or []) for r in group)
+        routes = {}
+        for r in group:
+            routes[r.get('route')] = routes.get(r.get('route'), 0) + 1
+        latencies = sorted(r.get('elapsed') or 0.0 for r in group)
+        rates = sorted(r['bytes'] / r['elapsed'] for r in group
+                       if r.get('bytes') and r.get('elapsed'))
+        operations[name] = {
+            'calls': len(group),
+            'errors': sum(1 for r in group if r.get('outcome') != 'ok'),
+            'attempts': attempts,
+            'retry_amplification': attempts / len(group),
+            'routes': routes,
+            'direct_hit_rate': routes.get(metrics.DIRECT, 0) / len(group),
+            'bytes': sum(r.get('bytes') or 0 for r in group),
+            'latency': {p: _percentile(latencies, p / 100.0)
+                        for p in (50, 90, 99)},
+            'throughput': {p: _percentile(rates, p / 100.0)
+                           for p in (50, 90, 99)}}
+    starts = [r['start'] for r in records if r.get('start') is not None]
+    ends = [r['end'] for r in records if r.get('end') is not None]
+    return {'calls': len(records),
+            'span': max(ends) - min(starts) if starts and ends else 0.0,
+            'slowest': sorted(records, key=lambda r: r.get('elapsed') or 0.0,
+                              reverse=True)[:top],
+            'operations': operations}
+
+
+def _seconds(value):
+    return '-' if value is None else '{:.3f}s'.format(value)
+
+
+def _rate(value):
+    return '-' if value is None else '{:.1f}MB/s'.format(value / 1e6)
+
+
+def format_summary(summary):
+    """Render ``summarize()`` output as plain text"""
+    lines = ['{} calls over {:.1f}s'.format(summary['calls'],
+                                            summary['span']), '']
+    lines.append('{:<16} {:>6} {:>6} {:>7} {:>7} {:>9} {:>9} {:>9} {:>12}'
+                 .format('operation', 'calls', 'errors', 'retryx', 'direct',
+                         'p50', 'p90', 'p99', 'p50 rate'))
+    for name, op in summary['operations'].items():
+        lines.append(
+            '{:<16} {:>6} {:>6} {:>7.2f} {:>6.0f}% {:>9} {:>9} {:>9} {:>12}'
+            .format(str(name), op['calls'], op['errors'],
+                    op['retry_amplification'], 100 * op['direct_hit_rate'],
+                    _seconds(op['latency'][50]), _seconds(op['latency'][90]),
+                    _seconds(op['latency'][99]),
+                    _rate(op['throughput'][50])))
+    lines.extend(['', 'slowest calls:'])
+    for r in summary['slowest']:
+        retries = r.get('retries') or []
+        lines.append('  {:>9} {} {} {} via {} {}{}'.format(
+            _seconds(r.get('elapsed')), r.get('operation'),
+            r.get('system') or '', r.get('path') or '', r.get('route'),
+            r.get('outcome'),
+            ' ({})'.format(r['error']) if r.get('error') else '') +
+            (' after {} retries'.format(len(retries)) if retries else ''))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    """Entry point for the ``bacanora-trace`` command"""
+    parser = argparse.ArgumentParser(
+        prog='bacanora-trace',
+        description='Summarize a bacanora JSON lines trace')
+    parser.add_argument('trace', nargs='+', help='Trace file(s)')
+    parser.add_argument('--top', type=int, default=10,
+                        help='Number of slowest calls to list [10]')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the summary as JSON')
+    args = parser.parse_args(argv)
+    records = []
+    for filename in args.trace:
+        if not os.path.exists(filename):
+            parser.error('No such file: {}'.format(filename))
+        records.extend(load(filename))
+    summary = summarize(records, top=args.top)
+    if args.json:
+        json.dump(summary, sys.stdout, indent=2, default=str)
+        sys.stdout.write('\n')
+    else:
+        print(format_summary(summary))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
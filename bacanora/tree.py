@@ -0,0 +1,269 @@
+"""
+Recursive, incremental transfers of whole directory trees
+"""
+import os
+import posixpath
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import bulk
+from . import listing
+from . import logger as loggermodule
+from . import metadata
+from . import settings
+from .bacanora import DEFAULT_STORAGE_SYSTEM
+from .metadata import StatResult
+
+logger = loggermodule.get_logger(__name__)
+
+__all__ = ['download_tree', 'upload_tree', 'walk_tree', 'TreePlan']
+
+MAX_WORKERS = settings.MAX_WORKERS
+# Agave reports modification times to the second
+MTIME_TOLERANCE = 1.0
+
+
+class TreePlan(object):
+    """Remote directories to create and files to upload for ``upload_tree()``
+
+    ``mkdirs`` holds only the deepest missing directories, since each
+    mkdir also creates any missing parents. ``uploads`` holds
+    ``(local_path, remote_dir)`` pairs and ``skipped`` the local paths
+    that are already up to date.
+    """
+    __slots__ = ('mkdirs', 'uploads', 'skipped')
+
+    def __init__(self, mkdirs=None, uploads=None, skipped=None):
+        self.mkdirs = list(mkdirs or [])
+        self.uploads = list(uploads or [])
+        self.skipped = list(skipped or [])
+
+    def __repr__(self):
+        return '<TreePlan mkdirs={} uploads={} skipped={}>'.format(
+            len(self.mkdirs), len(self.uploads), len(self.skipped))
+
+
+def _raise(exc):
+    raise exc
+
+
+def walk_tree(agave_client, remote_dir, system_id=DEFAULT_STORAGE_SYSTEM,
+              max_workers=None):
+    """List every file and directory below a remote directory
+
+    Directories are listed concurrently by ``listing.walk_entries()``,
+    which scans the storage system's mount when the direct path is
+    available.
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        remote_dir (str): Agave-absolute path of the directory
+        system_id (str, optional): Storage system where files are located [data-sd2e-community]
+        max_workers (int, optional): Concurrent listing calls [BACANORA_MAX_WORKERS]
+
+    Raises:
+        FileNotFoundError: The directory does not exist
+
+    Returns:
+        list: ``StatResult`` records, parents listed before their children
+    """
+    records = []
+    for _, dirs, files in listing.walk_entries(
+            agave_client, remote_dir, system_id=system_id,
+            order=listing.COMPLETED, max_workers=max_workers,
+            onerror=_raise):
+        records.extend(entry.stat() for entry in dirs + files)
+    return records
+
+
+def _unchanged(local_path, record):
+    """Whether a local file already matches a remote file's size and mtime"""
+    if record.mtime is None:
+        return False
+    try:
+        st = os.stat(local_path)
+    except OSError:
+        return False
+    return st.st_size == record.size and \
+        abs(st.st_mtime - record.mtime) < MTIME_TOLERANCE
+
+
+def download_tree(agave_client, remote_dir, local_dir,
+                  system_id=DEFAULT_STORAGE_SYSTEM, max_workers=None):
+    """Mirror a remote directory tree into a local directory
+
+    Files whose local copy has the same size and modification time as the
+    remote file are skipped, so repeating a mirror costs little more than
+    the listing. Downloaded files are given the remote modification time.
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        remote_dir (str): Agave-absolute path of the directory to mirror
+        local_dir (str): Local directory to mirror into; created if needed
+        system_id (str, optional): Storage system where files are located [data-sd2e-community]
+        max_workers (int, optional): Concurrent listings and downloads [BACANORA_MAX_WORKERS]
+
+    Raises:
+        FileNotFoundError: The remote directory does not exist
+
+    Returns:
+        TransferReport: Per-file results for transferred files, plus ``skipped`` records
+    """
+    logger.info('bacanora.download_tree()')
+    start = time.time()
+    remote_dir = '/' + remote_dir.strip('/')
+    local_dir = os.path.abspath(local_dir)
+    records = walk_tree(agave_client, remote_dir, system_id=system_id,
+                        max_workers=max_workers)
+    os.makedirs(local_dir, exist_ok=True)
+    wanted = {}
+    skipped = []
+    for record in records:
+        relative = posixpath.relpath(record.path, remote_dir)
+        local_path = os.path.join(local_dir, *relative.split('/'))
+        if record.is_dir():
+            os.makedirs(local_path, exist_ok=True)
+        elif record.is_file():
+            if _unchanged(local_path, record):
+                skipped.append(record)
+            else:
+                wanted[record.path] = (record, local_path)
+    logger.debug('{} files to fetch, {} unchanged'.format(
+        len(wanted), len(skipped)))
+
+    report = bulk.download_many(
+        agave_client, [(path, local) for path, (_, local) in wanted.items()],
+        system_id=system_id, max_workers=max_workers)
+    for result in report.succeeded:
+        record = wanted[result.source][0]
+        if record.mtime is not None:
+            os.utime(result.destination, (record.mtime, record.mtime))
+    report = bulk.TransferReport(report.results, time.time() - start,
+                                 skipped=skipped)
+    logger.info('mirrored {}: {} fetched, {} unchanged, {} failed'.format(
+        remote_dir, len(report.succeeded), len(skipped), len(report.failed)))
+    return report
+
+
+def _remote_tree(agave_client, remote_dir, system_id, max_workers):
+    """Records below ``remote_dir`` keyed by path, or {} if it does not exist
+
+    A subdirectory that disappears during the walk is left out, so only
+    that subtree is treated as missing. Other listing errors propagate.
+    """
+    vanished = []
+
+    def _onerror(exc):
+        if not isinstance(exc, FileNotFoundError):
+            raise exc
+        vanished.append(exc)
+
+    remote = {}
+    listed = set()
+    for path, dirs, files in listing.walk_entries(
+            agave_client, remote_dir, system_id=system_id,
+            order=listing.COMPLETED, max_workers=max_workers,
+            onerror=_onerror):
+        listed.add(path)
+        for entry in dirs + files:
+            remote[entry.path] = entry
+    if not listed:
+        # The walk starts at remote_dir, so it was the listing that failed
+        return {}
+    records = {path: entry.stat() for path, entry in remote.items()
+               if path in listed or not entry.is_dir() or
+               entry.is_symlink()}
+    records[remote_dir] = StatResult(remote_dir, system_id, metadata.DIR)
+    if vanished:
+        logger.debug('{} directories vanished while listing {}'.format(
+            len(vanished), remote_dir))
+    return records
+
+
+def _plan_upload(agave_client, local_dir, remote_dir, system_id, max_workers):
+    remote = _remote_tree(agave_client, remote_dir, system_id, max_workers)
+    plan = TreePlan()
+    missing = set()
+    for parent, dirnames, filenames in os.walk(local_dir):
+        relative = os.path.relpath(parent, local_dir)
+        remote_parent = remote_dir if relative == os.curdir else \
+            posixpath.join(remote_dir, *relative.split(os.sep))
+        if remote_parent not in remote:
+            missing.add(remote_parent)
+        for name in sorted(filenames):
+            local_path = os.path.join(parent, name)
+            try:
+                st = os.stat(local_path)
+            except OSError:
+                continue
+            record = remote.get(posixpath.join(remote_parent, name))
+            # Remote mtimes record the upload, so only a newer local file counts
+            if record is not None and record.size == st.st_size and \
+                    record.mtime is not None and \
+                    st.st_mtime < record.mtime + MTIME_TOLERANCE:
+                plan.skipped.append(local_path)
+            else:
+                plan.uploads.append((local_path, remote_parent))
+    plan.mkdirs = bulk._leaves(missing)
+    return plan
+
+
+def upload_tree(agave_client, local_dir, remote_dir,
+                system_id=DEFAULT_STORAGE_SYSTEM, autogrant=False,
+                dry_run=False, max_workers=None):
+    """Sync a local directory tree to a remote directory
+
+    One recursive listing of the remote tree decides which directories
+    are missing and which files are new or changed. The deepest missing
+    directories are created concurrently, then the new and changed files
+    are uploaded with ``upload_many()``.
+
+    Arguments:
+        agave_client (Agave): An active Agave client
+        local_dir (str): Local directory to upload
+        remote_dir (str): Agave-absolute path to sync into; created if needed
+        system_id (str, optional): Storage system for the uploads [data-sd2e-community]
+        autogrant (bool, optional): Grant world read on each uploaded file [False]
+        dry_run (bool, optional): Only report the planned actions [False]
+        max_workers (int, optional): Concurrent listings, mkdirs and uploads [BACANORA_MAX_WORKERS]
+
+    Raises:
+        NotADirectoryError: ``local_dir`` is not a directory
+
+    Returns:
+        TransferReport: Per-file upload results plus ``skipped`` local paths,
+        or the ``TreePlan`` when ``dry_run`` is set
+    """
+    logger.info('bacanora.upload_tree()')
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+    start = time.time()
+    if not os.path.isdir(local_dir):
+        raise NotADirectoryError('No such directory: {}'.format(local_dir))
+    local_dir = os.path.abspath(local_dir)
+    remote_dir = '/' + remote_dir.strip('/')
+    plan = _plan_upload(agave_client, local_dir, remote_dir, system_id,
+                        max_workers)
+    logger.debug('{!r} for {}'.format(plan, local_dir))
+    if dry_run:
+        return plan
+
+    if plan.mkdirs:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            futures = {pool.submit(bulk._mkdir, agave_client, path,
+                                   system_id): path
+                       for path in plan.mkdirs}
+            for future, path in futures.items():
+                try:
+                    future.result()
+                except Exception as exc:
+                    # Uploads into this directory fail and are reported
+                    logger.warning('mkdir of {} failed: {}'.format(path, exc))
+    report = bulk.upload_many(agave_client, plan.uploads, system_id=system_id,
+                              autogrant=autogrant, max_workers=max_workers)
+    report = bulk.TransferReport(report.results, time.time() - start,
+                                 skipped=plan.skipped)
+    logger.info('synced {}: {} uploaded, {} unchanged, {} failed'.format(
+        local_dir, len(report.succeeded), len(report.skipped),
+        len(report.failed)))
+    return report
@@ -0,0 +1,102 @@
+"""
+Compare pooled, adaptive response reads against fixed-size iter_content
+
+Usage: python benchmarks/bench_buffers.py [--sizes 64M,512M] [--block 4096]
+
+Serves an in-memory file from a local HTTP server and downloads it into a
+temporary file with each strategy. CPU time is measured for the
+downloading thread only, so the server's share is excluded.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import requests
+
+from bacanora import buffers
+
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    if text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    payload = b''
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        payload = self.server.payload
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        view = memoryview(payload)
+        for pos in range(0, len(view), 1024 * 1024):
+            self.wfile.write(view[pos:pos + 1024 * 1024])
+
+
+def fixed(rsp, f, block):
+    for chunk in rsp.iter_content(block):
+        f.write(chunk)
+
+
+def pooled(rsp, f, block):
+    for chunk in buffers.iter_response(rsp, block):
+        f.write(chunk)
+
+
+def timed(func, url, block, directory, repeat):
+    best_wall, best_cpu = None, None
+    for _ in range(repeat):
+        with tempfile.TemporaryFile(dir=directory) as f:
+            wall, cpu = time.perf_counter(), time.thread_time()
+            with requests.get(url, stream=True) as rsp:
+                func(rsp, f, block)
+            wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+        best_wall = wall if best_wall is None else min(best_wall, wall)
+        best_cpu = cpu if best_cpu is None else min(best_cpu, cpu)
+    return best_wall, best_cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='64M,512M')
+    parser.add_argument('--block', type=int, default=4096,
+                        help='Fixed block size, and initial adaptive size')
+    parser.add_argument('--dir', default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    server = Server(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://{}:{}/'.format(*server.server_address)
+    print('{:>10} {:>16} {:>10} {:>12}'.format('size', 'method', 'MB/s', 'cpu s/GB'))
+    try:
+        for text in args.sizes.split(','):
+            size = parse_size(text)
+            server.payload = os.urandom(size)
+            for name, func in (('iter_content', fixed), ('pooled', pooled)):
+                wall, cpu = timed(func, url, args.block, args.dir, args.repeat)
+                print('{:>10} {:>16} {:>10.1f} {:>12.3f}'.format(
+                    text, name, size / wall / 1e6, cpu * UNITS['G'] / size))
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Compare bacanora.copyfile against shutil.copy for direct-path transfers
+
+Usage: python benchmarks/bench_copy.py [--sizes 16M,256M,1G] [--dir /scratch/path]
+
+Point --dir at the filesystem of interest (e.g. a Lustre mount) since
+results depend heavily on whether the kernel can copy in place.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from bacanora import copyfile
+
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    if text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+def make_source(path, size, sparse=False):
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        written = 0
+        while written < size:
+            count = min(len(block), size - written)
+            if sparse and (written // len(block)) % 2:
+                f.seek(count, os.SEEK_CUR)
+            else:
+                f.write(block[:count])
+            written += count
+        f.truncate(size)
+
+
+def timed(func, src, dst, repeat):
+    best_wall, best_cpu = None, None
+    for _ in range(repeat):
+        if os.path.exists(dst):
+            os.unlink(dst)
+        wall, cpu = time.perf_counter(), time.process_time()
+        func(src, dst)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        best_wall = wall if best_wall is None else min(best_wall, wall)
+        best_cpu = cpu if best_cpu is None else min(best_cpu, cpu)
+    return best_wall, best_cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='16M,256M,1G')
+    parser.add_argument('--dir', default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--sparse', action='store_true',
+                        help='Use half-hole source files')
+    args = parser.parse_args()
+
+    candidates = [('shutil.copy', shutil.copy)]
+    for method in (copyfile.COPY_FILE_RANGE, copyfile.SENDFILE, copyfile.BUFFERED):
+        if method == copyfile.BUFFERED or hasattr(os, method):
+            candidates.append(
+                (method, lambda s, d, m=method: copyfile.copy(s, d, methods=[m])))
+
+    workdir = tempfile.mkdtemp(prefix='bacanora-bench-', dir=args.dir)
+    try:
+        print('{:>10} {:>18} {:>12} {:>12}'.format('size', 'method', 'MB/s', 'cpu s/GB'))
+        for size in [parse_size(s) for s in args.sizes.split(',')]:
+            src = os.path.join(workdir, 'src')
+            dst = os.path.join(workdir, 'dst')
+            make_source(src, size, sparse=args.sparse)
+            for name, func in candidates:
+                wall, cpu = timed(func, src, dst, args.repeat)
+                print('{:>10} {:>18} {:>12.1f} {:>12.3f}'.format(
+                    size, name, size / wall / UNITS['M'],
+                    cpu / (size / UNITS['G'])))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
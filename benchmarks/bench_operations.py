@@ -0,0 +1,389 @@
+"""
+Latency and throughput of every public bacanora operation, offline
+
+Usage: python benchmarks/bench_operations.py [--sizes 64K,1M,16M] [--latency 0.02]
+           [--bandwidth 100M] [--error-rate 0.01] [--paths direct,api]
+           [--operations download,stat] [--json out.json] [--baseline old.json]
+
+Operations run against a local stand-in for the Agave files API (see
+standin.py) whose storage lives in a temporary directory. That directory
+is also registered as the POSIX prefix of the ``direct`` storage system,
+so calls there take the direct path; the ``api`` system has no prefix, so
+every call goes through the stand-in. Both systems hold the same files.
+
+Each row reports per-call latency percentiles, MB/s at the median for
+operations that move file contents, and how many API requests each call
+made. ``--json`` saves the rows, and ``--baseline`` compares the median
+latency of each row against a saved run.
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('BACANORA_LOG_LEVEL', 'WARNING')
+
+import bacanora
+from bacanora import circuitbreaker
+from bacanora import runtimes
+from bacanora import storagesystems
+
+from standin import FilesClient, FilesServer
+
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+SYSTEMS = {'direct': 'bench-direct', 'api': 'bench-api'}
+READ_SIZE = 1024 * 1024
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    if text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+def make_file(path, size, block=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    block = block or os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        written = 0
+        while written < size:
+            count = min(len(block), size - written)
+            f.write(block[:count])
+            written += count
+
+
+def reset_dir(path):
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return None
+    rank = int(math.ceil(fraction * len(values))) - 1
+    return values[max(0, min(len(values) - 1, rank))]
+
+
+class Case(object):
+    """One operation at one file size on one path
+
+    ``setup(i)`` prepares the ``i``th call outside the timed region and
+    returns the argument passed to ``run``.
+    """
+
+    def __init__(self, operation, path, size, run, setup=None, nbytes=0):
+        self.operation = operation
+        self.path = path
+        self.size = size
+        self.run = run
+        self.setup = setup
+        self.nbytes = nbytes
+
+
+class Bench(object):
+    """Fixtures shared by the cases of one storage system"""
+
+    def __init__(self, server, client, path, local_root, sizes, files,
+                 entries, workers):
+        self.server = server
+        self.client = client
+        self.path = path
+        self.system = SYSTEMS[path]
+        self.remote_root = os.path.join(server.root, self.system)
+        self.local = os.path.join(local_root, path)
+        self.sizes = sizes
+        self.files = files
+        self.entries = entries
+        self.workers = workers
+        self.counter = 0
+
+    def remote(self, agave_path):
+        return os.path.join(self.remote_root, agave_path.lstrip('/'))
+
+    def unique(self, prefix):
+        self.counter += 1
+        return '{}/{}'.format(prefix, self.counter)
+
+    def tree_paths(self, label):
+        """Agave paths of the files in the tree for one size"""
+        return ['/tree-{}/{}/f{:03d}.bin'.format(
+            label, ('a', 'b/c')[n % 2], n) for n in range(self.files)]
+
+    def populate(self, block):
+        for label, size in self.sizes:
+            make_file(self.remote('/data/{}.bin'.format(label)), size, block)
+            make_file(os.path.join(self.local, 'src', label,
+                                   '{}.bin'.format(label)), size, block)
+            for path in self.tree_paths(label):
+                make_file(self.remote(path), size, block)
+                make_file(os.path.join(self.local, 'tree', label,
+                                       *path.split('/')[2:]), size, block)
+        for n in range(self.entries):
+            make_file(self.remote('/list/e{:05d}.dat'.format(n)), 0)
+        os.makedirs(self.remote('/empty'), exist_ok=True)
+
+    def cases(self):
+        client, system, workers = self.client, self.system, self.workers
+        small = '/data/{}.bin'.format(self.sizes[0][0])
+        yield Case('stat', self.path, '-', lambda _: bacanora.stat(
+            client, small, system_id=system))
+        yield Case('exists', self.path, '-', lambda _: bacanora.exists(
+            client, small, system_id=system))
+        yield Case('exists-missing', self.path, '-', lambda _: bacanora.exists(
+            client, '/data/missing.bin', system_id=system))
+        yield Case('isfile', self.path, '-', lambda _: bacanora.isfile(
+            client, small, system_id=system))
+        yield Case('isdir', self.path, '-', lambda _: bacanora.isdir(
+            client, '/data', system_id=system))
+        yield Case('grant', self.path, '-', lambda _: bacanora.grant(
+            client, small, system_id=system))
+        yield Case('mkdir', self.path, '-', lambda path: bacanora.mkdir(
+            client, path, system_id=system),
+            setup=lambda _: self.unique('/mkdir'))
+
+        def doomed(_):
+            path = self.unique('/delete')
+            make_file(self.remote(path), 1)
+            return path
+        yield Case('delete', self.path, '-', lambda path: bacanora.delete(
+            client, path, system_id=system), setup=doomed)
+        yield Case('listdir', self.path, '-', lambda _: bacanora.listdir(
+            client, '/list', system_id=system))
+        yield Case('scandir', self.path, '-', lambda _: [
+            e.is_dir() for e in bacanora.scandir(client, '/list',
+                                                 system_id=system)])
+        yield Case('walk', self.path, '-', lambda _: list(bacanora.walk(
+            client, '/tree-{}'.format(self.sizes[0][0]), system_id=system)))
+        yield Case('makedirs_many', self.path, '-',
+                   lambda paths: bacanora.makedirs_many(
+                       client, paths, system_id=system, max_workers=workers),
+                   setup=lambda _: [self.unique('/makedirs') + '/x'
+                                    for _ in range(self.files)])
+
+        def doomed_many(_):
+            paths = [self.unique('/delete_many') for _ in range(self.files)]
+            for path in paths:
+                make_file(self.remote(path), 1)
+            return paths
+        yield Case('delete_many', self.path, '-',
+                   lambda paths: bacanora.delete_many(
+                       client, paths, system_id=system, max_workers=workers),
+                   setup=doomed_many)
+
+        for label, size in self.sizes:
+            for case in self.transfer_cases(label, size):
+                yield case
+
+    def transfer_cases(self, label, size):
+        client, system, workers = self.client, self.system, self.workers
+        remote_file = '/data/{}.bin'.format(label)
+        source = os.path.join(self.local, 'src', label, '{}.bin'.format(label))
+        local_tree = os.path.join(self.local, 'tree', label)
+        scratch = os.path.join(self.local, 'scratch')
+        total = size * self.files
+
+        def fresh_scratch(_):
+            reset_dir(scratch)
+            return os.path.join(scratch, '{}.bin'.format(label))
+        yield Case('download', self.path, label,
+                   lambda dest: bacanora.download(
+                       client, remote_file, local_filename=dest,
+                       system_id=system),
+                   setup=fresh_scratch, nbytes=size)
+
+        def fresh_remote(_):
+            reset_dir(self.remote('/upload'))
+            return '/upload'
+        yield Case('upload', self.path, label,
+                   lambda dest: bacanora.upload(
+                       client, source, dest, system_id=system),
+                   setup=fresh_remote, nbytes=size)
+
+        def read_all(_):
+            with bacanora.open(client, remote_file, system_id=system) as f:
+                while f.read(READ_SIZE):
+                    pass
+        yield Case('open', self.path, label, read_all, nbytes=size)
+
+        def download_pairs(_):
+            reset_dir(scratch)
+            return [(path, os.path.join(scratch, os.path.basename(path)))
+                    for path in self.tree_paths(label)]
+        yield Case('download_many', self.path, label,
+                   lambda pairs: bacanora.download_many(
+                       client, pairs, system_id=system, max_workers=workers),
+                   setup=download_pairs, nbytes=total)
+
+        def upload_pairs(_):
+            reset_dir(self.remote('/upload_many'))
+            return [(os.path.join(local_tree, *path.split('/')[2:]),
+                     '/upload_many') for path in self.tree_paths(label)]
+        yield Case('upload_many', self.path, label,
+                   lambda pairs: bacanora.upload_many(
+                       client, pairs, system_id=system, max_workers=workers),
+                   setup=upload_pairs, nbytes=total)
+
+        def tree_dest(_):
+            shutil.rmtree(scratch, ignore_errors=True)
+            return scratch
+        yield Case('download_tree', self.path, label,
+                   lambda dest: bacanora.download_tree(
+                       client, '/tree-{}'.format(label), dest,
+                       system_id=system, max_workers=workers),
+                   setup=tree_dest, nbytes=total)
+
+        def remote_tree(_):
+            shutil.rmtree(self.remote('/upload_tree'), ignore_errors=True)
+            return '/upload_tree'
+        yield Case('upload_tree', self.path, label,
+                   lambda dest: bacanora.upload_tree(
+                       client, local_tree, dest, system_id=system,
+                       max_workers=workers),
+                   setup=remote_tree, nbytes=total)
+
+
+def requests_seen(server):
+    with server.lock:
+        return sum(server.counts.values())
+
+
+def measure(server, case, repeat):
+    circuitbreaker.reset()
+    latencies, errors, last_error = [], 0, None
+    before = requests_seen(server)
+    for i in range(repeat):
+        arg = case.setup(i) if case.setup is not None else i
+        start = time.perf_counter()
+        try:
+            case.run(arg)
+        except Exception as exc:
+            errors += 1
+            last_error = '{}: {}'.format(type(exc).__name__, exc)
+            continue
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    p50 = percentile(latencies, 0.5)
+    return {'operation': case.operation,
+            'path': case.path,
+            'size': case.size,
+            'calls': repeat,
+            'errors': errors,
+            'error': last_error,
+            'p50': p50,
+            'p90': percentile(latencies, 0.9),
+            'max': latencies[-1] if latencies else None,
+            'mbps': case.nbytes / p50 / 1e6 if case.nbytes and p50 else None,
+            'requests': (requests_seen(server) - before) / repeat}
+
+
+def _seconds(value):
+    return '-' if value is None else '{:.4f}'.format(value)
+
+
+def row_key(row):
+    return (row['operation'], row['path'], row['size'])
+
+
+def print_row(row, baseline):
+    change = ''
+    old = baseline.get(row_key(row)) if baseline else None
+    if old and old.get('p50') and row['p50']:
+        change = '{:+.0%}'.format(row['p50'] / old['p50'] - 1)
+    print('{:<15} {:>6} {:>6} {:>5} {:>6} {:>9} {:>9} {:>9} {:>9} {:>9} {:>8}'
+          .format(row['operation'], row['path'], row['size'], row['calls'],
+                  row['errors'], _seconds(row['p50']), _seconds(row['p90']),
+                  _seconds(row['max']),
+                  '-' if row['mbps'] is None else '{:.1f}'.format(row['mbps']),
+                  '{:.1f}'.format(row['requests']), change))
+    sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='64K,1M,16M')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--files', type=int, default=8,
+                        help='Files per bulk and tree operation')
+    parser.add_argument('--entries', type=int, default=500,
+                        help='Entries in the listed directory')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Workers for bulk and tree operations')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='Seconds added to each API request')
+    parser.add_argument('--bandwidth', default='0',
+                        help='API bytes per second per connection, e.g. 100M')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of API requests failed with a 503')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--paths', default='direct,api')
+    parser.add_argument('--operations', default=None,
+                        help='Comma-separated operations to run [all]')
+    parser.add_argument('--dir', default=None)
+    parser.add_argument('--json', default=None, help='Save rows to a file')
+    parser.add_argument('--baseline', default=None,
+                        help='Compare against rows saved with --json')
+    args = parser.parse_args()
+
+    sizes = [(text.strip(), parse_size(text)) for text in args.sizes.split(',')]
+    paths = [p.strip() for p in args.paths.split(',')]
+    for path in paths:
+        if path not in SYSTEMS:
+            parser.error('Unknown path {}; choose from {}'.format(
+                path, ', '.join(SYSTEMS)))
+    wanted = set(args.operations.split(',')) if args.operations else None
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = {row_key(row): row for row in json.load(f)}
+
+    workdir = tempfile.mkdtemp(prefix='bacanora-bench-', dir=args.dir)
+    server = FilesServer(root=os.path.join(workdir, 'remote'),
+                         latency=args.latency,
+                         bandwidth=parse_size(args.bandwidth),
+                         error_rate=args.error_rate, seed=args.seed)
+    storagesystems.registry.register(SYSTEMS['direct'], runtimes.current(),
+                                     os.path.join(server.root,
+                                                  SYSTEMS['direct']))
+    rows = []
+    try:
+        server.start()
+        client = FilesClient(server)
+        block = os.urandom(1024 * 1024)
+        benches = [Bench(server, client, path, os.path.join(workdir, 'local'),
+                         sizes, args.files, args.entries, args.workers)
+                   for path in paths]
+        for bench in benches:
+            bench.populate(block)
+        print('{:<15} {:>6} {:>6} {:>5} {:>6} {:>9} {:>9} {:>9} {:>9} {:>9} {:>8}'
+              .format('operation', 'path', 'size', 'calls', 'errors',
+                      'p50 s', 'p90 s', 'max s', 'MB/s', 'reqs/call',
+                      'vs base' if baseline else ''))
+        for bench in benches:
+            for case in bench.cases():
+                if wanted is not None and case.operation not in wanted:
+                    continue
+                row = measure(server, case, args.repeat)
+                rows.append(row)
+                print_row(row, baseline)
+        failed = [row for row in rows if row['error']]
+        for row in failed:
+            print('{} on {} path failed: {}'.format(
+                row['operation'], row['path'], row['error']))
+        if server.injected:
+            print('{} API requests failed by injection'.format(server.injected))
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
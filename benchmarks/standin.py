@@ -0,0 +1,446 @@
+"""
+Local stand-in for the Agave files API, for offline benchmarks
+
+``FilesServer`` answers the files endpoints bacanora uses (media GET with
+ranges, importData, listings, manage, delete, pems and history) from a
+directory on disk, one subdirectory per storage system. Every request can
+be delayed, throttled to a bandwidth per connection, or failed with a 503
+at a given rate, so the API path can be measured under realistic and
+degraded conditions. ``FilesClient`` is just enough of an AgavePy client
+to drive it, including a nonce for bacanora's raw media requests.
+
+The same directory can be registered as a storage system's POSIX prefix,
+which lets one tree be reached over both the direct and the API path.
+"""
+import datetime
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RESOURCE = re.compile(r'^/files/v2/(?P<collection>\w+)/system/'
+                      r'(?P<system>[^/]+)(?P<path>/.*)?$')
+RANGE = re.compile(r'^bytes=(\d+)-(\d*)$')
+CHUNK = 64 * 1024
+NONCE = 'bacanora-bench'
+
+
+def timestamp(seconds):
+    """Agave's ISO-8601 form of a POSIX time"""
+    moment = datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc)
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + \
+        '{:03d}-00:00'.format(moment.microsecond // 1000)
+
+
+class Throttle(object):
+    """Pace a stream of bytes to at most ``rate`` bytes per second"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.start = time.monotonic()
+        self.sent = 0
+
+    def __call__(self, nbytes):
+        if not self.rate:
+            return
+        self.sent += nbytes
+        ahead = self.sent / self.rate - (time.monotonic() - self.start)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+class FilesServer(ThreadingMixIn, HTTPServer):
+    """Files API stand-in serving ``root/<system>/<path>``
+
+    Arguments:
+        root (str, optional): Directory holding one subdirectory per storage system; a temporary one by default
+        latency (float, optional): Seconds added before each response [0]
+        bandwidth (float, optional): Bytes per second per connection, 0 for unlimited [0]
+        error_rate (float, optional): Fraction of requests failed with a 503 [0]
+        seed (int, optional): Seed for error injection [None]
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, root=None, latency=0.0, bandwidth=0, error_rate=0.0,
+                 seed=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FilesHandler)
+        self._tempdir = None
+        if root is None:
+            root = self._tempdir = tempfile.mkdtemp(prefix='bacanora-standin-')
+        self.root = root
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # (method, collection) -> requests answered
+        self.counts = {}
+        self.injected = 0
+        # (system, path) -> {username: permission}
+        self.pems = {}
+        # (system, path) -> [history events]
+        self.history = {}
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address)
+
+    def local_path(self, system, path):
+        """Directory-backed location of an Agave path, confined to its system"""
+        base = os.path.join(self.root, system)
+        full = os.path.normpath(os.path.join(base, (path or '/').lstrip('/')))
+        if full != base and not full.startswith(base + os.sep):
+            raise ValueError('Path escapes storage system: {}'.format(path))
+        return full
+
+    def inject(self):
+        """Apply latency, then decide whether this request fails"""
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate:
+            with self.lock:
+                failed = self.random.random() < self.error_rate
+                if failed:
+                    self.injected += 1
+            return failed
+        return False
+
+    def event(self, system, path, status):
+        with self.lock:
+            self.history.setdefault((system, path), []).append(
+                {'status': status, 'created': timestamp(time.time()),
+                 'description': status.lower()})
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        name='bacanora-standin', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._tempdir is not None:
+            shutil.rmtree(self._tempdir, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class FilesHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # Headers and body go out in separate writes; without this, delayed
+        # ACKs add tens of milliseconds to every small response
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _error(self, status, message):
+        self._json(status, {'status': 'error', 'message': message,
+                            'version': 'standin'})
+
+    def _success(self, result):
+        self._json(200, {'status': 'success', 'message': None,
+                         'version': 'standin', 'result': result})
+
+    def _body(self, throttle=None):
+        """Yield the request body in chunks, paced by ``throttle``"""
+        remaining = int(self.headers.get('Content-Length') or 0)
+        while remaining > 0:
+            chunk = self.rfile.read(min(CHUNK, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            if throttle is not None:
+                throttle(len(chunk))
+            yield chunk
+
+    def _json_body(self):
+        raw = b''.join(self._body())
+        try:
+            return json.loads(raw.decode('utf-8')) if raw else {}
+        except ValueError:
+            return None
+
+    def _dispatch(self):
+        server = self.server
+        url = urlsplit(self.path)
+        self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        match = RESOURCE.match(url.path)
+        if match is None:
+            for _ in self._body():
+                pass
+            return self._error(404, 'No such endpoint: {}'.format(url.path))
+        collection = match.group('collection')
+        with server.lock:
+            key = (self.command, collection)
+            server.counts[key] = server.counts.get(key, 0) + 1
+        if 'x-nonce' not in self.query and \
+                not self.headers.get('Authorization'):
+            for _ in self._body():
+                pass
+            return self._error(401, 'Missing credentials')
+        if server.inject():
+            # Drain the body so the client sees the 503, not a reset
+            for _ in self._body():
+                pass
+            return self._error(503, 'Injected failure')
+        self.system = match.group('system')
+        self.agave_path = '/' + unquote(match.group('path') or '/').strip('/')
+        try:
+            self.local = server.local_path(self.system, self.agave_path)
+        except ValueError as exc:
+            return self._error(400, str(exc))
+        handler = getattr(self, '_{}_{}'.format(self.command.lower(),
+                                                collection), None)
+        if handler is None:
+            for _ in self._body():
+                pass
+            return self._error(405, '{} not supported on {}'.format(
+                self.command, collection))
+        try:
+            handler()
+        except FileNotFoundError:
+            self._error(404, 'File/folder does not exist')
+        except OSError as exc:
+            self._error(500, str(exc))
+
+    do_GET = do_PUT = do_POST = do_DELETE = _dispatch
+
+    def _agave(self, path):
+        relative = os.path.relpath(path, os.path.join(self.server.root,
+                                                      self.system))
+        return '/' + ('' if relative == os.curdir else
+                      relative.replace(os.sep, '/'))
+
+    def _entry(self, name, path, st):
+        is_dir = os.path.isdir(path)
+        return {'name': name,
+                'path': self._agave(path),
+                'system': self.system,
+                'type': 'dir' if is_dir else 'file',
+                'format': 'folder' if is_dir else 'raw',
+                'mimeType': 'text/directory' if is_dir
+                else 'application/octet-stream',
+                'length': 0 if is_dir else st.st_size,
+                'lastModified': timestamp(st.st_mtime),
+                'permissions': 'ALL'}
+
+    def _get_listings(self):
+        st = os.stat(self.local)
+        if not os.path.isdir(self.local):
+            entries = [self._entry(os.path.basename(self.local), self.local, st)]
+        else:
+            entries = [self._entry('.', self.local, st)]
+            with os.scandir(self.local) as it:
+                children = sorted(it, key=lambda e: e.name)
+            for child in children:
+                entries.append(self._entry(child.name, child.path,
+                                           child.stat()))
+        offset = int(self.query.get('offset') or 0)
+        limit = int(self.query.get('limit') or 100)
+        self._success(entries[offset:offset + limit])
+
+    def _get_media(self):
+        if os.path.isdir(self.local):
+            return self._error(400, 'Folder downloads are not supported')
+        with open(self.local, 'rb') as f:
+            st = os.fstat(f.fileno())
+            size = st.st_size
+            start, end, status = 0, size - 1, 200
+            match = RANGE.match(self.headers.get('Range') or '')
+            if match:
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(end, int(match.group(2)))
+                if start >= size:
+                    self.send_response(416)
+                    self.send_header('Content-Range', 'bytes */{}'.format(size))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                status = 206
+            length = max(0, end - start + 1)
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(length))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Last-Modified', self.date_time_string(
+                st.st_mtime))
+            self.send_header('ETag', '"{}-{}"'.format(size, int(st.st_mtime)))
+            if status == 206:
+                self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                    start, end, size))
+            self.end_headers()
+            f.seek(start)
+            throttle = Throttle(self.server.bandwidth)
+            while length > 0:
+                chunk = f.read(min(CHUNK, length))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                length -= len(chunk)
+                throttle(len(chunk))
+
+    def _post_media(self):
+        # importData: the stand-in client sends the file as the raw body
+        name = self.query.get('fileName')
+        if not name:
+            for _ in self._body():
+                pass
+            return self._error(400, 'fileName is required')
+        destination = os.path.join(self.local, os.path.basename(name))
+        os.makedirs(self.local, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=self.local, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in self._body(Throttle(self.server.bandwidth)):
+                    f.write(chunk)
+            os.rename(temp, destination)
+        except Exception:
+            os.unlink(temp)
+            raise
+        path = self.agave_path.rstrip('/') + '/' + os.path.basename(name)
+        self.server.event(self.system, path, 'STAGING_QUEUED')
+        self.server.event(self.system, path, 'TRANSFORMING_COMPLETED')
+        self._success(self._entry(os.path.basename(destination), destination,
+                                  os.stat(destination)))
+
+    def _put_media(self):
+        body = self._json_body()
+        if not body or body.get('action') != 'mkdir' or not body.get('path'):
+            return self._error(400, 'Only the mkdir action is supported')
+        target = self.server.local_path(
+            self.system, self.agave_path.rstrip('/') + '/' + body['path'])
+        os.makedirs(target, exist_ok=True)
+        self.server.event(self.system, self._agave(target), 'CREATED')
+        self._success(self._entry(os.path.basename(target), target,
+                                  os.stat(target)))
+
+    def _delete_media(self):
+        if os.path.isdir(self.local) and not os.path.islink(self.local):
+            shutil.rmtree(self.local)
+        else:
+            os.unlink(self.local)
+        self._success({})
+
+    def _post_pems(self):
+        body = self._json_body()
+        if not body or 'username' not in body or 'permission' not in body:
+            return self._error(400, 'username and permission are required')
+        os.stat(self.local)
+        with self.server.lock:
+            self.server.pems.setdefault(
+                (self.system, self.agave_path), {})[body['username']] = \
+                body['permission']
+        self._success([{'username': body['username'],
+                        'permission': body['permission']}])
+
+    def _get_history(self):
+        st = os.stat(self.local)
+        events = self.server.history.get((self.system, self.agave_path))
+        if not events:
+            events = [{'status': 'CREATED', 'created': timestamp(st.st_mtime),
+                       'description': 'created'}]
+        self._success(list(events))
+
+
+class FilesAPI(object):
+    """The ``files`` service of ``FilesClient``, with AgavePy's signatures"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def _url(self, collection, systemId, filePath):
+        return '{}/files/v2/{}/system/{}/{}'.format(
+            self.client.api_server, collection, systemId,
+            requests.utils.quote(filePath.lstrip('/')))
+
+    def _call(self, method, collection, systemId, filePath, params=None,
+              **kwargs):
+        query = {'x-nonce': self.client.nonce}
+        query.update(params or {})
+        rsp = self.client.session.request(
+            method, self._url(collection, systemId, filePath), params=query,
+            **kwargs)
+        rsp.raise_for_status()
+        return rsp
+
+    def _result(self, *args, **kwargs):
+        return self._call(*args, **kwargs).json().get('result')
+
+    def download(self, systemId, filePath):
+        return self._call('GET', 'media', systemId, filePath, stream=True)
+
+    def importData(self, systemId, filePath, fileToUpload, fileName=None):
+        name = fileName or os.path.basename(fileToUpload.name)
+        with fileToUpload:
+            return self._result('POST', 'media', systemId, filePath,
+                                params={'fileName': name}, data=fileToUpload)
+
+    def list(self, systemId, filePath, limit=None, offset=None):
+        params = {}
+        if limit is not None:
+            params['limit'] = limit
+        if offset is not None:
+            params['offset'] = offset
+        return self._result('GET', 'listings', systemId, filePath,
+                            params=params)
+
+    def manage(self, systemId, filePath, body):
+        return self._result('PUT', 'media', systemId, filePath, json=body)
+
+    def delete(self, systemId, filePath):
+        return self._result('DELETE', 'media', systemId, filePath)
+
+    def updatePermissions(self, systemId, filePath, body):
+        return self._result('POST', 'pems', systemId, filePath, json=body)
+
+    def getHistory(self, systemId, filePath):
+        return self._result('GET', 'history', systemId, filePath)
+
+
+class FilesClient(object):
+    """Just enough of an AgavePy client to drive ``FilesServer``
+
+    Arguments:
+        server (FilesServer): The stand-in to talk to
+        pool_size (int, optional): Connections kept per host [32]
+    """
+    token = None
+
+    def __init__(self, server, pool_size=32):
+        self.api_server = server.url
+        self.nonce = NONCE
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.files = FilesAPI(self)
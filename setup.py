@@ -76,6 +76,10 @@ setup(
     url="https://github.com/SD2E/bacanora",
     install_requires=get_requirements(),
     tests_require=get_requirements()+['hashids'],
+    extras_require={'aio': ['aiohttp>=3.6']},
+    entry_points={
+        'console_scripts': ['bacanora-trace=bacanora.trace:main'],
+    },
     dependency_links=get_links(),
     packages=find_packages(),
     license="BSD",